@@ -1,18 +1,41 @@
-import copy
+import contextlib
 import os
-import pdb
 import random
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from boto3 import dynamodb
-from boto3.dynamodb.conditions import Key
-from boto3.dynamodb.types import STRING, NUMBER
-from botocore.exceptions import WaiterError
-import fire
+from my_aws_py_base import _fast_fire, _get_boto_client, _get_boto_resource, on_env_loaded
+from dynamodb_bulk import BulkStats, bulk_get, bulk_write
+from dynamodb_cache import cached_query, invalidate_item
+from dynamodb_query import paginated_query
+import dynamodb_ratelimit  # enables client-side rate limiting when ddb_rate_limit is set
+from dynamodb_scan import parallel_scan
+from dynamodb_shard import get_sharding, sharded_delete, sharded_get, sharded_put, sharded_query, sharded_update
+from dynamodb_waiter import WaitTimeout, describe_table, get_status, poll_delays, wait_for
+from dynamodb_writebehind import buffered_get_item, get_write_behind, write_behind
 
-from my_aws_py_base import _get_boto_client, _get_boto_resource
+
+def _memory_backend_from_env():
+    # ddb_backend=memory runs every command against an empty in-process DynamoDB (see dynamodb_memory).
+    if os.getenv('ddb_backend') == 'memory':
+        import dynamodb_memory
+        dynamodb_memory.enable_memory_backend()
+
+
+on_env_loaded(_memory_backend_from_env)
+
+
+def _sync_tracking_from_env():
+    # e.g. ddb_sync_track=/var/lib/sync/music.json journals the writes of this process for
+    # `sync_tables --checkpoint /var/lib/sync/music.json` (see dynamodb_sync.track_changes).
+    checkpoint = os.getenv('ddb_sync_track')
+    if checkpoint:
+        import dynamodb_sync
+        dynamodb_sync.track_changes(checkpoint)
+
+
+on_env_loaded(_sync_tracking_from_env)
 
 
 def get_default_table_name():
@@ -24,23 +47,26 @@ def get_table_name():
 
 
 def _query_by_artist_songtitle(ddb_table, index_name, artist, song_title):
-    response = ddb_table.query(
+    from boto3.dynamodb.conditions import Key
+    return cached_query(
+        ddb_table,
         IndexName=index_name,
         KeyConditionExpression=Key('Artist').eq(artist)
     )
-    return response['Items']
 
 
 def _query_by_length_awards(ddb_table, index_name, lengths, awards):
-    response = ddb_table.query(
+    from boto3.dynamodb.conditions import Key
+    return cached_query(
+        ddb_table,
         IndexName=index_name,
         KeyConditionExpression=Key('Length').eq(lengths[0]) & Key('Awards').eq(awards[0])
     )
-    return response['Items']
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def create_table(table_name=f'{get_table_name()}', delay=1, max_attempts=10):
+    from boto3.dynamodb.types import STRING
     #ddb = _get_boto_resource('dynamodb')
     ddb = _get_boto_client('dynamodb')
     ddb.create_table(
@@ -75,97 +101,191 @@ def recreate_table(table_name=f'{get_table_name()}', delay=None, max_attempts=No
     create_table(table_name, None, None)
 
 
+def provision_tables(tables=f'{get_table_name()},{get_default_table_name()}', action='ensure', spec=None,
+                     rate=10.0, timeout=900):
+    # spec: a JSON file (see dynamodb_provision.load_spec); by default every table gets the music table spec.
+    import dynamodb_provision
+    if spec is None:
+        names = tables.split(',') if isinstance(tables, str) else list(tables)
+        spec = {name: dynamodb_provision.MUSIC_TABLE_SPEC for name in names}
+    started_at = time.perf_counter()
+    summary = dynamodb_provision.provision(spec, action, rate=rate, timeout=timeout)
+    for name, entries in summary.items():
+        if entries:
+            print(f'{name.capitalize()}: {", ".join(entries)}')
+    print(f'Provisioned ({action}) in {time.perf_counter() - started_at:.1f}s')
+
+
+def truncate_table(table_name=f'{get_table_name()}', total_segments=4):
+    import dynamodb_provision
+    deleted = dynamodb_provision.truncate_table(table_name, total_segments)
+    print(f'Table ({table_name}) is truncated! Deleted {deleted} item(s).')
+
+
+def sync_tables(source=f'{get_default_table_name()}', target=f'{get_table_name()}', apply=False, buckets=256,
+                total_segments=4, verbose=False, checkpoint=None, full=False):
+    # Without --apply only prints the drift; with it, makes target equal to source. With --checkpoint
+    # a re-run only reads what writers tracked with ddb_sync_track=<checkpoint> changed (--full rescans).
+    import dynamodb_sync
+    diff = dynamodb_sync.diff_tables(source, target, buckets, total_segments, checkpoint=checkpoint, full=full)
+    print(f'Diff ({source} -> {target}): {diff}')
+    if verbose:
+        for item in diff.puts:
+            print(f'put    {item}')
+        for key in diff.deletes:
+            print(f'delete {key}')
+    if apply and diff:
+        put_stats, delete_stats = dynamodb_sync.apply_diff(diff)
+        print(f'Table ({target}) synced: puts {put_stats}; deletes {delete_stats}')
+
+
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def put_item(table_name=f'{get_table_name()}'):
     table = _get_boto_resource('dynamodb').Table(table_name)
     length = int(random.random() * 100)
-    resp = table.put_item(
-                Item = {
-                    "Artist": "No One You Know",
-                    "SongTitle": "Call Me Today",
-                    "AlbumTitle": "Greatest Hits",
-                    "Length": length,
-                    "Awards": 1,
-                }
-            )
+    item = {
+        "Artist": "No One You Know",
+        "SongTitle": "Call Me Today",
+        "AlbumTitle": "Greatest Hits",
+        "Length": length,
+        "Awards": 1,
+    }
+    if get_sharding(table_name):
+        print(sharded_put(table, item))
+        return
+    buffer = get_write_behind()
+    if buffer is not None:
+        buffer.put(table_name, item)
+        print(f'Buffered put: {item}')
+        return
+    resp = table.put_item(Item=item)
+    invalidate_item(table_name, item)
     print(resp)
 
 
+def _song_items(amount, start=1):
+    for i in range(start, start + amount):
+        yield {
+            "Artist": f"No One You Know-{i}",
+            "SongTitle": f"Call Me Today-{i}",
+            "AlbumTitle": f"Greatest Hits-{i}",
+            "Length": int(random.random() * 100),
+            "Awards": int(random.random() * 2),
+        }
+
+
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
-def batch_write(table_name=f'{get_table_name()}', amount=100):
-    table = _get_boto_resource('dynamodb').Table(table_name)
-    Item = {
-        "Artist": "No One You Know-0",
-        "SongTitle": "Call Me Today-0",
-        "AlbumTitle": "Greatest Hits-0",
-        "Length": 0,
-        "Awards": 0,
-    }
-    with table.batch_writer() as batch:
-        for i in range(1, amount+1):
-            item = copy.deepcopy(Item)
-            item['Artist'] = item['Artist'][0:-1] + str(i)
-            item['SongTitle'] = item['SongTitle'][0:-1] + str(i)
-            item['AlbumTitle'] = item['AlbumTitle'][0:-1] + str(i)
-            item['Length']  = int(random.random() * 100)
-            item['Awards']  = int(random.random() * 2)
-            batch.put_item(Item=item)
+def batch_write(table_name=f'{get_table_name()}', amount=100, concurrency=8):
+    stats = bulk_write(table_name, _song_items(amount), concurrency=concurrency)
+    print(f'Table ({table_name}) batch write: {stats}')
 
 
 # If the data type of the sort key is Number, the results are returned in numeric order;
 # otherwise, the results are returned in order of UTF-8 bytes.
 # By default, the sort order is ascending.
-def query_GSI_top_N_items(table_name=f'{get_default_table_name()}', top=3, asc=True):
+def query_GSI_top_N_items(table_name=f'{get_default_table_name()}', top=3, asc=True, album_titles=None, concurrency=16):
+    from boto3.dynamodb.conditions import Key
     table = _get_boto_resource('dynamodb').Table(table_name)
     index_name = 'AlbumTitle-Length-index'
     print(f'Table Name={table_name}, Top={top}, Ascending={asc}: ')
-    resp = table.query(
+    if album_titles:
+        # Top N across many albums: one query per album, merged as pages arrive.
+        from dynamodb_topn import TopNStats, top_n
+        stats = TopNStats()
+        items = top_n(table_name, album_titles, top, index_name=index_name, ascending=asc, concurrency=concurrency,
+                      stats=stats)
+        for item in items:
+            print(item['AlbumTitle'], item['Artist'], item['Length'])
+        print(f'Top N: {stats}')
+        return
+    items = cached_query(
+                table,
+                limit=top,
                 IndexName=index_name,
                 KeyConditionExpression=Key('AlbumTitle').eq('Album Title'),
-                Limit=top,
                 ScanIndexForward=asc
             )
-    for item in resp['Items']:
+    for item in items:
         print(item['Artist'], item['Length'])
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def get_item(idx=1, table_name=f'{get_table_name()}'):
     table = _get_boto_resource('dynamodb').Table(table_name)
-    resp = table.get_item(
-                Key={
-                        'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
-                        'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
-                    }
-            )
-    print(resp['Item'])
+    key = {
+        'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
+        'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
+    }
+    item = sharded_get(table, key) if get_sharding(table_name) else buffered_get_item(table, key)
+    print(item)
+
+
+def batch_get_item(start=1, amount=100, table_name=f'{get_table_name()}', projection=None, ordered=True, concurrency=8):
+    keys = ({
+                'Artist': f'No One You Know-{idx}',
+                'SongTitle': f'Call Me Today-{idx}',
+            } for idx in range(start, start + amount))
+    stats = BulkStats()
+    for key, item in bulk_get(table_name, keys, concurrency=concurrency, ordered=ordered, projection=projection, stats=stats):
+        print(item if item is not None else f'Not found: {key}')
+    print(f'Table ({table_name}) batch get: {stats}')
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
-def scan_table(table_name=f'{get_table_name()}'):
-    from boto3.dynamodb.conditions import Key, Attr
-    table = _get_boto_resource('dynamodb').Table(table_name)
-    resp1 = table.scan()
-    resp2 = table.scan(FilterExpression=Attr('Length').eq(1) & Attr('Awards').eq(1))
+def scan_table(table_name=f'{get_table_name()}', total_segments=4, max_workers=None):
+    from boto3.dynamodb.conditions import Attr
     print(f'''
 Full table scan:
-{'-' * 24}
-{resp1['Items']}
-{'=' * 24}
+{'-' * 24}''')
+    for item in parallel_scan(table_name, total_segments, max_workers):
+        print(item)
+    print(f'''{'=' * 24}
 The query returned the following items:
-{'-' * 24}
-{resp2['Items']}
-''')
+{'-' * 24}''')
+    for item in parallel_scan(table_name, total_segments, max_workers,
+                              FilterExpression=Attr('Length').eq(1) & Attr('Awards').eq(1)):
+        print(item)
+
+
+def scan_column_stats(table_name=f'{get_table_name()}', attributes='Length,Awards', categorical='AlbumTitle', total_segments=4):
+    from dynamodb_columnar import column_stats, scan_columns
+    attributes = attributes.split(',') if isinstance(attributes, str) else list(attributes)
+    categorical = (categorical.split(',') if isinstance(categorical, str) else list(categorical or [])) or []
+    columns = scan_columns(table_name, attributes + categorical, categorical, total_segments)
+    for attr in attributes:
+        stats = column_stats(columns[attr])
+        if 'mean' in stats:
+            print(f'{attr}: count={stats["count"]} min={stats["min"]} max={stats["max"]} mean={stats["mean"]:.3f}')
+        else:
+            print(f'{attr}: count={stats["count"]}')
+    for attr in categorical:
+        print(f'{attr}: {len(columns[attr].categories)} distinct value(s)')
+
+
+def aggregate_table(table_name=f'{get_table_name()}', aggregates='count,sum:Awards,avg:Length,hist:Length:10',
+                    group_by=None, where=None, total_segments=4):
+    # e.g. --aggregates=count,hist:Length:10 --group_by=AlbumTitle --where="{'Awards': 1}"
+    from dynamodb_aggregate import aggregate, filter_kwargs
+    result = aggregate(table_name, aggregates, group_by, total_segments, **filter_kwargs(where))
+    for group, values in result.results().items():
+        label = ', '.join(str(v) for v in group) or 'all'
+        print(f'{label}: ' + ', '.join(f'{name}={value}' for name, value in values.items()))
+    print(f'Table ({table_name}) aggregated {len(result.groups)} group(s) over {result.items} item(s)')
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def update_item(idx=None, value=99, table_name=f'{get_table_name()}'):
     table = _get_boto_resource('dynamodb').Table(table_name)
-    resp = table.update_item(
-                Key={
-                    'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
-                    'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
-                },
+    key = {
+        'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
+        'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
+    }
+    buffer = get_write_behind()
+    if buffer is not None and not get_sharding(table_name):
+        buffer.update(table_name, key, {'Length': value, 'Awards': value})
+        print(f'Buffered update: {key}')
+        return
+    update_kwargs = dict(
                 ExpressionAttributeNames={
                     "#length": 'Length',
                     "#awards": 'Awards',
@@ -176,36 +296,80 @@ def update_item(idx=None, value=99, table_name=f'{get_table_name()}'):
                 },
                 UpdateExpression='SET #length = :length, #awards = :awards',
             )
+    if get_sharding(table_name):
+        print(sharded_update(table, key, **update_kwargs))
+        return
+    resp = table.update_item(Key=key, **update_kwargs)
+    invalidate_item(table_name, key)
     print(resp)
 
 
+def update_hot_item(times=100, idx=None, max_delay=0.5, durability='async', concurrency=8,
+                    table_name=f'{get_table_name()}'):
+    # Only the updates made here are buffered; the buffer is flushed and disabled again on return.
+    with write_behind(max_delay=max_delay, durability=durability) as buffer:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(lambda value: update_item(idx, value, table_name), range(times)))
+        buffer.flush()
+        print(f'Table ({table_name}) hot item updates: {buffer.stats()}')
+    get_item(idx, table_name)
+
+
+def detect_hot_keys(amount=1000, concurrency=8, sample_rate=1.0, partition_wcu=1000, table_name=f'{get_table_name()}'):
+    # Samples a skewed workload: `amount` put_item calls on one artist next to a batch_write spread over many.
+    from dynamodb_shard import enable_write_sampling, print_hot_keys
+    sampler = enable_write_sampling(sample_rate)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda _: put_item(table_name), range(amount)))
+        batch_write(table_name, amount, concurrency)
+    print(f'Table ({table_name}) hot keys from {sampler.samples} sampled write(s):')
+    print_hot_keys(sampler, partition_wcu)
+
+
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def delete_item(idx=None, table_name=f'{get_table_name()}'):
     table = _get_boto_resource('dynamodb').Table(table_name)
-    resp = table.delete_item(
-                Key={
-                    'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
-                    'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
-                },
-            )
+    key = {
+        'Artist': 'No One You Know' if idx is None else f'No One You Know-{idx}',
+        'SongTitle': 'Call Me Today' if idx is None else f'Call Me Today-{idx}',
+    }
+    if get_sharding(table_name):
+        print(sharded_delete(table, key))
+        return
+    buffer = get_write_behind()
+    if buffer is not None:
+        buffer.discard(table_name, key)
+    resp = table.delete_item(Key=key)
+    invalidate_item(table_name, key)
     print(resp)
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
-def query_table(table_name=f'{get_table_name()}'):
+def query_table(table_name=f'{get_table_name()}', limit=None, cursor=None, prefetch=True):
+    from boto3.dynamodb.conditions import Key
     table = _get_boto_resource('dynamodb').Table(table_name)
     #resp = table.query(KeyConditionExpression=Key('Artist').eq('No One You Know-1') & Key('SongTitle').eq('Call Me Today-1'))
-    resp = table.query(KeyConditionExpression=Key('Artist').eq('No One You Know-1') & Key('SongTitle').begins_with('Call Me Today'))
+    if get_sharding(table_name):
+        # One query per shard, merged; a merged read has no single cursor to resume from.
+        items = list(sharded_query(table, 'No One You Know-1', Key('SongTitle').begins_with('Call Me Today'), limit=limit))
+    else:
+        items = paginated_query(table, limit=limit, cursor=cursor, prefetch=prefetch,
+                                KeyConditionExpression=Key('Artist').eq('No One You Know-1') & Key('SongTitle').begins_with('Call Me Today'))
     print(f'''
 Query: KeyConditionExpression=Key('Artist').eq('No One You Know') & Key('SongTitle').eq('Call Me Today')
 The query returned the following items:
-{'-' * 24}
-{resp['Items']}
-''')
+{'-' * 24}''')
+    for item in items:
+        print(item)
+    if getattr(items, 'cursor', None):
+        print(f'Next cursor: {items.cursor}')
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def create_global_secondary_index(index_name=None, table_name=f'{get_table_name()}'):
+    from boto3.dynamodb.types import NUMBER
     ddb = _get_boto_client('dynamodb')
     attr_name = 'Length'
     attr_type = NUMBER
@@ -257,16 +421,9 @@ def delete_global_secondary_index(index_name=None, table_name=f'{get_table_name(
     print(resp)
 
 
-def __checking_global_secondary_index(table_name=f'{get_table_name()}'):
-    table = _get_boto_resource('dynamodb').Table(table_name)
-    time.sleep(5)
-    while True:
-        if table.global_secondary_indexes and table.global_secondary_indexes[0]['IndexStatus'] == 'ACTIVE':
-            print(f'Global Secondary Index ({table.global_secondary_indexes[0]["IndexName"]}) is created!')
-            break
-        print('Waiting for index to backfill...')
-        time.sleep(5)
-        table.reload()
+def __checking_global_secondary_index(table_name=f'{get_table_name()}', timeout=600):
+    wait_for([(table_name, '*', 'active')], timeout=timeout)
+    print(f'Global Secondary Index ({table_name}) is created!')
 
 
 def check_global_secondary_index(status=None, index_name=None, table_name=f'{get_table_name()}', table=None):
@@ -281,18 +438,23 @@ def check_global_secondary_index(status=None, index_name=None, table_name=f'{get
         return not any(gsi for gsi in table.global_secondary_indexes or [] if gsi.get('IndexName') == index_name)
 
 
-def show_global_secondary_index_status(index_name=None, table_name=f'{get_table_name()}', table=None):
+def show_global_secondary_index_status(index_name=None, table_name=f'{get_table_name()}', table=None, timeout=600):
+    # `table` (a boto3 Table) is an alias of table_name, kept for existing callers.
+    if table is not None:
+        table_name = table.name
     attr_name = 'Length'
     index_name = index_name or table_name + '-' + attr_name + '-global-secondary-index'
-    table = table or _get_boto_resource('dynamodb').Table(table_name)
-    while True:
-        indexes = [gsi for gsi in table.global_secondary_indexes if gsi.get('IndexName') == index_name]
-        if not len(indexes):
+    deadline = time.monotonic() + timeout
+    for delay in poll_delays():
+        status = get_status(describe_table(table_name), index_name)
+        if status is None:
             return
-        index = indexes[0]
-        print(f'Index status: {index.get("IndexStatus")}')
-        time.sleep(5)
-        table.reload()
+        print(f'Index status: {status}')
+        if status == 'ACTIVE':
+            return
+        if time.monotonic() + delay > deadline:
+            raise WaitTimeout(f'Timed out after {timeout}s showing GSI ({index_name}) status')
+        time.sleep(delay)
 
 
 def get_global_secondary_index_status(index_name=None, table_name=f'{get_table_name()}', table=None):
@@ -305,18 +467,10 @@ def get_global_secondary_index_status(index_name=None, table_name=f'{get_table_n
     return indexes[0].get('IndexStatus')
 
 
-def wait_global_secondary_index(waiter=None, index_name=None, table_name=f'{get_table_name()}'):
+def wait_global_secondary_index(waiter=None, index_name=None, table_name=f'{get_table_name()}', timeout=600):
     valid_waiters = ['active', 'exists', 'not_exists']
     assert(waiter in valid_waiters and index_name and table_name)
-    table = _get_boto_resource('dynamodb').Table(table_name)
-    while True:
-        if check_global_secondary_index(waiter, index_name, table_name, table):
-            break
-        #status = get_global_secondary_index_status(index_name, table_name, table)
-        #print(f'Wait GSI ({index_name}) being {waiter}...')
-        print(f'Wait GSI ({index_name}) being {waiter}... ({get_global_secondary_index_status(index_name, table_name, table)})')
-        time.sleep(5)
-        table.reload()
+    wait_for([(table_name, index_name, waiter)], timeout=timeout)
 
 
 def recreate_global_secondary_index(index_name=None, table_name=f'{get_table_name()}'):
@@ -329,22 +483,33 @@ def recreate_global_secondary_index(index_name=None, table_name=f'{get_table_nam
     wait_global_secondary_index('active', index_name, table_name)
 
 
+def wait_resources(*resources, status='exists', timeout=600):
+    '''
+    Wait concurrently on many tables and GSIs, e.g.
+        wait_resources music-default music-test music-test/AlbumTitle-Length-index --status=exists
+    '''
+    table_status = {'exists': 'table_exists', 'active': 'table_exists', 'not_exists': 'table_not_exists'}[status]
+    targets = []
+    for resource in resources:
+        table_name, _, index_name = resource.partition('/')
+        targets.append((table_name, index_name, status) if index_name else (table_name, None, table_status))
+    wait_for(targets, timeout=timeout)
+    print(f'{", ".join(resources)} {"are" if len(resources) > 1 else "is"} {status}!')
+
+
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
 def query_global_secondary_index(index_name=None, table_name=f'{get_table_name()}'):
+    from boto3.dynamodb.conditions import Key
     table = _get_boto_resource('dynamodb').Table(table_name)
     attr_name = 'Length'
     index_name = index_name or table_name + '-' + attr_name + '-global-secondary-index'
-    #pdb.set_trace()
+    #import pdb; pdb.set_trace()
 
-    while True:
-        if not table.global_secondary_indexes or table.global_secondary_indexes[0]['IndexStatus'] != 'ACTIVE':
-            print('Waiting for index to backfill...')
-            time.sleep(5)
-            table.reload()
-        else:
-            break
+    wait_for([(table_name, index_name, 'active')])
 
-    resp = table.query(
+    items = paginated_query(
+            table,
+            prefetch=True,
             IndexName=index_name,
             KeyConditionExpression=Key(attr_name).eq(1),
         )
@@ -352,9 +517,9 @@ def query_global_secondary_index(index_name=None, table_name=f'{get_table_name()
     print(f'''
 Query: KeyConditionExpression=Key("{attr_name}").eq(1)
 The query returned the following items:
-{"-" * 24}
-{resp["Items"]}
-''')
+{"-" * 24}''')
+    for item in items:
+        print(item)
 
 
 # https://hands-on.cloud/working-with-dynamodb-in-python-using-boto3/#h-connecting-to-dynamodb-apis-using-boto3
@@ -367,6 +532,15 @@ def backup_table(table_name=f'{get_table_name()}', backup_table_name=f'{get_tabl
     print(resp)
 
 
+def export_table(table_name=f'{get_table_name()}', output_dir='export', fmt='jsonl', total_segments=8,
+                 compression='gzip', attributes=None, plain=False, resume=True):
+    import dynamodb_export
+    manifest = dynamodb_export.export_table(table_name, output_dir, fmt, total_segments, compression=compression,
+                                            attributes=attributes, plain=plain, resume=resume)
+    print(f'Table ({table_name}) export to {output_dir}: items={manifest["items"]}, shards={len(manifest["shards"])}, '
+          f'done={manifest["done"]}')
+
+
 def query(table_name=f'{get_default_table_name()}'):
     idx=10
     artist= f'Artist_{idx}'
@@ -375,8 +549,7 @@ def query(table_name=f'{get_default_table_name()}'):
     awards=[1, 10]
     index_name_1='Artist-SongTitle-index'
     index_name_2='Length-Awards-index'
-    ddb_client = boto3.resource('dynamodb')
-    ddb_table = ddb_client.Table(table_name)
+    ddb_table = _get_boto_resource('dynamodb').Table(table_name)
     albums = _query_by_artist_songtitle(ddb_table, index_name_1, artist, song_title) or dict()
     if not albums:
         print(f'No data found!')
@@ -385,11 +558,44 @@ def query(table_name=f'{get_default_table_name()}'):
         print('|'.join(str(v) for v in album.values()))
 
 
+def plan_query(where, table_name=f'{get_table_name()}', attributes=None, consistent=False, limit=None, explain=False):
+    # e.g. plan_query "{'Artist': 'No One You Know-1', 'Length': ['between', 1, 10]}" --explain=True
+    import dynamodb_planner
+    plan = dynamodb_planner.plan(table_name, where, attributes, consistent)
+    print(plan.explain())
+    if explain:
+        return
+    print('-' * 24)
+    for item in plan.execute(limit=limit):
+        print(item)
+
+
+def load_test(table_name=f'{get_table_name()}', mix='get:50,put:20,update:10,query:15,transact:5', rate=None,
+              concurrency=32, processes=None, duration=30, key_space=10000, zipf=1.1, report_interval=1.0, seed=None,
+              output=None):
+    # Open loop with --rate (requests/s in total), closed loop with --concurrency otherwise.
+    import dynamodb_loadgen
+    mode = f'open loop at {rate}/s' if rate else f'closed loop at concurrency {concurrency}'
+    print(f'Load test of {table_name}: {mix}, {mode}, zipf={zipf} over {key_space} keys, {duration}s')
+    summary = dynamodb_loadgen.run_load(table_name, mix, rate, concurrency, processes, duration, key_space, zipf,
+                                        report_interval=report_interval, seed=seed)
+    print('-' * 24)
+    for operation, row in summary.items():
+        print(dynamodb_loadgen.format_row(operation, row))
+        if row['errors']:
+            print(f'{"":<9} errors: {row["errors"]}')
+    if output:
+        dynamodb_loadgen.save_report(summary, output, table=table_name, mix=mix, rate=rate, concurrency=concurrency,
+                                     duration=duration, key_space=key_space, zipf=zipf)
+        print(f'Saved to {output}')
+
+
 def _helper_table_waiter(delay=1, max_attempts=10):
         print(f'''Usage:
     .pipenv_run.sh my_aws_py_dynamodb.py table_waiter [waiter] [table] [delay in second] [max attemps]
 E.g.
     ./pipenv_run.sh my_aws_py_dynamodb.py table_waiter table_exists music-default {delay} {max_attempts}
+    ./pipenv_run.sh my_aws_py_dynamodb.py table_waiter table_exists music-default,music-test
 Valid waiters:
     * table_exists
     * table_not_exists
@@ -412,19 +618,20 @@ table name = {table_name}
 delay = {delay}
 max attemps = {max_attempts}
 ''')
-    waiter = _get_boto_client('dynamodb').get_waiter(waiter_name)
+    table_names = table_name.split(',') if isinstance(table_name, str) else list(table_name)
     if delay and max_attempts:
-        waiter_config = {
-                'Delay': delay,
-                'MaxAttempts': max_attempts
+        wait_config = {
+                'initial_delay': min(0.5, delay),
+                'max_delay': delay,
+                'timeout': delay * max_attempts,
             }
     else:
-        waiter_config = {}
+        wait_config = {}
 
     try:
-        waiter.wait(TableName=table_name, WaiterConfig=waiter_config)
-    except WaiterError as ex:
-        print('WaiterError is raised!')
+        wait_for([(name, None, waiter_name) for name in table_names], **wait_config)
+    except WaitTimeout as ex:
+        print('WaitTimeout is raised!')
         print(ex)
     except Exception as ex:
         print('Exception is raised!')
@@ -446,7 +653,7 @@ def _get_transact_items(artist='default', song_title='default', length=None, is_
             }
         },
         {
-            'Update': {
+            'Put': {
                 'TableName': 'music-test',
                 'Item': {
                     'Artist': { 'S': f'USER#{artist}' },
@@ -502,25 +709,37 @@ def _get_transact_items_for_update(artist='default', song_title='default', lengt
     print(f'Transact Items={returns}')
     return returns
 
-def transact_write_create_new_user(length=None):
-    length = length if length else int(random.random() * 100)
-    ddb = _get_boto_client('dynamodb')
-    response = ddb.transact_write_items(TransactItems=_get_transact_items(length=length))
+def _transact_write(operations, concurrency):
+    from dynamodb_transact import transact_write
+    stats = transact_write(operations, concurrency=concurrency)
+    for index, reason in sorted(stats.failed.items()):
+        print(f'Operation {index} failed: {reason}')
+    print(f'Transact write: {stats}')
+    return stats
 
 
-def transact_write_update_new_user(length=None):
-    length = length if length else int(random.random() * 100)
-    ddb = _get_boto_client('dynamodb')
-    response = ddb.transact_write_items(TransactItems=_get_transact_items(length=length, is_update=True))
+def transact_write_create_new_user(length=None, amount=1, concurrency=8):
+    operations = [_get_transact_items(artist='default' if amount == 1 else f'default-{i}',
+                                      length=length if length else int(random.random() * 100))
+                  for i in range(amount)]
+    _transact_write(operations, concurrency)
 
 
-def transact_write_update_user(length=None):
-    length = length if length else int(random.random() * 100)
-    ddb = _get_boto_client('dynamodb')
-    response = ddb.transact_write_items(TransactItems=_get_transact_items_for_update(length=length))
+def transact_write_update_new_user(length=None, amount=1, concurrency=8):
+    operations = [_get_transact_items(artist='default' if amount == 1 else f'default-{i}',
+                                      length=length if length else int(random.random() * 100), is_update=True)
+                  for i in range(amount)]
+    _transact_write(operations, concurrency)
+
+
+def transact_write_update_user(length=None, amount=1, concurrency=8):
+    operations = [_get_transact_items_for_update(artist='default' if amount == 1 else f'default-{i}',
+                                                 length=length if length else int(random.random() * 100))
+                  for i in range(amount)]
+    _transact_write(operations, concurrency)
 
 
 if __name__ == '__main__':
     run_at = os.path.dirname(sys.argv[0])
-    fire.Fire()
+    _fast_fire(globals())
 
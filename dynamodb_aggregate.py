@@ -0,0 +1,251 @@
+import math
+
+from dynamodb_columnar import _merge_projection, from_typed
+from dynamodb_scan import parallel_scan_pages
+
+
+FUNCTIONS = ('count', 'sum', 'min', 'max', 'avg', 'hist')
+
+
+class AggregateError(ValueError):
+    pass
+
+
+class _Count:
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        if value is not None:
+            self.value += 1
+
+    def merge(self, other):
+        self.value += other.value
+
+    def result(self):
+        return self.value
+
+
+class _Sum:
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        if value is not None:
+            self.value += value
+
+    def merge(self, other):
+        self.value += other.value
+
+    def result(self):
+        return self.value
+
+
+class _Extreme:
+    def __init__(self, pick):
+        self.pick = pick
+        self.value = None
+
+    def add(self, value):
+        if value is not None:
+            self.value = value if self.value is None else self.pick(self.value, value)
+
+    def merge(self, other):
+        self.add(other.value)
+
+    def result(self):
+        return self.value
+
+
+class _Avg:
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def result(self):
+        return self.total / self.count if self.count else None
+
+
+class _Histogram:
+    '''
+    Counts per bucket [lower, lower + width) of a numeric attribute, keyed by the lower bound.
+    '''
+
+    def __init__(self, width):
+        self.width = width
+        self.buckets = {}
+
+    def add(self, value):
+        if value is not None:
+            lower = math.floor(value / self.width) * self.width
+            self.buckets[lower] = self.buckets.get(lower, 0) + 1
+
+    def merge(self, other):
+        for lower, count in other.buckets.items():
+            self.buckets[lower] = self.buckets.get(lower, 0) + count
+
+    def result(self):
+        return dict(sorted(self.buckets.items()))
+
+
+def parse_aggregates(aggregates):
+    '''
+    [(name, function, attribute, argument)] of specs like 'count', 'sum:Length', 'min:Length',
+    'max:Length', 'avg:Length' and 'hist:Length:10' (10 wide buckets); a comma-separated string
+    or a list, whose already parsed tuples are kept as they are.
+    '''
+    specs = aggregates.split(',') if isinstance(aggregates, str) else list(aggregates)
+    parsed = []
+    for spec in specs:
+        if isinstance(spec, tuple):
+            parsed.append(spec)
+            continue
+        function, *rest = spec.strip().split(':')
+        if function not in FUNCTIONS:
+            raise AggregateError(f'Aggregate ({spec}) is not valid! Valid functions are {FUNCTIONS}.')
+        if function == 'count':
+            parsed.append((spec, function, rest[0] if rest else None, None))
+        elif function == 'hist':
+            if len(rest) != 2 or float(rest[1]) <= 0:
+                raise AggregateError(f'Aggregate ({spec}) must be hist:<attribute>:<bucket width>')
+            width = float(rest[1])
+            parsed.append((spec, function, rest[0], int(width) if width.is_integer() else width))
+        elif len(rest) != 1:
+            raise AggregateError(f'Aggregate ({spec}) must be {function}:<attribute>')
+        else:
+            parsed.append((spec, function, rest[0], None))
+    return parsed
+
+
+def _accumulator(function, argument):
+    if function == 'count':
+        return _Count()
+    if function == 'sum':
+        return _Sum()
+    if function == 'min':
+        return _Extreme(min)
+    if function == 'max':
+        return _Extreme(max)
+    if function == 'avg':
+        return _Avg()
+    return _Histogram(argument)
+
+
+class Aggregation:
+    '''
+    Running aggregates per group. Only one accumulator per aggregate and group is kept, so the
+    memory follows the number of groups (and histogram buckets), not the number of items.
+    '''
+
+    def __init__(self, aggregates, group_by=()):
+        self.aggregates = aggregates
+        self.group_by = list(group_by)
+        self.groups = {}
+        self.items = 0
+
+    def _accumulators(self, group):
+        accumulators = self.groups.get(group)
+        if accumulators is None:
+            accumulators = self.groups[group] = [_accumulator(function, argument)
+                                                 for _, function, _, argument in self.aggregates]
+        return accumulators
+
+    def add_page(self, raw_items):
+        for item in raw_items:
+            group = tuple(from_typed(item[name]) if name in item else None for name in self.group_by)
+            for accumulator, (_, function, attribute, _) in zip(self._accumulators(group), self.aggregates):
+                if attribute is None:
+                    accumulator.add(True)
+                elif attribute in item:
+                    value = from_typed(item[attribute])
+                    # Numeric functions skip the values that are not numbers.
+                    if function in ('count', 'min', 'max') or isinstance(value, (int, float)):
+                        accumulator.add(value)
+        self.items += len(raw_items)
+
+    def add_count(self, count):
+        # Select=COUNT pages: no group by, every aggregate is a plain count.
+        for accumulator in self._accumulators(()):
+            accumulator.value += count
+        self.items += count
+
+    def merge(self, other):
+        for group, accumulators in other.groups.items():
+            for accumulator, partial in zip(self._accumulators(group), accumulators):
+                accumulator.merge(partial)
+        self.items += other.items
+        return self
+
+    def results(self):
+        '''
+        {group tuple: {aggregate spec: value}}, groups in sorted order (missing values first).
+        '''
+        ordered = sorted(self.groups.items(), key=lambda entry: [(v is not None, str(v)) for v in entry[0]])
+        return {group: {name: accumulator.result() for accumulator, (name, _, _, _) in zip(accumulators, self.aggregates)}
+                for group, accumulators in ordered}
+
+
+def _counts_only(aggregates, group_by):
+    return not group_by and all(function == 'count' and attribute is None for _, function, attribute, _ in aggregates)
+
+
+def aggregate(table_name, aggregates='count', group_by=(), total_segments=4, max_workers=None, **scan_kwargs):
+    '''
+    Aggregation of the table (see parse_aggregates), grouped by the `group_by` attributes, from a
+    parallel raw scan. Each segment aggregates its own pages and the partials are merged at
+    the end. Only the referenced attributes are read (ProjectionExpression), and with plain counts
+    and no group by the scan asks for Select=COUNT. `scan_kwargs` may add a FilterExpression.
+    '''
+    aggregates = parse_aggregates(aggregates)
+    group_by = group_by.split(',') if isinstance(group_by, str) else list(group_by or [])
+    counts_only = _counts_only(aggregates, group_by)
+    if counts_only:
+        scan_kwargs['Select'] = 'COUNT'
+    else:
+        attributes = list(dict.fromkeys(group_by + [attribute for _, _, attribute, _ in aggregates if attribute]))
+        scan_kwargs = _merge_projection(attributes, scan_kwargs)
+    partials = {}
+    for segment, resp in parallel_scan_pages(table_name, total_segments, max_workers, raw=True, **scan_kwargs):
+        partial = partials.get(segment)
+        if partial is None:
+            partial = partials[segment] = Aggregation(aggregates, group_by)
+        if counts_only:
+            partial.add_count(resp.get('Count', 0))
+        else:
+            partial.add_page(resp.get('Items', []))
+    total = Aggregation(aggregates, group_by)
+    for segment in sorted(partials):
+        total.merge(partials[segment])
+    if counts_only and not total.groups:
+        total.add_count(0)
+    return total
+
+
+def filter_kwargs(where):
+    '''
+    Raw scan FilterExpression keyword arguments for a declarative predicate (see
+    dynamodb_planner.parse_predicate), e.g. {'Awards': 1, 'Length': ['>', 60]}.
+    '''
+    from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder
+    from boto3.dynamodb.types import TypeSerializer
+    from dynamodb_planner import _condition, parse_predicate
+    condition = _condition(Attr, parse_predicate(where))
+    if condition is None:
+        return {}
+    expression = ConditionExpressionBuilder().build_expression(condition)
+    serializer = TypeSerializer()
+    return {
+        'FilterExpression': expression.condition_expression,
+        'ExpressionAttributeNames': expression.attribute_name_placeholders,
+        'ExpressionAttributeValues': {k: serializer.serialize(v)
+                                      for k, v in expression.attribute_value_placeholders.items()},
+    }
@@ -0,0 +1,282 @@
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import fire
+
+import dynamodb
+from my_aws_py_base import _get_boto_client, close_boto_registry
+
+
+DEFAULT_OPS = (
+    'put_item', 'batch_write', 'get_item', 'batch_get_item', 'update_item', 'scan_table', 'query_table',
+    'query', 'query_global_secondary_index', 'query_GSI_top_N_items',
+    'transact_write_create_new_user', 'transact_write_update_new_user', 'transact_write_update_user',
+    'delete_item',
+)
+
+
+@contextlib.contextmanager
+def _local_aws_config():
+    # A throwaway profile with a region and fake credentials, so no real account is ever used.
+    with tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, 'config')
+        with open(config, 'w') as f:
+            f.write('[default]\nregion = us-east-1\naws_access_key_id = bench\naws_secret_access_key = bench\n')
+        env = {'AWS_CONFIG_FILE': config, 'AWS_SHARED_CREDENTIALS_FILE': config, 'AWS_PROFILE': 'default'}
+        saved = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        close_boto_registry()
+        try:
+            yield
+        finally:
+            close_boto_registry()
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+
+@contextlib.contextmanager
+def _moto_backend():
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit('The moto backend needs `pip install moto`.')
+    with _local_aws_config(), mock_aws():
+        yield
+
+
+@contextlib.contextmanager
+def _memory_backend():
+    import dynamodb_memory
+    with _local_aws_config():
+        dynamodb_memory.enable_memory_backend(dynamodb_memory.MemoryEngine())
+        try:
+            yield
+        finally:
+            dynamodb_memory.disable_memory_backend()
+
+
+@contextlib.contextmanager
+def _endpoint_backend():
+    # e.g. DynamoDB Local: AWS_ENDPOINT_URL_DYNAMODB=http://localhost:8000
+    if not (os.getenv('AWS_ENDPOINT_URL_DYNAMODB') or os.getenv('AWS_ENDPOINT_URL')):
+        raise SystemExit('The endpoint backend needs AWS_ENDPOINT_URL_DYNAMODB (e.g. http://localhost:8000).')
+    yield
+
+
+_BACKENDS = {
+    'moto': _moto_backend,
+    'memory': _memory_backend,
+    'endpoint': _endpoint_backend,
+}
+
+
+def _create_fixture_tables():
+    ddb = _get_boto_client('dynamodb')
+    table_names = (dynamodb.get_table_name(), dynamodb.get_default_table_name())
+    for table_name in table_names:
+        with contextlib.suppress(ddb.exceptions.ResourceNotFoundException):
+            ddb.delete_table(TableName=table_name)
+    dynamodb.wait_for([(table_name, None, 'table_not_exists') for table_name in table_names], verbose=False)
+    for table_name in table_names:
+        dynamodb.create_table(table_name)
+    dynamodb.create_global_secondary_index(table_name=dynamodb.get_table_name())
+    gsi_specs = (('AlbumTitle-Length-index', 'AlbumTitle', 'S', 'Length', 'N'),
+                 ('Artist-SongTitle-index', 'Artist', 'S', 'SongTitle', 'S'))
+    for index_name, hash_name, hash_type, range_name, range_type in gsi_specs:
+        ddb.update_table(
+            TableName=dynamodb.get_default_table_name(),
+            AttributeDefinitions=[
+                {'AttributeName': hash_name, 'AttributeType': hash_type},
+                {'AttributeName': range_name, 'AttributeType': range_type},
+            ],
+            GlobalSecondaryIndexUpdates=[{'Create': {
+                'IndexName': index_name,
+                'KeySchema': [
+                    {'AttributeName': hash_name, 'KeyType': 'HASH'},
+                    {'AttributeName': range_name, 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1},
+            }}],
+        )
+        # Only one GSI can be created on a table at a time.
+        dynamodb.wait_for([(dynamodb.get_default_table_name(), index_name, 'active')], verbose=False)
+    dynamodb.wait_for([(dynamodb.get_table_name(), '*', 'active')], verbose=False)
+
+
+def _op_calls(op, items, concurrency):
+    '''
+    (calls, item_count) for one operation: each call is timed on its own, item_count is the
+    number of items the calls process in total (used for ops/sec of the batch operations).
+    '''
+    table_name = dynamodb.get_table_name()
+    indexes = range(1, items + 1)
+    if op == 'batch_write':
+        return [lambda: dynamodb.batch_write(table_name, items, concurrency)], items
+    if op == 'batch_get_item':
+        return [lambda: dynamodb.batch_get_item(1, items, table_name, concurrency=concurrency)], items
+    if op == 'scan_table':
+        return [lambda: dynamodb.scan_table(table_name, max_workers=concurrency)], items
+    if op in ('get_item', 'update_item', 'delete_item'):
+        fn = getattr(dynamodb, op)
+        return [lambda idx=idx: fn(idx, table_name=table_name) for idx in indexes], items
+    if op in ('query_table', 'put_item', 'query_global_secondary_index'):
+        fn = getattr(dynamodb, op)
+        return [lambda: fn(table_name=table_name) for _ in indexes], items
+    fn = getattr(dynamodb, op)
+    if op.startswith('transact_write_'):
+        return [lambda idx=idx: fn(length=idx) for idx in indexes], items
+    return [fn for _ in indexes], items
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def _timed(call):
+    started = time.perf_counter()
+    try:
+        call()
+        error = None
+    except Exception as ex:
+        error = type(ex).__name__
+    return time.perf_counter() - started, error
+
+
+def _run_op(op, items, concurrency, trace_memory):
+    calls, item_count = _op_calls(op, items, concurrency)
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(_timed, calls))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in outcomes)
+    errors = {}
+    for _, error in outcomes:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        'calls': len(calls),
+        'items': item_count,
+        'elapsed': round(elapsed, 6),
+        'ops_per_sec': round(item_count / elapsed, 2) if elapsed else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+        'errors': errors,
+        'peak_memory_kb': round(tracemalloc.get_traced_memory()[1] / 1024, 1) if trace_memory else None,
+    }
+
+
+def bench(items=200, concurrency=4, ops=','.join(DEFAULT_OPS), backend='moto', output=None, trace_memory=True):
+    '''
+    Run every operation in `ops` (comma-separated, in order) against a local DynamoDB stand-in
+    and print ops/sec, p50/p95/p99 latency and peak traced memory. `output` saves the results
+    as JSON for `compare`. Peak memory tracing slows Python down; use --trace_memory=False
+    when only latency matters.
+    '''
+    ops = ops.split(',') if isinstance(ops, str) else list(ops)
+    unknown = [op for op in ops if not callable(getattr(dynamodb, op, None))]
+    if unknown:
+        raise SystemExit(f'Unknown operation(s): {unknown}')
+    results = {}
+    with _BACKENDS[backend]():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _create_fixture_tables()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            for op in ops:
+                results[op] = _run_op(op, items, concurrency, trace_memory)
+                print(f'{op:<32} {_format_result(results[op])}')
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'backend': backend,
+            'items': items,
+            'concurrency': concurrency,
+            'trace_memory': trace_memory,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results are saved to {output}')
+
+
+def _format_result(result):
+    errors = sum(result['errors'].values())
+    memory = '' if result['peak_memory_kb'] is None else f' peak={result["peak_memory_kb"]}KiB'
+    return (f'{result["ops_per_sec"]:>10} ops/s  p50={result["p50_ms"]}ms p95={result["p95_ms"]}ms '
+            f'p99={result["p99_ms"]}ms{memory}' + (f' errors={errors}' if errors else ''))
+
+
+def compare(baseline, candidate):
+    '''
+    Compare two saved `bench` results: ratio > 1 means the candidate is faster (or smaller).
+    '''
+    with open(baseline) as f:
+        base = json.load(f)['results']
+    with open(candidate) as f:
+        cand = json.load(f)['results']
+    print(f'{"operation":<32} {"ops/s":>20} {"p50":>8} {"p99":>8} {"memory":>8}')
+    for op in [op for op in base if op in cand]:
+        b, c = base[op], cand[op]
+        ratio = lambda key, inverse=False: (
+            f'{(b[key] / c[key] if inverse else c[key] / b[key]):.2f}x' if b.get(key) and c.get(key) else '-')
+        print(f'{op:<32} {b["ops_per_sec"]:>9}->{c["ops_per_sec"]:<9} {ratio("p50_ms", True):>8} '
+              f'{ratio("p99_ms", True):>8} {ratio("peak_memory_kb", True):>8}  ({ratio("ops_per_sec")} ops/s)')
+
+
+def _import_time_ms(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in proc.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f'No import time is reported for {module}')
+
+
+def import_budget(module='dynamodb', budget_ms=60, runs=5, heavy_modules='boto3,botocore,fire,dotenv'):
+    '''
+    Check that importing `module` stays within `budget_ms` (median of `runs` fresh interpreters)
+    and pulls in none of `heavy_modules`; exits non-zero otherwise, so it can gate CI.
+    '''
+    heavy_modules = heavy_modules.split(',') if isinstance(heavy_modules, str) else list(heavy_modules)
+    median_ms = statistics.median(_import_time_ms(module) for _ in range(runs))
+    probe = subprocess.run(
+        [sys.executable, '-c', f'import sys, {module}; print(",".join(m for m in {heavy_modules!r} if m in sys.modules))'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    loaded = [m for m in probe.stdout.strip().split(',') if m]
+    print(f'import {module}: {median_ms:.1f}ms (budget {budget_ms}ms), heavy modules loaded: {loaded or "none"}')
+    if median_ms > budget_ms or loaded:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    fire.Fire()
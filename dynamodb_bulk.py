@@ -0,0 +1,245 @@
+import collections
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dynamodb_cache import invalidate_items
+from dynamodb_shard import get_sharding, routable_sharding
+from my_aws_py_base import _get_boto_resource_client
+
+
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+
+
+class BulkWriteError(Exception):
+    pass
+
+
+class BulkGetError(Exception):
+    pass
+
+
+class BulkStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.requests = 0
+        self.retries = 0
+        self.unprocessed = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+        return self
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def items_per_sec(self):
+        return self.items / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'items': self.items,
+            'requests': self.requests,
+            'retries': self.retries,
+            'unprocessed': self.unprocessed,
+            'elapsed': round(self.elapsed, 3),
+            'items_per_sec': round(self.items_per_sec, 1),
+        }
+
+    def __str__(self):
+        return ', '.join(f'{k}={v}' for k, v in self.as_dict().items())
+
+
+def _backoff_delay(attempt, base_delay=0.05, max_delay=5.0):
+    # "Full jitter" exponential backoff.
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _dedupe_puts(items, overwrite_by_pkeys):
+    if not overwrite_by_pkeys:
+        return items
+    # BatchWriteItem rejects a request that touches the same key twice; keep the last write.
+    latest = {tuple(item[k] for k in overwrite_by_pkeys): item for item in items}
+    return list(latest.values())
+
+
+def _write_batch(table_name, items, stats, max_retries, base_delay, max_delay, request_type='PutRequest'):
+    client = _get_boto_resource_client('dynamodb')
+    field = 'Item' if request_type == 'PutRequest' else 'Key'
+    requests = [{request_type: {field: item}} for item in items]
+    for attempt in range(max_retries + 1):
+        resp = client.batch_write_item(RequestItems={table_name: requests})
+        unprocessed = resp.get('UnprocessedItems', {}).get(table_name, [])
+        stats.add(requests=1, items=len(requests) - len(unprocessed))
+        if not unprocessed:
+            invalidate_items(table_name, items)
+            return
+        stats.add(retries=1, unprocessed=len(unprocessed))
+        requests = unprocessed
+        time.sleep(_backoff_delay(attempt, base_delay, max_delay))
+    invalidate_items(table_name, items)
+    raise BulkWriteError(f'{len(requests)} item(s) still unprocessed after {max_retries} retries')
+
+
+def _bulk_write_requests(table_name, items, request_type, prepare, concurrency, max_retries, base_delay, max_delay,
+                         stats):
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'bulk-{table_name}') as executor:
+        in_flight = set()
+        try:
+            for chunk in _chunks(items, BATCH_WRITE_MAX_ITEMS):
+                if len(in_flight) >= 2 * concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(_write_batch, table_name, prepare(chunk), stats,
+                                              max_retries, base_delay, max_delay, request_type))
+            for future in in_flight:
+                future.result()
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+    return stats.finish()
+
+
+def bulk_write(table_name, items, concurrency=8, max_retries=10, base_delay=0.05, max_delay=5.0,
+               overwrite_by_pkeys=None, stats=None):
+    '''
+    Put `items` (any iterable, consumed lazily) using `concurrency` parallel BatchWriteItem
+    streams, retrying UnprocessedItems with jittered exponential backoff. Returns BulkStats.
+    Items of a hash-sharded table (see dynamodb_shard) are written to their shards.
+    '''
+    shard_map = routable_sharding(table_name, 'bulk_write')
+    if shard_map is not None:
+        items = map(shard_map.to_physical, items)
+    return _bulk_write_requests(table_name, items, 'PutRequest', lambda chunk: _dedupe_puts(chunk, overwrite_by_pkeys),
+                                concurrency, max_retries, base_delay, max_delay, stats or BulkStats())
+
+
+def bulk_delete(table_name, keys, concurrency=8, max_retries=10, base_delay=0.05, max_delay=5.0, stats=None):
+    '''
+    Delete the items of `keys` (any iterable of key dicts) the same way bulk_write puts items.
+    A key of a sharded table is deleted wherever it may be stored (see ShardMap.locations).
+    '''
+    shard_map = get_sharding(table_name)
+    if shard_map is not None:
+        keys = (physical for key in keys for physical in shard_map.locations(key))
+    # BatchWriteItem rejects a request that names the same key twice.
+    dedupe = lambda chunk: list({tuple(sorted(key.items())): key for key in chunk}.values())
+    return _bulk_write_requests(table_name, keys, 'DeleteRequest', dedupe,
+                                concurrency, max_retries, base_delay, max_delay, stats or BulkStats())
+
+
+def _key_of(item, key_names):
+    return tuple(item[k] for k in key_names)
+
+
+def _get_request_options(key_names, projection, consistent_read):
+    options = {'ConsistentRead': consistent_read}
+    if projection:
+        attrs = projection.split(',') if isinstance(projection, str) else list(projection)
+        attrs = [a.strip() for a in attrs if a.strip()]
+        # Keys are always fetched so results can be matched back to the requested keys.
+        attrs = list(dict.fromkeys(list(key_names) + attrs))
+        names = {f'#p{i}': attr for i, attr in enumerate(attrs)}
+        options['ProjectionExpression'] = ', '.join(names)
+        options['ExpressionAttributeNames'] = names
+    return options
+
+
+def _get_batch(table_name, keys, key_names, options, stats, max_retries, base_delay, max_delay):
+    client = _get_boto_resource_client('dynamodb')
+    found = {}
+    # BatchGetItem rejects a request that names the same key twice: send each key once and
+    # answer every requested position from the results.
+    request = dict(options, Keys=list({_key_of(key, key_names): key for key in keys}.values()))
+    for attempt in range(max_retries + 1):
+        resp = client.batch_get_item(RequestItems={table_name: request})
+        items = resp.get('Responses', {}).get(table_name, [])
+        for item in items:
+            found[_key_of(item, key_names)] = item
+        unprocessed = resp.get('UnprocessedKeys', {}).get(table_name)
+        stats.add(requests=1, items=len(items))
+        if not unprocessed or not unprocessed.get('Keys'):
+            return [(key, found.get(_key_of(key, key_names))) for key in keys]
+        stats.add(retries=1, unprocessed=len(unprocessed['Keys']))
+        request = unprocessed
+        time.sleep(_backoff_delay(attempt, base_delay, max_delay))
+    raise BulkGetError(f'{len(request["Keys"])} key(s) still unprocessed after {max_retries} retries')
+
+
+def bulk_get(table_name, keys, concurrency=8, ordered=True, projection=None, consistent_read=False,
+             max_retries=10, base_delay=0.05, max_delay=5.0, stats=None):
+    '''
+    Yield (key, item) for every key (item is None when the key does not exist), fetching
+    100-key BatchGetItem chunks concurrently and retrying UnprocessedKeys with backoff.
+
+    With `ordered` results follow the request order, otherwise chunks are yielded as they
+    complete. `projection` (comma string or list of attribute names) limits the attributes read.
+    Keys of a hash-sharded table are read from their shards and yielded as requested.
+    '''
+    shard_map = routable_sharding(table_name, 'bulk_get')
+    results = _bulk_get(table_name, keys if shard_map is None else map(shard_map.to_physical, keys), concurrency,
+                        ordered, projection, consistent_read, max_retries, base_delay, max_delay, stats)
+    try:
+        for key, item in results:
+            yield (key, item) if shard_map is None else (shard_map.to_logical(key), shard_map.to_logical(item))
+    finally:
+        results.close()
+
+
+def _bulk_get(table_name, keys, concurrency, ordered, projection, consistent_read, max_retries, base_delay, max_delay,
+              stats):
+    stats = stats or BulkStats()
+    keys = iter(keys)
+    first = next(keys, None)
+    if first is None:
+        return
+    key_names = tuple(first)
+    options = _get_request_options(key_names, projection, consistent_read)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'bulk-get-{table_name}') as executor:
+        in_flight = collections.deque()
+        try:
+            for chunk in _chunks(itertools.chain([first], keys), BATCH_GET_MAX_KEYS):
+                if len(in_flight) >= 2 * concurrency:
+                    yield from _drain(in_flight, ordered)
+                in_flight.append(executor.submit(_get_batch, table_name, chunk, key_names, options, stats,
+                                                 max_retries, base_delay, max_delay))
+            while in_flight:
+                yield from _drain(in_flight, ordered)
+        finally:
+            for future in in_flight:
+                future.cancel()
+            stats.finish()
+
+
+def _drain(in_flight, ordered):
+    if ordered:
+        yield from in_flight.popleft().result()
+        return
+    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in done:
+        in_flight.remove(future)
+        yield from future.result()
@@ -0,0 +1,205 @@
+import collections
+import os
+import threading
+import time
+
+from dynamodb_query import paginated_query
+from my_aws_py_base import on_env_loaded
+
+
+_MISSING = object()
+
+
+def _freeze(value):
+    from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+    if isinstance(value, ConditionBase):
+        expression = value.get_expression()
+        return ('cond', expression['format'], expression['operator'], _freeze(expression['values']))
+    if isinstance(value, AttributeBase):
+        return ('attr', type(value).__name__, value.name)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+class ReadThroughCache:
+    '''
+    Size-bounded (LRU) cache whose entries expire `ttl` seconds after they are loaded.
+    '''
+
+    def __init__(self, max_size=10000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._key_names = {}
+        # Bumped on every write to a table: retires its cached queries and stops in-flight loads
+        # that started before the write from storing a stale value.
+        self._generations = collections.defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return _MISSING
+
+    def _store(self, key, value, table_name, generation):
+        with self._lock:
+            if self._generations[table_name] != generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        table_name = key[1]
+        with self._lock:
+            generation = self._generations[table_name]
+        value = self._lookup(key)
+        if value is _MISSING:
+            value = loader()
+            self._store(key, value, table_name, generation)
+        return value
+
+    def item_key(self, table_name, key):
+        with self._lock:
+            self._key_names.setdefault(table_name, tuple(sorted(key)))
+        return ('item', table_name, _freeze(key))
+
+    def query_key(self, table_name, query_kwargs):
+        with self._lock:
+            generation = self._generations[table_name]
+        return ('query', table_name, generation, _freeze(query_kwargs))
+
+    def invalidate_item(self, table_name, item):
+        '''
+        Drop the cached copy of `item` (a key or a full item) and every cached query of the table.
+        '''
+        with self._lock:
+            self._generations[table_name] += 1
+            key_names = self._key_names.get(table_name)
+            if key_names is None or not all(k in item for k in key_names):
+                return
+            key = ('item', table_name, _freeze({k: item[k] for k in key_names}))
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for table_name in self._generations:
+                self._generations[table_name] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = None
+
+
+def enable_cache(max_size=10000, ttl=60.0):
+    global _cache
+    _cache = ReadThroughCache(max_size, ttl)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+
+def get_cache():
+    return _cache
+
+
+def cached_get_item(table, key, **get_kwargs):
+    '''
+    table.get_item(Key=key)['Item'] (or None) through the process cache when it is enabled.
+    Only whole-item, eventually consistent reads are cached; anything else goes to the table.
+    '''
+    load = lambda: table.get_item(Key=key, **get_kwargs).get('Item')
+    cache = get_cache()
+    if cache is None or get_kwargs:
+        return load()
+    return cache.get_or_load(cache.item_key(table.name, key), load)
+
+
+def cached_query(table, limit=None, **query_kwargs):
+    '''
+    All items of a paginated query as a list, through the process cache when it is enabled.
+    '''
+    load = lambda: list(paginated_query(table, limit=limit, **query_kwargs))
+    cache = get_cache()
+    if cache is None or query_kwargs.get('ConsistentRead'):
+        return load()
+    return cache.get_or_load(cache.query_key(table.name, dict(query_kwargs, limit=limit)), load)
+
+
+def invalidate_item(table_name, item):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate_item(table_name, item)
+
+
+def invalidate_items(table_name, items):
+    cache = get_cache()
+    if cache is not None:
+        for item in items:
+            cache.invalidate_item(table_name, item)
+
+
+def invalidate_transact_items(transact_items):
+    cache = get_cache()
+    if cache is None:
+        return
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    for action in transact_items:
+        for kind, request in action.items():
+            if kind == 'ConditionCheck':
+                continue
+            typed = request.get('Key') or request.get('Item') or {}
+            item = {k: deserializer.deserialize(v) for k, v in typed.items()}
+            cache.invalidate_item(request['TableName'], item)
+
+
+def _enable_cache_from_env():
+    # e.g. ddb_cache=10000 caches up to 10000 reads for 60 seconds, ddb_cache=10000:5 for 5 seconds.
+    spec = os.getenv('ddb_cache')
+    if spec:
+        max_size, _, ttl = spec.partition(':')
+        enable_cache(int(max_size), float(ttl) if ttl else 60.0)
+
+
+on_env_loaded(_enable_cache_from_env)
@@ -0,0 +1,243 @@
+import base64
+import collections
+import functools
+from array import array
+
+from dynamodb_query import paginated_query
+from dynamodb_scan import ClientTable, parallel_scan_pages
+
+
+Categorical = collections.namedtuple('Categorical', ['codes', 'categories'])
+
+
+def _number(text):
+    # int for integral values, float otherwise: cheaper than Decimal, at the cost of float precision.
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
+
+def from_typed(value):
+    '''
+    Plain Python value of one raw attribute value such as {'N': '12'} or {'S': 'abc'}.
+    '''
+    (kind, raw), = value.items()
+    if kind == 'S':
+        return raw
+    if kind == 'N':
+        return _number(raw)
+    if kind == 'BOOL':
+        return raw
+    if kind == 'NULL':
+        return None
+    if kind == 'B':
+        return raw if isinstance(raw, bytes) else base64.b64decode(raw)
+    if kind == 'SS':
+        return set(raw)
+    if kind == 'NS':
+        return {_number(n) for n in raw}
+    if kind == 'BS':
+        return set(raw)
+    if kind == 'L':
+        return [from_typed(v) for v in raw]
+    if kind == 'M':
+        return {k: from_typed(v) for k, v in raw.items()}
+    raise ValueError(f'Unknown DynamoDB type ({kind})')
+
+
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{k}={v!r}" for k, v in self._asdict().items())})'
+
+
+@functools.lru_cache(maxsize=None)
+def record_type(attributes):
+    '''
+    A __slots__ record class with one field per attribute name (a tuple of valid identifiers).
+    '''
+    return type('Record', (_Record,), {'__slots__': tuple(attributes)})
+
+
+def to_records(raw_items, attributes):
+    '''
+    __slots__ records for a page of raw items; attributes missing from an item are None.
+    '''
+    cls = record_type(tuple(attributes))
+    return [cls(*[from_typed(item[a]) if a in item else None for a in attributes]) for item in raw_items]
+
+
+def _projection(attributes):
+    names = {f'#a{i}': attr for i, attr in enumerate(attributes)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def _merge_projection(attributes, kwargs):
+    projection = _projection(attributes)
+    kwargs = dict(kwargs)
+    kwargs['ExpressionAttributeNames'] = dict(kwargs.get('ExpressionAttributeNames') or {},
+                                              **projection['ExpressionAttributeNames'])
+    kwargs.setdefault('ProjectionExpression', projection['ProjectionExpression'])
+    return kwargs
+
+
+class ColumnBuilder:
+    '''
+    Accumulate raw pages column by column and build NumPy arrays: int64 (float64 when a value is
+    fractional or missing, exact Python ints in an object array beyond the int64 range) for N,
+    object arrays for everything else, and Categorical
+    (int32 codes + categories) for the attributes in `categorical`.
+    '''
+
+    def __init__(self, attributes, categorical=()):
+        self.attributes = list(attributes)
+        self.categorical = set(categorical)
+        self.count = 0
+        self._chunks = {a: [] for a in self.attributes}
+        self._kinds = {a: set() for a in self.attributes}
+        self._codes = {a: array('i') for a in self.categorical}
+        self._categories = {a: {} for a in self.categorical}
+
+    def add_page(self, raw_items):
+        import numpy as np
+        for attr in self.attributes:
+            values = [item.get(attr) for item in raw_items]
+            kinds = self._kinds[attr]
+            if attr in self.categorical:
+                categories = self._categories[attr]
+                codes = self._codes[attr]
+                for value in values:
+                    key = None if value is None else from_typed(value)
+                    codes.append(categories.setdefault(key, len(categories)))
+                continue
+            if all(value is not None and 'N' in value for value in values):
+                texts = [value['N'] for value in values]
+                if any('.' in t or 'e' in t or 'E' in t for t in texts):
+                    kinds.add('float')
+                    self._chunks[attr].append(np.array(texts).astype(np.float64))
+                else:
+                    try:
+                        chunk = np.array(texts).astype(np.int64) if texts else np.empty(0, np.int64)
+                        kinds.add('int')
+                    except OverflowError:
+                        # DynamoDB numbers have up to 38 digits; keep them exact rather than wrap around.
+                        kinds.add('object')
+                        chunk = np.empty(len(texts), dtype=object)
+                        chunk[:] = [int(t) for t in texts]
+                    self._chunks[attr].append(chunk)
+            elif all(value is None or 'N' in value for value in values):
+                kinds.add('float')
+                self._chunks[attr].append(np.array([np.nan if v is None else float(v['N']) for v in values]))
+            else:
+                kinds.add('object')
+                chunk = np.empty(len(values), dtype=object)
+                chunk[:] = [None if v is None else from_typed(v) for v in values]
+                self._chunks[attr].append(chunk)
+        self.count += len(raw_items)
+
+    def build(self):
+        import numpy as np
+        columns = {}
+        for attr in self.attributes:
+            if attr in self.categorical:
+                categories = np.empty(len(self._categories[attr]), dtype=object)
+                categories[:] = list(self._categories[attr])
+                columns[attr] = Categorical(np.frombuffer(self._codes[attr], dtype=np.int32).copy(), categories)
+                continue
+            chunks = self._chunks[attr]
+            kinds = self._kinds[attr]
+            if not chunks:
+                columns[attr] = np.empty(0, dtype=np.int64)
+            elif 'object' in kinds:
+                columns[attr] = np.concatenate([chunk.astype(object) for chunk in chunks])
+            elif 'float' in kinds:
+                columns[attr] = np.concatenate([chunk.astype(np.float64) for chunk in chunks])
+            else:
+                columns[attr] = np.concatenate(chunks)
+        return columns
+
+
+def column_stats(column):
+    '''
+    {'count': values present} of a built column, plus min, max and mean when it is numeric.
+    Missing values (NaN in float columns, None in object columns) are not counted.
+    '''
+    import numpy as np
+    kind = column.dtype.kind
+    if kind == 'f':
+        count = int(np.count_nonzero(~np.isnan(column)))
+        if not count:
+            return {'count': 0}
+        return {'count': count, 'min': float(np.nanmin(column)), 'max': float(np.nanmax(column)),
+                'mean': float(np.nanmean(column))}
+    if kind == 'i':
+        if not len(column):
+            return {'count': 0}
+        return {'count': len(column), 'min': column.min().item(), 'max': column.max().item(),
+                'mean': float(column.mean())}
+    present = [value for value in column if value is not None]
+    if not present or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return {'count': len(present)}
+    return {'count': len(present), 'min': min(present), 'max': max(present), 'mean': sum(present) / len(present)}
+
+
+def scan_records(table_name, attributes, total_segments=4, max_workers=None, **scan_kwargs):
+    '''
+    Yield __slots__ records of `attributes` from a parallel raw scan, one page at a time.
+    '''
+    scan_kwargs = _merge_projection(attributes, scan_kwargs)
+    for _, resp in parallel_scan_pages(table_name, total_segments, max_workers, raw=True, **scan_kwargs):
+        yield from to_records(resp.get('Items', []), attributes)
+
+
+def scan_columns(table_name, attributes, categorical=(), total_segments=4, max_workers=None, **scan_kwargs):
+    '''
+    {attribute: NumPy array or Categorical} for a parallel raw scan (see ColumnBuilder).
+    '''
+    builder = ColumnBuilder(attributes, categorical)
+    scan_kwargs = _merge_projection(attributes, scan_kwargs)
+    for _, resp in parallel_scan_pages(table_name, total_segments, max_workers, raw=True, **scan_kwargs):
+        builder.add_page(resp.get('Items', []))
+    return builder.build()
+
+
+def query_records(table_name, attributes, limit=None, prefetch=True, **query_kwargs):
+    '''
+    Yield __slots__ records of `attributes` from a raw paginated query; expressions must be
+    strings with typed ExpressionAttributeValues, e.g. {':a': {'S': 'No One You Know-1'}}.
+    '''
+    items = paginated_query(ClientTable(table_name), limit=limit, prefetch=prefetch,
+                            **_merge_projection(attributes, query_kwargs))
+    cls = record_type(tuple(attributes))
+    for item in items:
+        yield cls(*[from_typed(item[a]) if a in item else None for a in attributes])
+
+
+def query_columns(table_name, attributes, categorical=(), limit=None, prefetch=True, page_items=1000, **query_kwargs):
+    '''
+    {attribute: NumPy array or Categorical} for a raw paginated query.
+    '''
+    builder = ColumnBuilder(attributes, categorical)
+    batch = []
+    for item in paginated_query(ClientTable(table_name), limit=limit, prefetch=prefetch,
+                                **_merge_projection(attributes, query_kwargs)):
+        batch.append(item)
+        if len(batch) >= page_items:
+            builder.add_page(batch)
+            batch = []
+    builder.add_page(batch)
+    return builder.build()
@@ -0,0 +1,173 @@
+import base64
+import bz2
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_columnar import from_typed
+from dynamodb_scan import scan_segment_pages
+
+
+FORMATS = ('jsonl', 'csv')
+COMPRESSIONS = {'gzip': ('.gz', gzip.compress), 'bz2': ('.bz2', bz2.compress), None: ('', lambda data: data)}
+
+
+class ExportError(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'__b64__': base64.b64encode(bytes(value)).decode()}
+    if isinstance(value, (set, frozenset)):
+        # SS/NS/BS: sorted lists, so exports are stable; bytes members are encoded as above.
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _json_object_hook(value):
+    return base64.b64decode(value['__b64__']) if set(value) == {'__b64__'} else value
+
+
+def _csv_value(value):
+    (kind, raw), = value.items()
+    if kind in ('S', 'N'):
+        return raw
+    return json.dumps(from_typed(value), default=_json_default, sort_keys=True)
+
+
+def _encode_page(items, fmt, attributes, plain):
+    if fmt == 'jsonl':
+        lines = (json.dumps({k: from_typed(v) for k, v in item.items()} if plain else {'Item': item},
+                            default=_json_default, sort_keys=True) for item in items)
+        return ''.join(line + '\n' for line in lines).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for item in items:
+        writer.writerow([_csv_value(item[a]) if a in item else '' for a in attributes])
+    return buffer.getvalue().encode()
+
+
+def _header(fmt, attributes):
+    if fmt != 'csv':
+        return b''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(attributes)
+    return buffer.getvalue().encode()
+
+
+def _shard_paths(output_dir, table_name, segment, total_segments, fmt, compression):
+    base = os.path.join(output_dir, f'{table_name}-{segment:05d}-of-{total_segments:05d}')
+    return f'{base}.{fmt}{COMPRESSIONS[compression][0]}', f'{base}.checkpoint.json'
+
+
+def _read_checkpoint(path, settings):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f, object_hook=_json_object_hook)
+    if checkpoint['settings'] != settings:
+        raise ExportError(f'{path} was written with {checkpoint["settings"]}, not {settings}; '
+                          f'use another output directory or resume=False')
+    return checkpoint
+
+
+def _write_checkpoint(path, checkpoint):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, default=_json_default, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _export_segment(table_name, segment, total_segments, output_dir, fmt, compression, attributes, plain,
+                    settings, resume, stop, scan_kwargs):
+    shard_path, checkpoint_path = _shard_paths(output_dir, table_name, segment, total_segments, fmt, compression)
+    compress = COMPRESSIONS[compression][1]
+    checkpoint = _read_checkpoint(checkpoint_path, settings) if resume else None
+    if checkpoint and (not os.path.exists(shard_path) or os.path.getsize(shard_path) < checkpoint['offset']):
+        # The shard no longer holds what the checkpoint vouches for: export the segment again.
+        checkpoint = None
+    if checkpoint and checkpoint['done']:
+        return checkpoint
+    if checkpoint is None:
+        checkpoint = {'settings': settings, 'segment': segment, 'offset': 0, 'items': 0,
+                      'last_evaluated_key': None, 'done': False}
+    with open(shard_path, 'ab' if checkpoint['offset'] else 'wb') as shard:
+        # Anything past the checkpointed offset was written after the last checkpoint; drop it.
+        shard.truncate(checkpoint['offset'])
+        shard.seek(checkpoint['offset'])
+        if not checkpoint['offset']:
+            header = _header(fmt, attributes)
+            if header:
+                shard.write(compress(header))
+        pages = scan_segment_pages(table_name, segment, total_segments, checkpoint['last_evaluated_key'],
+                                   raw=True, **scan_kwargs)
+        for resp in pages:
+            items = resp.get('Items', [])
+            if items:
+                # Every page is its own gzip/bz2 member, so a shard is valid at every checkpoint.
+                shard.write(compress(_encode_page(items, fmt, attributes, plain)))
+            shard.flush()
+            os.fsync(shard.fileno())
+            checkpoint.update(offset=shard.tell(), items=checkpoint['items'] + len(items),
+                              last_evaluated_key=resp.get('LastEvaluatedKey'),
+                              done=not resp.get('LastEvaluatedKey'))
+            _write_checkpoint(checkpoint_path, checkpoint)
+            if stop.is_set():
+                break
+    return checkpoint
+
+
+def export_table(table_name, output_dir, fmt='jsonl', total_segments=8, max_workers=None, compression='gzip',
+                 attributes=None, plain=False, resume=True, **scan_kwargs):
+    '''
+    Export the table with a parallel segmented scan into one compressed shard per segment.
+
+    jsonl lines are {"Item": <DynamoDB JSON>} (lossless), or plain JSON values with `plain`;
+    csv needs `attributes` and writes one column per attribute. Each segment checkpoints its
+    LastEvaluatedKey and shard size after every page, so running the same export again resumes
+    where it stopped. Returns the manifest, which is also written next to the shards.
+    '''
+    if fmt not in FORMATS:
+        raise ExportError(f'Format ({fmt}) is not valid! Valid formats are {FORMATS}.')
+    if compression not in COMPRESSIONS:
+        raise ExportError(f'Compression ({compression}) is not valid! Valid compressions are {tuple(COMPRESSIONS)}.')
+    attributes = attributes.split(',') if isinstance(attributes, str) else list(attributes or [])
+    if fmt == 'csv' and not attributes:
+        raise ExportError('csv export needs the attributes to write')
+    if attributes:
+        names = {f'#a{i}': attr for i, attr in enumerate(attributes)}
+        scan_kwargs.setdefault('ProjectionExpression', ', '.join(names))
+        scan_kwargs['ExpressionAttributeNames'] = dict(scan_kwargs.get('ExpressionAttributeNames') or {}, **names)
+    settings = {'table': table_name, 'total_segments': total_segments, 'format': fmt, 'compression': compression,
+                'attributes': attributes, 'plain': plain}
+    os.makedirs(output_dir, exist_ok=True)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers or total_segments, thread_name_prefix=f'export-{table_name}') as executor:
+        futures = [executor.submit(_export_segment, table_name, segment, total_segments, output_dir, fmt, compression,
+                                   attributes, plain, settings, resume, stop, scan_kwargs)
+                   for segment in range(total_segments)]
+        try:
+            checkpoints = [future.result() for future in futures]
+        except BaseException:
+            # e.g. Ctrl-C: let every segment finish its current page and checkpoint it.
+            stop.set()
+            raise
+    manifest = {
+        'settings': settings,
+        'done': all(checkpoint['done'] for checkpoint in checkpoints),
+        'items': sum(checkpoint['items'] for checkpoint in checkpoints),
+        'shards': [{'segment': checkpoint['segment'], 'items': checkpoint['items'], 'done': checkpoint['done'],
+                    'path': os.path.basename(_shard_paths(output_dir, table_name, checkpoint['segment'],
+                                                          total_segments, fmt, compression)[0])}
+                   for checkpoint in checkpoints],
+    }
+    with open(os.path.join(output_dir, f'{table_name}.manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
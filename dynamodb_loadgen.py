@@ -0,0 +1,399 @@
+import bisect
+import functools
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_shard import _fan_out, routable_sharding
+from my_aws_py_base import _THROTTLE_CODES, _get_boto_client, close_boto_registry
+
+
+OPERATIONS = ('get', 'put', 'update', 'query', 'transact')
+DEFAULT_MIX = 'get:50,put:20,update:10,query:15,transact:5'
+# Latency histogram buckets grow by 5%, so percentiles are within 5% of the exact value.
+_GROWTH = 1.05
+_LOG_GROWTH = math.log(_GROWTH)
+
+
+class LoadError(ValueError):
+    pass
+
+
+def parse_mix(mix):
+    '''
+    [(operation, weight)] of 'get:50,put:20,...' (or a dict); weights are relative.
+    '''
+    entries = mix.items() if isinstance(mix, dict) else (entry.split(':') for entry in mix.split(','))
+    parsed = []
+    for operation, weight in entries:
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise LoadError(f'Operation ({operation}) is not valid! Valid operations are {OPERATIONS}.')
+        if float(weight) > 0:
+            parsed.append((operation, float(weight)))
+    if not parsed:
+        raise LoadError(f'The mix ({mix}) has no operation with a positive weight')
+    return parsed
+
+
+class Histogram:
+    '''
+    Log-bucketed latency histogram, mergeable across threads and processes as a plain dict.
+    '''
+
+    def __init__(self, buckets=None):
+        self.buckets = dict(buckets or {})
+
+    def record(self, seconds):
+        bucket = max(0, math.ceil(math.log(max(seconds * 1e6, 1.0)) / _LOG_GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, buckets):
+        for bucket, count in buckets.items():
+            bucket = int(bucket)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, pct):
+        '''
+        Upper bound of the bucket holding the pct-th percentile, in milliseconds.
+        '''
+        total = self.count
+        if not total:
+            return None
+        rank = math.ceil(total * pct / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return _GROWTH ** bucket / 1000
+        return _GROWTH ** max(self.buckets) / 1000
+
+
+def _new_stats():
+    return {'count': 0, 'errors': {}, 'throttles': 0, 'retries': 0, 'dropped': 0, 'histogram': Histogram()}
+
+
+class _Stats:
+    '''
+    Per operation counts of one worker process since the last snapshot.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def _operation(self, operation):
+        stats = self._ops.get(operation)
+        if stats is None:
+            stats = self._ops[operation] = _new_stats()
+        return stats
+
+    def drop(self, operation):
+        # An open loop arrival that could not start before the end of the run.
+        with self._lock:
+            self._operation(operation)['dropped'] += 1
+
+    def record(self, operation, latency, error=None, retries=0):
+        with self._lock:
+            stats = self._operation(operation)
+            stats['count'] += 1
+            stats['retries'] += retries
+            stats['histogram'].record(latency)
+            if error:
+                stats['errors'][error] = stats['errors'].get(error, 0) + 1
+                stats['throttles'] += error in _THROTTLE_CODES
+
+    def snapshot(self):
+        with self._lock:
+            ops, self._ops = self._ops, {}
+        return {operation: dict(stats, histogram=stats['histogram'].buckets) for operation, stats in ops.items()}
+
+
+@functools.lru_cache(maxsize=4)
+def _zipf_cdf(key_space, exponent):
+    # Shared by every thread of a process: key_space floats, not key_space per thread.
+    return list(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, key_space + 1)))
+
+
+class ZipfKeys:
+    '''
+    Key ids 1..key_space drawn with probability proportional to 1 / rank ** exponent (0 is uniform).
+    '''
+
+    def __init__(self, key_space, exponent=1.1, seed=None):
+        self.random = random.Random(seed)
+        self.cdf = _zipf_cdf(key_space, exponent)
+
+    def next(self):
+        return bisect.bisect_left(self.cdf, self.random.random() * self.cdf[-1]) + 1
+
+
+def _key(key_id):
+    return {'Artist': {'S': f'No One You Know-{key_id}'}, 'SongTitle': {'S': f'Call Me Today-{key_id}'}}
+
+
+def _item(key_id, rng):
+    return dict(_key(key_id), AlbumTitle={'S': f'Greatest Hits-{key_id}'},
+                Length={'N': str(rng.randrange(100))}, Awards={'N': str(rng.randrange(2))})
+
+
+def _run_operation(client, table_name, operation, keys, rng, query_limit, shard_map=None):
+    '''
+    One request of `operation`; returns the response. With a (hash mode) `shard_map` every key goes
+    to its shard and a query reads all shards of its key concurrently.
+    '''
+    physical = shard_map.to_physical if shard_map is not None else (lambda item: item)
+    key_id = keys.next()
+    if operation == 'get':
+        return client.get_item(TableName=table_name, Key=physical(_key(key_id)))
+    if operation == 'put':
+        return client.put_item(TableName=table_name, Item=physical(_item(key_id, rng)))
+    if operation == 'update':
+        return client.update_item(TableName=table_name, Key=physical(_key(key_id)), UpdateExpression='SET #l = :l',
+                                  ExpressionAttributeNames={'#l': 'Length'},
+                                  ExpressionAttributeValues={':l': {'N': str(rng.randrange(100))}})
+    if operation == 'query':
+        artist = _key(key_id)['Artist']['S']
+        shards = shard_map.physical_keys(artist) if shard_map is not None else [artist]
+        responses = _fan_out([lambda k=k: client.query(TableName=table_name, KeyConditionExpression='#a = :a',
+                                                       Limit=query_limit, ExpressionAttributeNames={'#a': 'Artist'},
+                                                       ExpressionAttributeValues={':a': {'S': k}})
+                              for k in shards], len(shards))
+        return max(responses, key=lambda resp: resp['ResponseMetadata'].get('RetryAttempts', 0))
+    other = keys.next()
+    if other == key_id:
+        other = key_id + 1
+    return client.transact_write_items(TransactItems=[
+        {'Put': {'TableName': table_name, 'Item': physical(_item(key_id, rng))}},
+        {'Update': {'TableName': table_name, 'Key': physical(_key(other)), 'UpdateExpression': 'ADD #w :one',
+                    'ExpressionAttributeNames': {'#w': 'Awards'},
+                    'ExpressionAttributeValues': {':one': {'N': '1'}}}},
+    ])
+
+
+def _worker(worker_id, config, results):
+    '''
+    One load generator process: `threads` client threads for its share of the rate or concurrency,
+    sending a _Stats snapshot to `results` every report interval.
+    '''
+    close_boto_registry()
+    client = _get_boto_client('dynamodb')
+    mix = config['mix']
+    operations = [operation for operation, _ in mix]
+    weights = list(itertools.accumulate(weight for _, weight in mix))
+    stats = _Stats()
+    seed = config['seed'] + worker_id * 1000 if config['seed'] is not None else None
+    local = threading.local()
+    thread_ids = itertools.count()
+
+    def call(intended_at, deadline=None):
+        if not hasattr(local, 'keys'):
+            thread_seed = None if seed is None else seed + next(thread_ids)
+            local.keys, local.rng = ZipfKeys(config['key_space'], config['zipf'], thread_seed), random.Random(thread_seed)
+        operation = operations[bisect.bisect_left(weights, local.rng.random() * weights[-1])]
+        if deadline is not None and time.perf_counter() >= deadline:
+            stats.drop(operation)
+            return
+        error, retries = None, 0
+        try:
+            resp = _run_operation(client, config['table_name'], operation, local.keys, local.rng, config['query_limit'],
+                                  config['shard_map'])
+            retries = resp['ResponseMetadata'].get('RetryAttempts', 0)
+        except Exception as ex:
+            response = getattr(ex, 'response', None) or {}
+            error = (response.get('Error') or {}).get('Code') or type(ex).__name__
+            retries = (response.get('ResponseMetadata') or {}).get('RetryAttempts', 0)
+        # Open loop measures from the intended start, so queueing behind a slow table counts too.
+        stats.record(operation, time.perf_counter() - intended_at, error, retries)
+
+    started_at = time.perf_counter()
+    deadline = started_at + config['duration']
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(config['report_interval']):
+            results.put(('interval', worker_id, stats.snapshot(), time.perf_counter() - started_at))
+
+    reporter = threading.Thread(target=report, name='loadgen-report', daemon=True)
+    reporter.start()
+    try:
+        if config['rate']:
+            _open_loop(call, config['rate'], config['threads'], deadline)
+        else:
+            _closed_loop(call, config['threads'], deadline)
+    finally:
+        stop.set()
+        reporter.join()
+        results.put(('done', worker_id, stats.snapshot(), time.perf_counter() - started_at))
+
+
+def _closed_loop(call, threads, deadline):
+    def loop():
+        while time.perf_counter() < deadline:
+            call(time.perf_counter())
+
+    workers = [threading.Thread(target=loop, name=f'loadgen-{i}') for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _open_loop(call, rate, threads, deadline):
+    # Requests start on a fixed schedule whatever the latency; a full pool delays them, it does not skip them.
+    # Arrivals still queued at the deadline are dropped (counted, not sent), so the run ends on time.
+    interval = 1.0 / rate
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='loadgen') as executor:
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(call, next_at, deadline)
+            next_at += interval
+
+
+class LoadReport:
+    '''
+    Merged results of every worker: per operation counts, errors, throttles and a Histogram.
+    '''
+
+    def __init__(self):
+        self.operations = {}
+        self.started_at = time.perf_counter()
+
+    def merge(self, snapshot):
+        for operation, stats in snapshot.items():
+            total = self.operations.get(operation)
+            if total is None:
+                total = self.operations[operation] = _new_stats()
+            total['count'] += stats['count']
+            total['dropped'] += stats['dropped']
+            total['throttles'] += stats['throttles']
+            total['retries'] += stats['retries']
+            total['histogram'].merge(stats['histogram'])
+            for code, count in stats['errors'].items():
+                total['errors'][code] = total['errors'].get(code, 0) + count
+
+    def summary(self, elapsed=None):
+        elapsed = elapsed or time.perf_counter() - self.started_at
+        operations = {operation: self.operations[operation] for operation in sorted(self.operations, key=OPERATIONS.index)}
+        if operations:
+            operations['all'] = _merged_all(self.operations)
+        rows = {}
+        for operation, stats in operations.items():
+            count, histogram = stats['count'], stats['histogram']
+            errors = sum(stats['errors'].values())
+            rows[operation] = {
+                'count': count,
+                'ops_per_sec': round(count / elapsed, 1) if elapsed else None,
+                'p50_ms': _round(histogram.percentile(50)),
+                'p90_ms': _round(histogram.percentile(90)),
+                'p99_ms': _round(histogram.percentile(99)),
+                'p999_ms': _round(histogram.percentile(99.9)),
+                'error_rate': round(errors / count, 4) if count else 0.0,
+                'throttle_rate': round(stats['throttles'] / count, 4) if count else 0.0,
+                'retries': stats['retries'],
+                'dropped': stats['dropped'],
+                'errors': dict(stats['errors']),
+            }
+        return rows
+
+
+def _merged_all(operations):
+    merged = _new_stats()
+    for stats in operations.values():
+        merged['count'] += stats['count']
+        merged['dropped'] += stats['dropped']
+        merged['throttles'] += stats['throttles']
+        merged['retries'] += stats['retries']
+        merged['histogram'].merge(stats['histogram'].buckets)
+        for code, count in stats['errors'].items():
+            merged['errors'][code] = merged['errors'].get(code, 0) + count
+    return merged
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def format_row(operation, row):
+    text = (f'{operation:<9} {row["ops_per_sec"]:>9} ops/s  p50={row["p50_ms"]}ms p90={row["p90_ms"]}ms '
+            f'p99={row["p99_ms"]}ms p99.9={row["p999_ms"]}ms')
+    if row['error_rate'] or row['throttle_rate']:
+        text += f'  errors={row["error_rate"]:.2%} throttles={row["throttle_rate"]:.2%}'
+    if row['dropped']:
+        text += f'  dropped={row["dropped"]}'
+    return text
+
+
+def run_load(table_name, mix=DEFAULT_MIX, rate=None, concurrency=32, processes=None, duration=30.0, key_space=10000,
+             zipf=1.1, query_limit=10, report_interval=1.0, seed=None, live=True):
+    '''
+    Drive `table_name` with the operation `mix` from a pool of `processes` worker processes for
+    `duration` seconds: open loop at `rate` requests per second in total when it is set, closed
+    loop with `concurrency` requests in flight in total otherwise. Keys follow a Zipf distribution
+    over `key_space` song keys; a hash-sharded table is driven through its ShardMap. Prints a live
+    line per report interval and returns the final LoadReport summary ({operation or 'all': row}).
+    '''
+    mix = parse_mix(mix)
+    processes = max(1, min(processes or os.cpu_count() or 1, concurrency))
+    threads = max(1, math.ceil(concurrency / processes))
+    config = {
+        'table_name': table_name, 'mix': mix, 'duration': float(duration), 'key_space': int(key_space),
+        'zipf': float(zipf), 'query_limit': query_limit, 'report_interval': report_interval, 'seed': seed,
+        'rate': rate / processes if rate else None, 'threads': threads,
+        # Worker processes are spawned and do not see sharding configured in this one.
+        'shard_map': routable_sharding(table_name, 'load_test'),
+    }
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(worker_id, config, results), name=f'loadgen-{worker_id}')
+               for worker_id in range(processes)]
+    for worker in workers:
+        worker.start()
+    total, interval = LoadReport(), LoadReport()
+    running, reported, rounds, elapsed = len(workers), set(), 0, 0.0
+    try:
+        while running:
+            try:
+                kind, worker_id, snapshot, worker_elapsed = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            total.merge(snapshot)
+            elapsed = max(elapsed, worker_elapsed)
+            if kind == 'done':
+                running -= 1
+                continue
+            # Every worker reports once per interval: print when the round is complete.
+            interval.merge(snapshot)
+            reported.add(worker_id)
+            if len(reported) >= running:
+                rounds += 1
+                rows = interval.summary(report_interval)
+                if live and 'all' in rows:
+                    print(f'[{rounds * report_interval:6.1f}s] {format_row("all", rows["all"])}')
+                interval, reported = LoadReport(), set()
+    finally:
+        for worker in workers:
+            worker.join()
+    # Rates are over the measured time the workers generated load, not counting process start-up.
+    return total.summary(elapsed or config['duration'])
+
+
+def save_report(summary, path, **meta):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'operations': summary}, f, indent=2)
@@ -0,0 +1,1485 @@
+import bisect
+import copy
+import datetime
+import decimal
+import functools
+import math
+import re
+import threading
+import time
+import uuid
+import zlib
+
+from my_aws_py_base import register_client_hook
+
+
+PAGE_BYTES = 1024 * 1024
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+TRANSACT_MAX_ACTIONS = 100
+IDEMPOTENCY_WINDOW = 600.0
+_TOKEN_SPACE = 2 ** 32
+
+
+class MemoryDynamoDBError(Exception):
+    '''
+    A DynamoDB error response: `code` is the error code botocore maps to an exception class.
+    '''
+
+    def __init__(self, code, message, **extra):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.extra = extra
+
+
+def _validation(message):
+    return MemoryDynamoDBError('ValidationException', message)
+
+
+def _not_found(table_name):
+    return MemoryDynamoDBError('ResourceNotFoundException',
+                               f'Requested resource not found: Table: {table_name} not found')
+
+
+class _ConditionFailed(Exception):
+    def __init__(self, item):
+        self.item = item
+
+
+class _Max:
+    # Compares greater than anything: (v, _MAX) bounds every (v, ...) key from above.
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_MAX = _Max()
+
+
+# Attribute values ---------------------------------------------------------------------------------
+
+def _number(text):
+    try:
+        return decimal.Decimal(text)
+    except decimal.InvalidOperation:
+        raise _validation(f'A value provided cannot be converted into a number: {text}') from None
+
+
+def _format_number(value):
+    text = format(value.normalize(), 'f')
+    return text[:-2] if text.endswith('.0') else text
+
+
+def _binary(raw):
+    return raw.encode() if isinstance(raw, str) else bytes(raw)
+
+
+def _scalar(value):
+    '''
+    Python value of a key attribute ({'S'}, {'N'} or {'B'}) that sorts like DynamoDB sorts it.
+    '''
+    (kind, raw), = value.items()
+    if kind == 'S':
+        return raw
+    if kind == 'N':
+        return _number(raw)
+    if kind == 'B':
+        return _binary(raw)
+    raise _validation(f'Key attributes must be scalars of type S, N or B, not {kind}')
+
+
+def _equal(a, b):
+    (kind, raw), = a.items()
+    (other_kind, other), = b.items()
+    if kind != other_kind:
+        return False
+    if kind == 'N':
+        return _number(raw) == _number(other)
+    if kind == 'B':
+        return _binary(raw) == _binary(other)
+    if kind == 'NS':
+        return {_number(n) for n in raw} == {_number(n) for n in other}
+    if kind in ('SS', 'BS'):
+        return set(raw) == set(other)
+    if kind == 'L':
+        return len(raw) == len(other) and all(_equal(x, y) for x, y in zip(raw, other))
+    if kind == 'M':
+        return raw.keys() == other.keys() and all(_equal(raw[k], other[k]) for k in raw)
+    return raw == other
+
+
+def _compare(a, b):
+    '''
+    -1, 0 or 1 for two S, N or B values of the same type; None when they cannot be ordered.
+    '''
+    if a is None or b is None:
+        return None
+    (kind, _), = a.items()
+    (other_kind, _), = b.items()
+    if kind != other_kind or kind not in ('S', 'N', 'B'):
+        return None
+    x, y = _scalar(a), _scalar(b)
+    return (x > y) - (x < y)
+
+
+def _value_size(value):
+    (kind, raw), = value.items()
+    if kind == 'S':
+        return len(raw.encode())
+    if kind == 'N':
+        return len(raw.strip('-').replace('.', '')) // 2 + 1
+    if kind == 'B':
+        return len(_binary(raw))
+    if kind in ('BOOL', 'NULL'):
+        return 1
+    if kind == 'SS':
+        return sum(len(v.encode()) for v in raw)
+    if kind == 'NS':
+        return sum(len(v) // 2 + 1 for v in raw)
+    if kind == 'BS':
+        return sum(len(_binary(v)) for v in raw)
+    if kind == 'L':
+        return 3 + sum(1 + _value_size(v) for v in raw)
+    return 3 + sum(1 + len(k.encode()) + _value_size(v) for k, v in raw.items())
+
+
+def item_size(item):
+    '''
+    Size of an item the way DynamoDB bills it: attribute names plus values, in bytes.
+    '''
+    return sum(len(name.encode()) + _value_size(value) for name, value in item.items())
+
+
+# Expressions ---------------------------------------------------------------------------------------
+
+_TOKEN = re.compile(r'\s*(?:(?P<name>#[A-Za-z0-9_]+)|(?P<value>:[A-Za-z0-9_]+)|(?P<number>\d+)'
+                    r'|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)|(?P<op><>|<=|>=|[=<>(),.\[\]+\-]))')
+_COMPARATORS = ('=', '<>', '<', '<=', '>', '>=')
+_CONDITION_FUNCTIONS = ('attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains')
+_VALUE_FUNCTIONS = ('size', 'if_not_exists', 'list_append')
+_UPDATE_CLAUSES = ('SET', 'REMOVE', 'ADD', 'DELETE')
+
+
+def _tokenize(expression):
+    tokens, pos = [], 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise _validation(f'Invalid expression: unexpected character at {pos}: {expression!r}')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    '''
+    Recursive descent parser of condition, projection and update expressions into tuples:
+    ('and'|'or', a, b), ('not', a), ('cmp', op, a, b), ('between', a, lo, hi), ('in', a, values),
+    ('call', function, args) and the operands ('path', elements) and ('value', placeholder).
+    '''
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def _peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise _validation(f'Invalid expression: unexpected end of expression: {self.expression!r}')
+        self.pos += 1
+        return token
+
+    def _expect(self, text):
+        kind, token = self._next()
+        if token != text:
+            raise _validation(f'Invalid expression: expected {text!r}, found {token!r}: {self.expression!r}')
+
+    def _keyword(self, word):
+        kind, token = self._peek()
+        if kind == 'ident' and token.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def _done(self):
+        if self._peek()[0] is not None:
+            raise _validation(f'Invalid expression: unexpected token {self._peek()[1]!r}: {self.expression!r}')
+
+    def condition(self):
+        node = self._and()
+        while self._keyword('OR'):
+            node = ('or', node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._keyword('AND'):
+            node = ('and', node, self._not())
+        return node
+
+    def _not(self):
+        if self._keyword('NOT'):
+            return ('not', self._not())
+        return self._primary()
+
+    def _primary(self):
+        kind, token = self._peek()
+        if token == '(':
+            self._next()
+            node = self.condition()
+            self._expect(')')
+            return node
+        if kind == 'ident' and self._peek(1)[1] == '(' and token.lower() in _CONDITION_FUNCTIONS:
+            return self._call()
+        left = self.operand()
+        kind, token = self._peek()
+        if token in _COMPARATORS:
+            self._next()
+            return ('cmp', token, left, self.operand())
+        if self._keyword('BETWEEN'):
+            low = self.operand()
+            if not self._keyword('AND'):
+                raise _validation(f'Invalid expression: BETWEEN without AND: {self.expression!r}')
+            return ('between', left, low, self.operand())
+        if self._keyword('IN'):
+            self._expect('(')
+            values = [self.operand()]
+            while self._peek()[1] == ',':
+                self._next()
+                values.append(self.operand())
+            self._expect(')')
+            return ('in', left, tuple(values))
+        raise _validation(f'Invalid expression: expected a comparison after an operand: {self.expression!r}')
+
+    def _call(self):
+        _, function = self._next()
+        self._expect('(')
+        args = [self.operand()]
+        while self._peek()[1] == ',':
+            self._next()
+            args.append(self.operand())
+        self._expect(')')
+        return ('call', function.lower(), tuple(args))
+
+    def operand(self):
+        kind, token = self._peek()
+        if kind == 'value':
+            self._next()
+            return ('value', token)
+        if kind == 'ident' and self._peek(1)[1] == '(' and token.lower() in _VALUE_FUNCTIONS + _CONDITION_FUNCTIONS:
+            return self._call()
+        return self.path()
+
+    def path(self):
+        kind, token = self._next()
+        if kind not in ('name', 'ident'):
+            raise _validation(f'Invalid expression: expected an attribute, found {token!r}: {self.expression!r}')
+        elements = [token]
+        while self._peek()[1] in ('.', '['):
+            if self._next()[1] == '.':
+                kind, token = self._next()
+                if kind not in ('name', 'ident'):
+                    raise _validation(f'Invalid document path after ".": {self.expression!r}')
+                elements.append(token)
+            else:
+                kind, token = self._next()
+                if kind != 'number':
+                    raise _validation(f'Invalid list index: {self.expression!r}')
+                elements.append(int(token))
+                self._expect(']')
+        return ('path', tuple(elements))
+
+    def paths(self):
+        paths = [self.path()]
+        while self._peek()[1] == ',':
+            self._next()
+            paths.append(self.path())
+        self._done()
+        return tuple(paths)
+
+    def _set_value(self):
+        node = self.operand()
+        kind, token = self._peek()
+        if token in ('+', '-'):
+            self._next()
+            node = ('arith', token, node, self.operand())
+        return node
+
+    def update(self):
+        actions = []
+        while self._peek()[0] is not None:
+            kind, clause = self._next()
+            clause = (clause or '').upper()
+            if clause not in _UPDATE_CLAUSES:
+                raise _validation(f'Invalid UpdateExpression: unknown clause {clause!r}: {self.expression!r}')
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self._expect('=')
+                    actions.append(('SET', path, self._set_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                else:
+                    actions.append((clause, path, self.operand()))
+                if self._peek()[1] != ',':
+                    break
+                self._next()
+        if not actions:
+            raise _validation('Invalid UpdateExpression: the expression is empty')
+        return tuple(actions)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_condition(expression):
+    parser = _Parser(expression)
+    node = parser.condition()
+    parser._done()
+    return node
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_projection(expression):
+    return _Parser(expression).paths()
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_update(expression):
+    return _Parser(expression).update()
+
+
+class _Expressions:
+    '''
+    ExpressionAttributeNames/Values of one request, resolving the placeholders of parsed expressions.
+    '''
+
+    def __init__(self, params):
+        self.names = params.get('ExpressionAttributeNames') or {}
+        self.values = params.get('ExpressionAttributeValues') or {}
+
+    def path(self, node):
+        elements = []
+        for element in node[1]:
+            if isinstance(element, str) and element.startswith('#'):
+                if element not in self.names:
+                    raise _validation(f'An expression attribute name used in the document path is not defined; '
+                                      f'attribute name: {element}')
+                element = self.names[element]
+            elements.append(element)
+        return tuple(elements)
+
+    def value(self, node):
+        if node[1] not in self.values:
+            raise _validation(f'An expression attribute value used in expression is not defined; '
+                              f'attribute value: {node[1]}')
+        return self.values[node[1]]
+
+    def operand(self, node):
+        '''
+        operand(item) -> attribute value, or None when the path does not exist.
+        '''
+        if node[0] == 'value':
+            value = self.value(node)
+            return lambda item: value
+        if node[0] == 'path':
+            path = self.path(node)
+            return lambda item: _get_path(item, path)
+        if node[0] == 'call' and node[1] == 'size':
+            target = self.operand(node[2][0])
+            return lambda item: _size(target(item))
+        if node[0] == 'call' and node[1] == 'if_not_exists':
+            target, default = self.operand(node[2][0]), self.operand(node[2][1])
+            return lambda item: _first_present(target(item), default, item)
+        if node[0] == 'call' and node[1] == 'list_append':
+            first, second = self.operand(node[2][0]), self.operand(node[2][1])
+            return lambda item: _list_append(first(item), second(item))
+        if node[0] == 'arith':
+            left, right = self.operand(node[2]), self.operand(node[3])
+            sign = 1 if node[1] == '+' else -1
+            return lambda item: _arith(left(item), right(item), sign)
+        raise _validation(f'Invalid operand: {node[1]}')
+
+    def condition(self, node):
+        '''
+        condition(item) -> bool for a parsed condition; item is {} for a missing item.
+        '''
+        kind = node[0]
+        if kind in ('and', 'or'):
+            left, right = self.condition(node[1]), self.condition(node[2])
+            if kind == 'and':
+                return lambda item: left(item) and right(item)
+            return lambda item: left(item) or right(item)
+        if kind == 'not':
+            inner = self.condition(node[1])
+            return lambda item: not inner(item)
+        if kind == 'cmp':
+            return _comparison(node[1], self.operand(node[2]), self.operand(node[3]))
+        if kind == 'between':
+            target, low, high = self.operand(node[1]), self.operand(node[2]), self.operand(node[3])
+
+            def between(item):
+                value = target(item)
+                lower, upper = _compare(value, low(item)), _compare(value, high(item))
+                return lower is not None and upper is not None and lower >= 0 and upper <= 0
+            return between
+        if kind == 'in':
+            target, candidates = self.operand(node[1]), [self.operand(v) for v in node[2]]
+
+            def is_in(item):
+                value = target(item)
+                return value is not None and any(c(item) is not None and _equal(value, c(item)) for c in candidates)
+            return is_in
+        if kind == 'call':
+            return self._function(node[1], node[2])
+        raise _validation(f'Invalid condition: {kind}')
+
+    def _function(self, function, args):
+        if function in ('attribute_exists', 'attribute_not_exists'):
+            path = self.path(args[0])
+            exists = function == 'attribute_exists'
+            return lambda item: (_get_path(item, path) is not None) == exists
+        target, argument = self.operand(args[0]), self.operand(args[1])
+        if function == 'attribute_type':
+            return lambda item: target(item) is not None and next(iter(target(item))) == argument(item).get('S')
+        if function == 'begins_with':
+            def begins_with(item):
+                value, prefix = target(item), argument(item)
+                if value is None or prefix is None:
+                    return False
+                (kind, raw), = value.items()
+                (prefix_kind, prefix_raw), = prefix.items()
+                if kind != prefix_kind or kind not in ('S', 'B'):
+                    return False
+                return raw.startswith(prefix_raw) if kind == 'S' else _binary(raw).startswith(_binary(prefix_raw))
+            return begins_with
+        if function == 'contains':
+            def contains(item):
+                value, operand = target(item), argument(item)
+                if value is None or operand is None:
+                    return False
+                (kind, raw), = value.items()
+                (operand_kind, operand_raw), = operand.items()
+                if kind == 'S' and operand_kind == 'S':
+                    return operand_raw in raw
+                if kind in ('SS', 'NS', 'BS') and operand_kind == kind[0]:
+                    return any(_equal({operand_kind: member}, operand) for member in raw)
+                if kind == 'L':
+                    return any(_equal(member, operand) for member in raw)
+                return False
+            return contains
+        raise _validation(f'Invalid function name; function: {function}')
+
+
+def _comparison(operator, left, right):
+    if operator == '=':
+        return lambda item: (lambda a, b: a is not None and b is not None and _equal(a, b))(left(item), right(item))
+    if operator == '<>':
+        return lambda item: (lambda a, b: a is None or b is None or not _equal(a, b))(left(item), right(item))
+    accept = {'<': (-1,), '<=': (-1, 0), '>': (1,), '>=': (1, 0)}[operator]
+    return lambda item: _compare(left(item), right(item)) in accept
+
+
+def _get_path(item, path):
+    value = item.get(path[0])
+    for element in path[1:]:
+        if value is None:
+            return None
+        if isinstance(element, int):
+            elements = value.get('L')
+            value = elements[element] if elements is not None and element < len(elements) else None
+        else:
+            members = value.get('M')
+            value = members.get(element) if members is not None else None
+    return value
+
+
+def _set_path(item, path, value):
+    if len(path) == 1:
+        item[path[0]] = value
+        return
+    parent = _get_path(item, path[:-1])
+    element = path[-1]
+    if parent is not None and isinstance(element, int) and 'L' in parent:
+        if element < len(parent['L']):
+            parent['L'][element] = value
+        else:
+            parent['L'].append(value)
+    elif parent is not None and isinstance(element, str) and 'M' in parent:
+        parent['M'][element] = value
+    else:
+        raise _validation('The document path provided in the update expression is invalid for update')
+
+
+def _remove_path(item, path):
+    if len(path) == 1:
+        item.pop(path[0], None)
+        return
+    parent = _get_path(item, path[:-1])
+    element = path[-1]
+    if parent is not None and isinstance(element, int) and 'L' in parent:
+        if element < len(parent['L']):
+            del parent['L'][element]
+    elif parent is not None and isinstance(element, str) and 'M' in parent:
+        parent['M'].pop(element, None)
+
+
+def _size(value):
+    if value is None:
+        return None
+    (kind, raw), = value.items()
+    if kind == 'S':
+        return {'N': str(len(raw))}
+    if kind == 'B':
+        return {'N': str(len(_binary(raw)))}
+    if kind in ('SS', 'NS', 'BS', 'L', 'M'):
+        return {'N': str(len(raw))}
+    return None
+
+
+def _first_present(value, default, item):
+    return value if value is not None else default(item)
+
+
+def _list_append(first, second):
+    if first is None or second is None or 'L' not in first or 'L' not in second:
+        raise _validation('An operand in the update expression has an incorrect data type')
+    return {'L': list(first['L']) + list(second['L'])}
+
+
+def _arith(left, right, sign):
+    if left is None or right is None or 'N' not in left or 'N' not in right:
+        raise _validation('An operand in the update expression has an incorrect data type')
+    return {'N': _format_number(_number(left['N']) + sign * _number(right['N']))}
+
+
+def _project(item, paths):
+    '''
+    The attributes of `item` at the resolved document `paths`, nested structure kept.
+    '''
+    projected = {}
+    for path in paths:
+        value = _get_path(item, path)
+        if value is None:
+            continue
+        if len(path) == 1:
+            projected[path[0]] = value
+            continue
+        # Rebuild the containers down to the projected value; list elements are compacted.
+        target = projected
+        source = item
+        for depth, element in enumerate(path[:-1]):
+            source_value = source.get(element) if isinstance(source, dict) else source[element]
+            kind = 'L' if isinstance(path[depth + 1], int) else 'M'
+            container = target.get(element) if isinstance(target, dict) else None
+            if container is None:
+                container = {kind: [] if kind == 'L' else {}}
+                if isinstance(target, dict):
+                    target[element] = container
+                else:
+                    target.append(container)
+            target = container[kind]
+            source = source_value[kind]
+        if isinstance(target, dict):
+            target[path[-1]] = value
+        else:
+            target.append(value)
+    return projected
+
+
+# Storage ------------------------------------------------------------------------------------------
+
+def _token(hash_key):
+    if isinstance(hash_key, decimal.Decimal):
+        data = b'N' + _format_number(hash_key).encode()
+    elif isinstance(hash_key, bytes):
+        data = b'B' + hash_key
+    else:
+        data = b'S' + hash_key.encode()
+    return zlib.crc32(data)
+
+
+class _Partitions:
+    '''
+    Items grouped by hash key; each partition keeps its sort keys in a sorted list, so a key
+    condition is two bisections plus the items it returns. Partitions are ordered by a hash
+    token of their key, which is the order (and segment split) of scans.
+    '''
+
+    def __init__(self):
+        self.partitions = {}
+        self.tokens = []
+
+    def get(self, hash_key, sort_key):
+        partition = self.partitions.get(hash_key)
+        return partition[1].get(sort_key) if partition else None
+
+    def put(self, hash_key, sort_key, item):
+        partition = self.partitions.get(hash_key)
+        if partition is None:
+            partition = self.partitions[hash_key] = ([], {})
+            bisect.insort(self.tokens, (_token(hash_key), hash_key))
+        keys, items = partition
+        if sort_key not in items:
+            bisect.insort(keys, sort_key)
+        items[sort_key] = item
+
+    def remove(self, hash_key, sort_key):
+        partition = self.partitions.get(hash_key)
+        if partition is None or sort_key not in partition[1]:
+            return None
+        keys, items = partition
+        del keys[bisect.bisect_left(keys, sort_key)]
+        item = items.pop(sort_key)
+        if not items:
+            del self.partitions[hash_key]
+            del self.tokens[bisect.bisect_left(self.tokens, (_token(hash_key), hash_key))]
+        return item
+
+    def query(self, hash_key, bounds, forward=True, after=None):
+        '''
+        Yield (sort_key, item) of one partition between the `bounds` probes, after `after`.
+        '''
+        partition = self.partitions.get(hash_key)
+        if partition is None:
+            return
+        keys, items = partition
+        low, high, prefix = bounds
+        start = bisect.bisect_left(keys, low) if low is not None else 0
+        stop = bisect.bisect_left(keys, high) if high is not None else len(keys)
+        if after is not None:
+            if forward:
+                start = max(start, bisect.bisect_right(keys, after))
+            else:
+                stop = min(stop, bisect.bisect_left(keys, after))
+        indexes = range(start, stop) if forward else range(stop - 1, start - 1, -1)
+        for index in indexes:
+            sort_key = keys[index]
+            if prefix is not None and not _starts_with(sort_key[0], prefix):
+                if forward:
+                    return
+                continue
+            yield sort_key, items[sort_key]
+
+    def scan(self, segment=0, total_segments=1, after=None):
+        '''
+        Yield (hash_key, sort_key, item) of one segment in token order, after the (hash, sort) `after`.
+        '''
+        low = segment * _TOKEN_SPACE // total_segments
+        high = (segment + 1) * _TOKEN_SPACE // total_segments
+        if after is not None:
+            after_token = (_token(after[0]), after[0])
+            position = bisect.bisect_left(self.tokens, after_token)
+        else:
+            after_token = None
+            position = bisect.bisect_left(self.tokens, (low,))
+        while position < len(self.tokens):
+            token = self.tokens[position]
+            if token[0] >= high:
+                return
+            hash_key = token[1]
+            keys, items = self.partitions[hash_key]
+            start = bisect.bisect_right(keys, after[1]) if token == after_token else 0
+            for sort_key in keys[start:]:
+                yield hash_key, sort_key, items[sort_key]
+            # The partition may have changed while the caller consumed it: find our place again.
+            position = bisect.bisect_right(self.tokens, token)
+
+
+def _starts_with(value, prefix):
+    return isinstance(value, type(prefix)) and value.startswith(prefix)
+
+
+def _key_bounds(operator, values):
+    '''
+    (low, high, prefix) probes of a range key condition over (range value, ...) sort keys.
+    '''
+    if operator is None:
+        return None, None, None
+    if operator == '=':
+        return (values[0],), (values[0], _MAX), None
+    if operator == '<':
+        return None, (values[0],), None
+    if operator == '<=':
+        return None, (values[0], _MAX), None
+    if operator == '>':
+        return (values[0], _MAX), None, None
+    if operator == '>=':
+        return (values[0],), None, None
+    if operator == 'between':
+        return (values[0],), (values[1], _MAX), None
+    return (values[0],), None, values[0]
+
+
+class _Index:
+    def __init__(self, request, kind, throughput):
+        self.name = request['IndexName']
+        self.kind = kind
+        self.key_schema = request['KeySchema']
+        keys = {key['KeyType']: key['AttributeName'] for key in self.key_schema}
+        self.hash_name, self.range_name = keys['HASH'], keys.get('RANGE')
+        self.projection = dict(request.get('Projection') or {'ProjectionType': 'ALL'})
+        self.throughput = throughput
+        self.items = _Partitions()
+        self.item_count = 0
+        self.size_bytes = 0
+
+    def entry(self, table, item):
+        '''
+        (hash_key, sort_key) of the item in this index, or None when the item is not indexed.
+        '''
+        hash_value = item.get(self.hash_name)
+        if hash_value is None or next(iter(hash_value)) != table.attribute_types.get(self.hash_name):
+            return None
+        if self.range_name:
+            range_value = item.get(self.range_name)
+            if range_value is None or next(iter(range_value)) != table.attribute_types.get(self.range_name):
+                return None
+            range_key = _scalar(range_value)
+        else:
+            range_key = ()
+        return _scalar(hash_value), (range_key, table.key_of(item))
+
+    def projected(self, table, item):
+        projection_type = self.projection.get('ProjectionType', 'ALL')
+        if projection_type == 'ALL':
+            return item
+        names = {table.hash_name, table.range_name, self.hash_name, self.range_name} - {None}
+        if projection_type == 'INCLUDE':
+            names |= set(self.projection.get('NonKeyAttributes') or [])
+        return {name: value for name, value in item.items() if name in names}
+
+    def describe(self, table):
+        description = {
+            'IndexName': self.name,
+            'KeySchema': [dict(key) for key in self.key_schema],
+            'Projection': copy.deepcopy(self.projection),
+            'IndexSizeBytes': self.size_bytes,
+            'ItemCount': self.item_count,
+            'IndexArn': f'{table.arn}/index/{self.name}',
+        }
+        if self.kind == 'gsi':
+            description['IndexStatus'] = 'ACTIVE'
+            if self.throughput:
+                description['ProvisionedThroughput'] = dict(self.throughput, NumberOfDecreasesToday=0)
+        return description
+
+
+class _Table:
+    def __init__(self, params):
+        self.name = params['TableName']
+        self.key_schema = params['KeySchema']
+        keys = {key['KeyType']: key['AttributeName'] for key in self.key_schema}
+        self.hash_name, self.range_name = keys['HASH'], keys.get('RANGE')
+        self.attribute_types = {d['AttributeName']: d['AttributeType'] for d in params['AttributeDefinitions']}
+        for name in keys.values():
+            if name not in self.attribute_types:
+                raise _validation(f'One or more parameter values were invalid: Some index key attributes are not '
+                                  f'defined in AttributeDefinitions. Keys: [{name}]')
+        self.billing_mode = params.get('BillingMode') or 'PROVISIONED'
+        self.throughput = params.get('ProvisionedThroughput')
+        if self.billing_mode == 'PROVISIONED' and not self.throughput:
+            raise _validation('One or more parameter values were invalid: ReadCapacityUnits and WriteCapacityUnits '
+                              'must both be specified when BillingMode is PROVISIONED')
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.arn = f'arn:aws:dynamodb:memory:000000000000:table/{self.name}'
+        self.items = _Partitions()
+        self.item_count = 0
+        self.size_bytes = 0
+        self.indexes = {}
+        for kind, requests in (('gsi', params.get('GlobalSecondaryIndexes')), ('lsi', params.get('LocalSecondaryIndexes'))):
+            for request in requests or []:
+                self.add_index(request, kind)
+
+    def add_index(self, request, kind='gsi'):
+        if request['IndexName'] in self.indexes:
+            raise _validation(f'One or more parameter values were invalid: Index {request["IndexName"]} already exists')
+        index = _Index(request, kind, request.get('ProvisionedThroughput') if kind == 'gsi' else None)
+        for key in index.key_schema:
+            if key['AttributeName'] not in self.attribute_types:
+                raise _validation(f'One or more parameter values were invalid: Some index key attributes are not '
+                                  f'defined in AttributeDefinitions. Keys: [{key["AttributeName"]}]')
+        # Backfill from the current items.
+        for hash_key, (_, items) in self.items.partitions.items():
+            for item in items.values():
+                self._index_put(index, item)
+        self.indexes[index.name] = index
+
+    def key_of(self, item, require=True):
+        '''
+        (hash, range) Python values of the item's primary key; range is () without a range key.
+        '''
+        key = []
+        for name in (self.hash_name, self.range_name):
+            if name is None:
+                key.append(())
+                continue
+            value = item.get(name)
+            if value is None:
+                raise _validation('One or more parameter values were invalid: Missing the key '
+                                  f'{name} in the item')
+            if next(iter(value)) != self.attribute_types[name]:
+                raise _validation('One or more parameter values were invalid: Type mismatch for key '
+                                  f'{name} expected: {self.attribute_types[name]} actual: {next(iter(value))}')
+            key.append(_scalar(value))
+        return tuple(key)
+
+    def validate_key(self, key):
+        names = {self.hash_name, self.range_name} - {None}
+        if set(key) != names:
+            raise _validation('The provided key element does not match the schema')
+        return self.key_of(key)
+
+    def get(self, key):
+        return self.items.get(key[0], (key[1],))
+
+    def key_item(self, item):
+        return {name: item[name] for name in (self.hash_name, self.range_name) if name}
+
+    def _index_put(self, index, item):
+        entry = index.entry(self, item)
+        if entry is not None:
+            index.items.put(entry[0], entry[1], item)
+            index.item_count += 1
+            index.size_bytes += item_size(index.projected(self, item))
+
+    def _index_remove(self, index, item):
+        entry = index.entry(self, item)
+        if entry is not None and index.items.remove(entry[0], entry[1]) is not None:
+            index.item_count -= 1
+            index.size_bytes -= item_size(index.projected(self, item))
+
+    def store(self, key, old, new):
+        '''
+        Replace `old` (None if absent) with `new` (None to delete) and maintain every index.
+        Returns {index name: touched} for the indexes whose entries changed.
+        '''
+        touched = {}
+        for index in self.indexes.values():
+            if old is not None:
+                self._index_remove(index, old)
+            if new is not None:
+                self._index_put(index, new)
+            touched[index.name] = (old is not None and index.entry(self, old) is not None) or \
+                                  (new is not None and index.entry(self, new) is not None)
+        if old is not None:
+            self.item_count -= 1
+            self.size_bytes -= item_size(old)
+        if new is not None:
+            self.items.put(key[0], (key[1],), new)
+            self.item_count += 1
+            self.size_bytes += item_size(new)
+        else:
+            self.items.remove(key[0], (key[1],))
+        return touched
+
+    def describe(self, status='ACTIVE'):
+        description = {
+            'TableName': self.name,
+            'TableArn': self.arn,
+            'TableId': str(uuid.uuid5(uuid.NAMESPACE_URL, self.arn)),
+            'TableStatus': status,
+            'CreationDateTime': self.created_at,
+            'KeySchema': [dict(key) for key in self.key_schema],
+            'AttributeDefinitions': [{'AttributeName': name, 'AttributeType': attribute_type}
+                                     for name, attribute_type in self.attribute_types.items()],
+            'ItemCount': self.item_count,
+            'TableSizeBytes': self.size_bytes,
+            'BillingModeSummary': {'BillingMode': self.billing_mode},
+            'ProvisionedThroughput': dict(self.throughput or {'ReadCapacityUnits': 0, 'WriteCapacityUnits': 0},
+                                          NumberOfDecreasesToday=0),
+        }
+        for kind, field in (('gsi', 'GlobalSecondaryIndexes'), ('lsi', 'LocalSecondaryIndexes')):
+            indexes = [index.describe(self) for index in self.indexes.values() if index.kind == kind]
+            if indexes:
+                description[field] = indexes
+        return description
+
+
+# Engine -------------------------------------------------------------------------------------------
+
+def _read_units(size, consistent):
+    return max(1, math.ceil(size / 4096)) * (1.0 if consistent else 0.5)
+
+
+def _write_units(size):
+    return float(max(1, math.ceil(size / 1024)))
+
+
+class MemoryEngine:
+    '''
+    In-process implementation of the DynamoDB operations this project uses, on the low-level
+    (typed attribute value) request and response shapes. Tables and indexes are _Partitions, so
+    reads cost O(log n + k); every write maintains the indexes of its table in place.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.tables = {}
+        self.backups = {}
+        self._tokens = {}
+
+    def handle(self, operation, params):
+        handler = getattr(self, f'_{operation}', None)
+        if handler is None:
+            raise MemoryDynamoDBError('UnknownOperationException', f'{operation} is not supported by the memory backend')
+        with self._lock:
+            return handler(params)
+
+    def reset(self):
+        with self._lock:
+            self.tables.clear()
+            self.backups.clear()
+            self._tokens.clear()
+
+    def _table(self, table_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            raise _not_found(table_name)
+        return table
+
+    # Control plane
+
+    def _CreateTable(self, params):
+        if params['TableName'] in self.tables:
+            raise MemoryDynamoDBError('ResourceInUseException', f'Table already exists: {params["TableName"]}')
+        table = self.tables[params['TableName']] = _Table(params)
+        return {'TableDescription': table.describe()}
+
+    def _DeleteTable(self, params):
+        table = self._table(params['TableName'])
+        del self.tables[table.name]
+        return {'TableDescription': table.describe('DELETING')}
+
+    def _DescribeTable(self, params):
+        return {'Table': self._table(params['TableName']).describe()}
+
+    def _ListTables(self, params):
+        names = sorted(self.tables)
+        start = params.get('ExclusiveStartTableName')
+        if start:
+            names = names[bisect.bisect_right(names, start):]
+        limit = params.get('Limit') or 100
+        resp = {'TableNames': names[:limit]}
+        if len(names) > limit:
+            resp['LastEvaluatedTableName'] = names[limit - 1]
+        return resp
+
+    def _UpdateTable(self, params):
+        table = self._table(params['TableName'])
+        for definition in params.get('AttributeDefinitions') or []:
+            table.attribute_types[definition['AttributeName']] = definition['AttributeType']
+        if params.get('BillingMode'):
+            table.billing_mode = params['BillingMode']
+        if params.get('ProvisionedThroughput'):
+            table.throughput = params['ProvisionedThroughput']
+        for update in params.get('GlobalSecondaryIndexUpdates') or []:
+            if 'Create' in update:
+                table.add_index(update['Create'])
+            elif 'Delete' in update:
+                name = update['Delete']['IndexName']
+                if name not in table.indexes:
+                    raise MemoryDynamoDBError('ResourceNotFoundException', f'Requested resource not found: '
+                                              f'Index: {name} not found')
+                del table.indexes[name]
+            elif 'Update' in update:
+                name = update['Update']['IndexName']
+                if name not in table.indexes:
+                    raise MemoryDynamoDBError('ResourceNotFoundException', f'Requested resource not found: '
+                                              f'Index: {name} not found')
+                table.indexes[name].throughput = update['Update'].get('ProvisionedThroughput')
+        return {'TableDescription': table.describe()}
+
+    def _CreateBackup(self, params):
+        table = self._table(params['TableName'])
+        arn = f'{table.arn}/backup/{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}'
+        self.backups[arn] = (params['BackupName'], copy.deepcopy(table))
+        return {'BackupDetails': {
+            'BackupArn': arn, 'BackupName': params['BackupName'], 'BackupSizeBytes': table.size_bytes,
+            'BackupStatus': 'AVAILABLE', 'BackupType': 'USER',
+            'BackupCreationDateTime': datetime.datetime.now(datetime.timezone.utc),
+        }}
+
+    # Items
+
+    def _condition(self, params, field='ConditionExpression'):
+        expression = params.get(field)
+        if not expression:
+            return None
+        return _Expressions(params).condition(_parse_condition(expression))
+
+    def _check(self, params, old):
+        condition = self._condition(params)
+        if condition is not None and not condition(old or {}):
+            raise _ConditionFailed(old)
+
+    def _prepare(self, kind, params):
+        '''
+        (table, key, old, new) of one write; raises _ConditionFailed when its condition fails.
+        '''
+        table = self._table(params['TableName'])
+        if kind == 'Put':
+            for legacy in ('Expected', 'ConditionalOperator'):
+                if legacy in params:
+                    raise _validation(f'{legacy} is not supported by the memory backend; use ConditionExpression')
+            new = dict(params['Item'])
+            key = table.key_of(new)
+        else:
+            key = table.validate_key(params['Key'])
+            new = None
+        old = table.get(key)
+        self._check(params, old)
+        if kind == 'Update':
+            new = self._updated(table, params, old)
+        elif kind == 'ConditionCheck':
+            new = old
+        return table, key, old, new
+
+    def _updated(self, table, params, old):
+        if 'AttributeUpdates' in params:
+            raise _validation('AttributeUpdates is not supported by the memory backend; use UpdateExpression')
+        new = copy.deepcopy(old) if old is not None else dict(params['Key'])
+        expression = params.get('UpdateExpression')
+        if not expression:
+            return new
+        expressions = _Expressions(params)
+        key_names = {table.hash_name, table.range_name}
+        source = old or {}
+        # Every value is computed from the item as it was before the update.
+        changes = []
+        for clause, path_node, operand in _parse_update(expression):
+            path = expressions.path(path_node)
+            if path[0] in key_names:
+                raise _validation(f'One or more parameter values were invalid: Cannot update attribute {path[0]}. '
+                                  f'This attribute is part of the key')
+            value = expressions.operand(operand)(source) if operand is not None else None
+            changes.append((clause, path, value))
+        for clause, path, value in changes:
+            if clause == 'SET':
+                _set_path(new, path, value)
+            elif clause == 'REMOVE':
+                _remove_path(new, path)
+            elif clause == 'ADD':
+                _set_path(new, path, _add(_get_path(new, path), value))
+            else:
+                self._delete_from(new, path, _get_path(new, path), value)
+        return new
+
+    @staticmethod
+    def _delete_from(item, path, current, value):
+        if current is None:
+            return
+        (kind, members), = current.items()
+        if kind not in ('SS', 'NS', 'BS') or kind not in value:
+            raise _validation('An operand in the update expression has an incorrect data type')
+        remaining = [member for member in members if not any(_equal({kind[0]: member}, {kind[0]: other})
+                                                             for other in value[kind])]
+        if remaining:
+            _set_path(item, path, {kind: remaining})
+        else:
+            _remove_path(item, path)
+
+    def _capacity(self, params, table, units, kind, index_units=None, index_name=None):
+        mode = params.get('ReturnConsumedCapacity') or 'NONE'
+        if mode == 'NONE':
+            return None
+        field = 'ReadCapacityUnits' if kind == 'read' else 'WriteCapacityUnits'
+        index_units = index_units or {}
+        total = units + sum(index_units.values())
+        consumed = {'TableName': table.name, 'CapacityUnits': total, field: total}
+        if mode == 'INDEXES':
+            if index_name is None:
+                consumed['Table'] = {'CapacityUnits': units, field: units}
+            if index_units:
+                target = 'LocalSecondaryIndexes' if table.indexes[next(iter(index_units))].kind == 'lsi' \
+                    else 'GlobalSecondaryIndexes'
+                consumed[target] = {name: {'CapacityUnits': u, field: u} for name, u in index_units.items()}
+        return consumed
+
+    def _write_capacity(self, params, table, old, new, touched, factor=1.0):
+        size = max(item_size(old) if old else 0, item_size(new) if new else 0)
+        index_units = {name: _write_units(size) * factor for name, hit in touched.items() if hit}
+        return self._capacity(params, table, _write_units(size) * factor, 'write', index_units)
+
+    def _return_values(self, params, old, new):
+        mode = params.get('ReturnValues') or 'NONE'
+        if mode == 'ALL_OLD':
+            return dict(old) if old else None
+        if mode == 'ALL_NEW':
+            return dict(new) if new else None
+        if mode in ('UPDATED_OLD', 'UPDATED_NEW'):
+            before, after = old or {}, new or {}
+            changed = {name for name in set(before) | set(after)
+                       if name not in after or name not in before or not _equal(before[name], after[name])}
+            source = before if mode == 'UPDATED_OLD' else after
+            return {name: source[name] for name in changed if name in source} or None
+        return None
+
+    def _write(self, kind, params):
+        try:
+            table, key, old, new = self._prepare(kind, params)
+        except _ConditionFailed as failed:
+            extra = {}
+            if params.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and failed.item:
+                extra['Item'] = dict(failed.item)
+            raise MemoryDynamoDBError('ConditionalCheckFailedException', 'The conditional request failed', **extra)
+        touched = table.store(key, old, new)
+        resp = {}
+        attributes = self._return_values(params, old, new)
+        if attributes:
+            resp['Attributes'] = attributes
+        consumed = self._write_capacity(params, table, old, new, touched)
+        if consumed:
+            resp['ConsumedCapacity'] = consumed
+        return resp
+
+    def _PutItem(self, params):
+        return self._write('Put', params)
+
+    def _UpdateItem(self, params):
+        return self._write('Update', params)
+
+    def _DeleteItem(self, params):
+        return self._write('Delete', params)
+
+    def _projection(self, params):
+        if params.get('ProjectionExpression'):
+            expressions = _Expressions(params)
+            paths = [expressions.path(node) for node in _parse_projection(params['ProjectionExpression'])]
+            return lambda item: _project(item, paths)
+        if params.get('AttributesToGet'):
+            names = set(params['AttributesToGet'])
+            return lambda item: {name: value for name, value in item.items() if name in names}
+        return dict
+
+    def _GetItem(self, params):
+        table = self._table(params['TableName'])
+        item = table.get(table.validate_key(params['Key']))
+        resp = {}
+        if item is not None:
+            resp['Item'] = self._projection(params)(item)
+        consumed = self._capacity(params, table, _read_units(item_size(item) if item else 0,
+                                                             params.get('ConsistentRead')), 'read')
+        if consumed:
+            resp['ConsumedCapacity'] = consumed
+        return resp
+
+    # Query and Scan
+
+    def _source(self, table, params):
+        index_name = params.get('IndexName')
+        if not index_name:
+            return None, table.hash_name, table.range_name
+        index = table.indexes.get(index_name)
+        if index is None:
+            raise _validation(f'The table does not have the specified index: {index_name}')
+        if params.get('ConsistentRead') and index.kind == 'gsi':
+            raise _validation('Consistent reads are not supported on global secondary indexes')
+        return index, index.hash_name, index.range_name
+
+    def _key_condition(self, params, table, hash_name, range_name):
+        expression = params.get('KeyConditionExpression')
+        if not expression:
+            raise _validation('Either the KeyConditions or KeyConditionExpression parameter must be specified')
+        expressions = _Expressions(params)
+        terms, stack = [], [_parse_condition(expression)]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'and':
+                stack.extend((node[2], node[1]))
+            else:
+                terms.append(node)
+        hash_key, range_condition = None, None
+        for node in terms:
+            if node[0] == 'cmp' and node[2][0] == 'path':
+                name, operator, values = expressions.path(node[2])[0], node[1], [node[3]]
+            elif node[0] == 'between' and node[1][0] == 'path':
+                name, operator, values = expressions.path(node[1])[0], 'between', [node[2], node[3]]
+            elif node[0] == 'call' and node[1] == 'begins_with' and node[2][0][0] == 'path':
+                name, operator, values = expressions.path(node[2][0])[0], 'begins_with', [node[2][1]]
+            else:
+                raise _validation(f'Invalid KeyConditionExpression: {expression}')
+            values = [expressions.value(value) if value[0] == 'value' else None for value in values]
+            if None in values or operator == '<>':
+                raise _validation(f'Invalid KeyConditionExpression: {expression}')
+            for value in values:
+                if next(iter(value)) != table.attribute_types.get(name):
+                    raise _validation('One or more parameter values were invalid: Condition parameter type does '
+                                      'not match schema type')
+            values = [_scalar(value) for value in values]
+            if name == hash_name and operator == '=' and hash_key is None:
+                hash_key = values[0]
+            elif name == range_name and range_condition is None:
+                range_condition = (operator, values)
+            else:
+                raise _validation(f'Query key condition not supported: {expression}')
+        if hash_key is None:
+            raise _validation('Query condition missed key schema element: ' + hash_name)
+        return hash_key, range_condition or (None, None)
+
+    def _start_key(self, table, index, params):
+        start = params.get('ExclusiveStartKey')
+        if not start:
+            return None
+        key = table.key_of(start)
+        if index is None:
+            return key[0], (key[1],)
+        entry = index.entry(table, start)
+        if entry is None:
+            raise _validation('The provided starting key is invalid')
+        return entry
+
+    def _page(self, params, table, index, rows):
+        '''
+        Query/Scan response for (hash_key, sort_key, item) rows in read order.
+        '''
+        limit = params.get('Limit')
+        condition = self._condition(params, 'FilterExpression')
+        select = params.get('Select') or 'ALL_ATTRIBUTES'
+        if params.get('ProjectionExpression') and select == 'ALL_ATTRIBUTES':
+            select = 'SPECIFIC_ATTRIBUTES'
+        project = self._projection(params)
+        items, scanned, size, last = [], 0, 0, None
+        rows = iter(rows)
+        for hash_key, sort_key, item in rows:
+            if index is not None:
+                item = index.projected(table, item)
+            scanned += 1
+            size += item_size(item)
+            if condition is None or condition(item):
+                items.append(item if select == 'COUNT' else project(item))
+            if (limit and scanned >= limit) or size >= PAGE_BYTES:
+                # LastEvaluatedKey only when another row follows.
+                if next(rows, None) is not None:
+                    last = item
+                break
+        resp = {'Count': len(items), 'ScannedCount': scanned}
+        if select != 'COUNT':
+            resp['Items'] = items
+        if last is not None:
+            last_key = table.key_item(last)
+            if index is not None:
+                last_key.update({name: last[name] for name in (index.hash_name, index.range_name) if name})
+            resp['LastEvaluatedKey'] = last_key
+        consumed = self._capacity(params, table, 0 if index else _read_units(size, params.get('ConsistentRead')),
+                                  'read', {index.name: _read_units(size, False)} if index else None,
+                                  index.name if index else None)
+        if consumed:
+            resp['ConsumedCapacity'] = consumed
+        return resp
+
+    def _Query(self, params):
+        table = self._table(params['TableName'])
+        index, hash_name, range_name = self._source(table, params)
+        hash_key, (operator, values) = self._key_condition(params, table, hash_name, range_name)
+        store = index.items if index else table.items
+        after = self._start_key(table, index, params)
+        forward = params.get('ScanIndexForward', True)
+        rows = ((hash_key, sort_key, item) for sort_key, item in
+                store.query(hash_key, _key_bounds(operator, values), forward, after[1] if after else None))
+        return self._page(params, table, index, rows)
+
+    def _Scan(self, params):
+        table = self._table(params['TableName'])
+        index, _, _ = self._source(table, params)
+        total_segments = params.get('TotalSegments') or 1
+        segment = params.get('Segment') or 0
+        if ('Segment' in params) != ('TotalSegments' in params) or not 0 <= segment < total_segments:
+            raise _validation('Segment and TotalSegments must be given together, with 0 <= Segment < TotalSegments')
+        store = index.items if index else table.items
+        rows = store.scan(segment, total_segments, self._start_key(table, index, params))
+        return self._page(params, table, index, rows)
+
+    # Batches and transactions
+
+    def _BatchWriteItem(self, params):
+        requests = [(table_name, request) for table_name, table_requests in params['RequestItems'].items()
+                    for request in table_requests]
+        if len(requests) > BATCH_WRITE_MAX_ITEMS:
+            raise _validation(f'Too many items requested for the BatchWriteItem call (max {BATCH_WRITE_MAX_ITEMS})')
+        seen, writes = set(), []
+        for table_name, request in requests:
+            table = self._table(table_name)
+            (kind, body), = request.items()
+            key = table.key_of(body['Item']) if kind == 'PutRequest' else table.validate_key(body['Key'])
+            if (table_name, key) in seen:
+                raise _validation('Provided list of item keys contains duplicates')
+            seen.add((table_name, key))
+            writes.append((table, key, dict(body['Item']) if kind == 'PutRequest' else None))
+        consumed = {}
+        for table, key, new in writes:
+            old = table.get(key)
+            touched = table.store(key, old, new)
+            units = self._write_capacity(params, table, old, new, touched)
+            if units:
+                _merge_capacity(consumed, units)
+        resp = {'UnprocessedItems': {}}
+        if consumed:
+            resp['ConsumedCapacity'] = list(consumed.values())
+        return resp
+
+    def _BatchGetItem(self, params):
+        if sum(len(request['Keys']) for request in params['RequestItems'].values()) > BATCH_GET_MAX_KEYS:
+            raise _validation(f'Too many items requested for the BatchGetItem call (max {BATCH_GET_MAX_KEYS})')
+        responses, consumed = {}, {}
+        for table_name, request in params['RequestItems'].items():
+            table = self._table(table_name)
+            project = self._projection(request)
+            keys = [table.validate_key(key) for key in request['Keys']]
+            if len(set(keys)) != len(keys):
+                raise _validation('Provided list of item keys contains duplicates')
+            items = [item for item in (table.get(key) for key in keys) if item is not None]
+            responses[table_name] = [project(item) for item in items]
+            units = self._capacity(params, table, sum(_read_units(item_size(item), request.get('ConsistentRead'))
+                                                      for item in items), 'read')
+            if units:
+                _merge_capacity(consumed, units)
+        resp = {'Responses': responses, 'UnprocessedKeys': {}}
+        if consumed:
+            resp['ConsumedCapacity'] = list(consumed.values())
+        return resp
+
+    def _TransactWriteItems(self, params):
+        actions = params['TransactItems']
+        if len(actions) > TRANSACT_MAX_ACTIONS:
+            raise _validation(f'Member must have length less than or equal to {TRANSACT_MAX_ACTIONS}')
+        token = params.get('ClientRequestToken')
+        now = time.monotonic()
+        self._tokens = {k: v for k, v in self._tokens.items() if v[0] > now}
+        if token and token in self._tokens:
+            if self._tokens[token][1] != repr(actions):
+                raise MemoryDynamoDBError('IdempotentParameterMismatchException',
+                                          'The request uses the same client token as a previous, but non-identical request.')
+            return {}
+        prepared, reasons, seen = [], [], set()
+        for action in actions:
+            (kind, request), = action.items()
+            try:
+                table, key, old, new = self._prepare(kind, request)
+                reasons.append({'Code': 'None'})
+                prepared.append((table, key, old, new, kind))
+            except _ConditionFailed as failed:
+                reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                if request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and failed.item:
+                    reason['Item'] = dict(failed.item)
+                reasons.append(reason)
+                continue
+            if (table.name, key) in seen:
+                raise _validation('Transaction request cannot include multiple operations on one item')
+            seen.add((table.name, key))
+        if any(reason['Code'] != 'None' for reason in reasons):
+            codes = ', '.join(reason['Code'] for reason in reasons)
+            raise MemoryDynamoDBError('TransactionCanceledException',
+                                      f'Transaction cancelled, please refer cancellation reasons for specific reasons '
+                                      f'[{codes}]', CancellationReasons=reasons)
+        consumed = {}
+        for table, key, old, new, kind in prepared:
+            touched = table.store(key, old, new) if kind != 'ConditionCheck' else {}
+            units = self._write_capacity(params, table, old, new, touched, factor=2.0)
+            if units:
+                _merge_capacity(consumed, units)
+        if token:
+            self._tokens[token] = (now + IDEMPOTENCY_WINDOW, repr(actions))
+        return {'ConsumedCapacity': list(consumed.values())} if consumed else {}
+
+    def _TransactGetItems(self, params):
+        responses = []
+        for action in params['TransactItems']:
+            request = action['Get']
+            table = self._table(request['TableName'])
+            item = table.get(table.validate_key(request['Key']))
+            responses.append({'Item': self._projection(request)(item)} if item is not None else {})
+        return {'Responses': responses}
+
+
+def _add(current, value):
+    if current is None:
+        return value
+    (kind, raw), = current.items()
+    if kind == 'N' and 'N' in value:
+        return {'N': _format_number(_number(raw) + _number(value['N']))}
+    if kind in ('SS', 'NS', 'BS') and kind in value:
+        merged = list(raw) + [member for member in value[kind]
+                              if not any(_equal({kind[0]: member}, {kind[0]: existing}) for existing in raw)]
+        return {kind: merged}
+    raise _validation('An operand in the update expression has an incorrect data type')
+
+
+def _merge_capacity(consumed, units):
+    entry = consumed.get(units['TableName'])
+    if entry is None:
+        consumed[units['TableName']] = copy.deepcopy(units)
+        return
+    for field, value in units.items():
+        if isinstance(value, float):
+            entry[field] = entry.get(field, 0.0) + value
+        elif isinstance(value, dict) and field != 'TableName':
+            target = entry.setdefault(field, {})
+            for name, inner in value.items():
+                if isinstance(inner, dict):
+                    bucket = target.setdefault(name, {})
+                    for inner_field, inner_value in inner.items():
+                        bucket[inner_field] = bucket.get(inner_field, 0.0) + inner_value
+                else:
+                    target[name] = target.get(name, 0.0) + inner
+
+
+# botocore plug-in ---------------------------------------------------------------------------------
+
+_engine = None
+
+
+def _on_before_parameter_build(params, context, **kwargs):
+    # The resource layer serializes Python values into these params in place, so by the time
+    # the call is made they hold the typed request.
+    context['memory_params'] = params
+
+
+def _on_before_call(model, context, **kwargs):
+    engine = _engine
+    if engine is None:
+        return None
+    from botocore.awsrequest import AWSResponse
+    try:
+        parsed, status = engine.handle(model.name, context.get('memory_params') or {}), 200
+    except MemoryDynamoDBError as ex:
+        parsed = {'Error': {'Code': ex.code, 'Message': ex.message}, 'message': ex.message, **ex.extra}
+        status = 400
+    parsed['ResponseMetadata'] = {'RequestId': uuid.uuid4().hex, 'HTTPStatusCode': status,
+                                  'HTTPHeaders': {}, 'RetryAttempts': 0}
+    return AWSResponse('memory://dynamodb', status, {}, None), parsed
+
+
+def _install_handlers(client):
+    if client.meta.service_model.service_name != 'dynamodb':
+        return
+    client.meta.events.register('before-parameter-build', _on_before_parameter_build)
+    client.meta.events.register('before-call', _on_before_call)
+
+
+def enable_memory_backend(engine=None):
+    '''
+    Serve every DynamoDB call of this process (clients and resources from the registry alike)
+    from an in-memory MemoryEngine instead of the network. Returns the engine.
+    '''
+    global _engine
+    _engine = engine or _engine or MemoryEngine()
+    register_client_hook(_install_handlers)
+    return _engine
+
+
+def disable_memory_backend():
+    global _engine
+    _engine = None
+
+
+def get_engine():
+    return _engine
+
@@ -0,0 +1,333 @@
+import decimal
+import itertools
+import math
+import threading
+import time
+
+from dynamodb_cache import cached_get_item
+from dynamodb_query import paginated_query
+from dynamodb_scan import parallel_scan
+from dynamodb_shard import get_sharding, sharded_get, sharded_query
+from dynamodb_waiter import describe_table
+from my_aws_py_base import _get_boto_resource
+
+
+# Predicate operator -> boto3 condition method; KEY_OPERATORS are the ones a KeyConditionExpression accepts.
+OPERATORS = {
+    '=': 'eq', '<>': 'ne', '<': 'lt', '<=': 'lte', '>': 'gt', '>=': 'gte', 'between': 'between',
+    'begins_with': 'begins_with', 'in': 'is_in', 'contains': 'contains', 'exists': 'exists', 'not_exists': 'not_exists',
+}
+KEY_OPERATORS = {'=', '<', '<=', '>', '>=', 'between', 'begins_with'}
+# Rough fraction of a partition a range key condition keeps; the describe statistics say nothing about it.
+RANGE_SELECTIVITY = {'between': 0.1, 'begins_with': 0.1, '<': 0.3, '<=': 0.3, '>': 0.3, '>=': 0.3}
+READ_UNIT_BYTES = 4096
+# Item size assumed until DescribeTable reports sizes (its statistics are refreshed about every six hours).
+DEFAULT_ITEM_BYTES = 1024
+# Cached schemas are described again after SCHEMA_TTL seconds, or SCHEMA_PENDING_TTL while an index is
+# still being created or deleted, so new indexes become usable and dropped ones stop being planned.
+SCHEMA_TTL = 60.0
+SCHEMA_PENDING_TTL = 5.0
+# Errors of a plan whose index or table is gone; its schema is forgotten.
+SCHEMA_ERRORS = {'ValidationException', 'ResourceNotFoundException'}
+
+
+class PlanError(ValueError):
+    pass
+
+
+class AccessPath:
+    '''
+    The base table or one of its indexes, as far as planning is concerned: key schema,
+    projected attributes (None for all) and the DescribeTable size statistics.
+    '''
+
+    def __init__(self, index_name, kind, hash_key, range_key, projected, item_count, size_bytes):
+        self.index_name = index_name
+        self.kind = kind
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.projected = projected
+        self.item_count = item_count
+        self.size_bytes = size_bytes
+
+    @property
+    def item_size(self):
+        return self.size_bytes / self.item_count if self.item_count and self.size_bytes else DEFAULT_ITEM_BYTES
+
+    def covers(self, attributes):
+        return self.projected is None or (attributes is not None and set(attributes) <= self.projected)
+
+
+def _key_schema(key_schema):
+    keys = {key['KeyType']: key['AttributeName'] for key in key_schema}
+    return keys['HASH'], keys.get('RANGE')
+
+
+def _access_paths(description):
+    hash_key, range_key = _key_schema(description['KeySchema'])
+    table_keys = {hash_key, range_key} - {None}
+    item_count = description.get('ItemCount', 0)
+    paths = [AccessPath(None, 'table', hash_key, range_key, None, item_count, description.get('TableSizeBytes', 0))]
+    for kind, indexes in (('gsi', description.get('GlobalSecondaryIndexes')),
+                          ('lsi', description.get('LocalSecondaryIndexes'))):
+        for index in indexes or []:
+            if index.get('IndexStatus', 'ACTIVE') != 'ACTIVE' or index.get('Backfilling'):
+                continue
+            index_hash, index_range = _key_schema(index['KeySchema'])
+            projection = index.get('Projection') or {}
+            projected = None
+            if projection.get('ProjectionType') != 'ALL':
+                projected = table_keys | {index_hash, index_range} - {None}
+                projected |= set(projection.get('NonKeyAttributes') or [])
+            # A new index reports no items yet; assume it holds as many as the table.
+            paths.append(AccessPath(index['IndexName'], kind, index_hash, index_range, projected,
+                                    index.get('ItemCount') or item_count, index.get('IndexSizeBytes', 0)))
+    return paths
+
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def _pending_indexes(description):
+    indexes = (description.get('GlobalSecondaryIndexes') or []) + (description.get('LocalSecondaryIndexes') or [])
+    return any(index.get('IndexStatus', 'ACTIVE') != 'ACTIVE' or index.get('Backfilling') for index in indexes)
+
+
+def access_paths(table_name, refresh=False):
+    '''
+    [AccessPath] of the table and its ACTIVE indexes, cached for SCHEMA_TTL seconds.
+    '''
+    with _schemas_lock:
+        entry = _schemas.get(table_name)
+    if entry is None or refresh or entry[0] <= time.monotonic():
+        description = describe_table(table_name)
+        if description is None:
+            forget_schema(table_name)
+            raise PlanError(f'Table ({table_name}) does not exist')
+        ttl = SCHEMA_PENDING_TTL if _pending_indexes(description) else SCHEMA_TTL
+        entry = (time.monotonic() + ttl, _access_paths(description))
+        with _schemas_lock:
+            _schemas[table_name] = entry
+    return entry[1]
+
+
+def forget_schema(table_name=None):
+    '''
+    Drop the cached schema of `table_name` (all tables by default), e.g. after adding a GSI.
+    '''
+    with _schemas_lock:
+        if table_name is None:
+            _schemas.clear()
+        else:
+            _schemas.pop(table_name, None)
+
+
+def _value(value):
+    # The resource layer takes Decimal, not float.
+    return decimal.Decimal(str(value)) if isinstance(value, float) else value
+
+
+def parse_predicate(where):
+    '''
+    [(attribute, operator, values)] of a declarative predicate: {attribute: value} for equality or
+    {attribute: [operator, value, ...]}, e.g. {'Artist': 'No One You Know-1', 'Length': ['between', 1, 10]}.
+    '''
+    terms = []
+    for attribute, condition in (where or {}).items():
+        if isinstance(condition, (list, tuple)) and condition and condition[0] in OPERATORS:
+            operator, values = condition[0], [_value(v) for v in condition[1:]]
+        else:
+            operator, values = '=', [_value(condition)]
+        expected = {'between': 2, 'exists': 0, 'not_exists': 0}.get(operator, None if operator == 'in' else 1)
+        if expected is not None and len(values) != expected:
+            raise PlanError(f'{attribute} {operator} takes {expected} value(s), not {len(values)}')
+        terms.append((attribute, operator, tuple(values)))
+    return terms
+
+
+def _condition(factory, terms):
+    condition = None
+    for attribute, operator, values in terms:
+        method = getattr(factory(attribute), OPERATORS[operator])
+        term = method(list(values)) if operator == 'in' else method(*values)
+        condition = term if condition is None else condition & term
+    return condition
+
+
+class Plan:
+    '''
+    One way to answer a predicate: a GetItem, a Query on the table or an index, or a Scan.
+    '''
+
+    def __init__(self, table_name, operation, path, key_terms, filter_terms, attributes, consistent, items):
+        self.table_name = table_name
+        self.operation = operation
+        self.path = path
+        self.key_terms = key_terms
+        self.filter_terms = filter_terms
+        self.attributes = attributes
+        self.consistent = consistent
+        self.items = items
+        self.alternatives = []
+
+    @property
+    def index_name(self):
+        return self.path.index_name
+
+    @property
+    def read_units(self):
+        '''
+        Estimated read units: filters do not reduce them, only the items the key condition reads do.
+        '''
+        size = self.items * self.path.item_size
+        return max(1, math.ceil(size / READ_UNIT_BYTES)) * (1.0 if self.consistent else 0.5)
+
+    def request(self):
+        '''
+        Keyword arguments for Table.get_item/query/scan.
+        '''
+        from boto3.dynamodb.conditions import Attr, Key
+        kwargs = {}
+        if self.operation == 'GetItem':
+            kwargs['Key'] = {attribute: values[0] for attribute, _, values in self.key_terms}
+        elif self.operation == 'Query':
+            kwargs['KeyConditionExpression'] = _condition(Key, self.key_terms)
+        if self.index_name:
+            kwargs['IndexName'] = self.index_name
+        if self.filter_terms:
+            kwargs['FilterExpression'] = _condition(Attr, self.filter_terms)
+        if self.attributes:
+            names = {f'#p{i}': attribute for i, attribute in enumerate(self.attributes)}
+            kwargs['ProjectionExpression'] = ', '.join(names)
+            kwargs['ExpressionAttributeNames'] = names
+        if self.consistent:
+            kwargs['ConsistentRead'] = True
+        return kwargs
+
+    def execute(self, limit=None, total_segments=4):
+        '''
+        Yield the matching items.
+        '''
+        table = _get_boto_resource('dynamodb').Table(self.table_name)
+        kwargs = self.request()
+        shard_map = get_sharding(self.table_name)
+        try:
+            if shard_map is not None and self.operation != 'Scan' and self.path.hash_key == shard_map.hash_name:
+                yield from self._execute_sharded(table, kwargs, limit)
+            elif self.operation == 'GetItem':
+                item = cached_get_item(table, kwargs.pop('Key'), **kwargs)
+                if item is not None:
+                    yield item
+            elif self.operation == 'Query':
+                yield from paginated_query(table, limit=limit, prefetch=True, **kwargs)
+            else:
+                items = parallel_scan(self.table_name, total_segments, **kwargs)
+                try:
+                    yield from itertools.islice(items, limit)
+                finally:
+                    items.close()
+        except Exception as ex:
+            # The index (or table) this plan was made for may be gone: plan again from a fresh describe.
+            if (getattr(ex, 'response', None) or {}).get('Error', {}).get('Code') in SCHEMA_ERRORS:
+                forget_schema(self.table_name)
+            raise
+
+    def _execute_sharded(self, table, kwargs, limit):
+        # The hash key is logical: read its shards with the dynamodb_shard functions.
+        from boto3.dynamodb.conditions import Key
+        if self.operation == 'GetItem':
+            item = sharded_get(table, kwargs.pop('Key'), **kwargs)
+            if item is not None:
+                yield item
+            return
+        del kwargs['KeyConditionExpression']
+        sort_key = self.path.range_key
+        if self.attributes and sort_key and sort_key not in self.attributes:
+            # Shards are merged in sort key order, so it is read even when not asked for.
+            kwargs['ExpressionAttributeNames']['#s'] = sort_key
+            kwargs['ProjectionExpression'] += ', #s'
+        yield from sharded_query(table, self.key_terms[0][2][0], _condition(Key, self.key_terms[1:]),
+                                 sort_key=sort_key, limit=limit, **kwargs)
+
+    def describe(self):
+        target = f'{self.table_name}.{self.index_name}' if self.index_name else self.table_name
+        return f'{self.operation} {target}'
+
+    def explain(self):
+        lines = [f'{self.describe()}  ~{self.items:.0f} items read, ~{self.read_units:g} RCU']
+        if self.key_terms:
+            lines.append(f'  key:        {_format_terms(self.key_terms)}')
+        if self.filter_terms:
+            lines.append(f'  filter:     {_format_terms(self.filter_terms)}')
+        lines.append(f'  projection: {", ".join(self.attributes) if self.attributes else "all attributes"}')
+        for alternative, reason in self.alternatives:
+            lines.append(f'  rejected:   {alternative} ({reason})')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.explain()
+
+
+def _format_terms(terms):
+    return ' AND '.join(f'{attribute} {operator} {", ".join(repr(v) for v in values)}'.rstrip()
+                        for attribute, operator, values in terms)
+
+
+def _candidate(table_name, path, terms, attributes, consistent):
+    '''
+    (Plan, None) for reading `path`, or (None, reason) when the path cannot answer the predicate.
+    '''
+    if consistent and path.kind == 'gsi':
+        return None, 'GSIs do not support consistent reads'
+    referenced = None if attributes is None else set(attributes) | {attribute for attribute, _, _ in terms}
+    if not path.covers(referenced):
+        return None, 'does not project every attribute needed'
+    by_attribute = {}
+    for term in terms:
+        by_attribute.setdefault(term[0], []).append(term)
+    hash_terms = [term for term in by_attribute.get(path.hash_key, []) if term[1] == '=']
+    if not hash_terms:
+        if path.kind == 'table':
+            return Plan(table_name, 'Scan', path, [], terms, attributes, consistent, max(path.item_count, 1)), None
+        return None, f'no equality on its hash key {path.hash_key}'
+    hash_term = hash_terms[0]
+    range_terms = [term for term in by_attribute.get(path.range_key, []) if term[1] in KEY_OPERATORS]
+    range_term = range_terms[0] if range_terms else None
+    key_terms = [hash_term] + ([range_term] if range_term else [])
+    filter_terms = [term for term in terms if term not in key_terms]
+    # Assume about sqrt(items) distinct hash keys: a partition holds ~sqrt(items) items.
+    items = math.sqrt(max(path.item_count, 1))
+    if range_term and range_term[1] == '=':
+        items = 1
+    elif range_term:
+        items = max(1.0, items * RANGE_SELECTIVITY[range_term[1]])
+    operation = 'GetItem' if path.kind == 'table' and items == 1 and not filter_terms else 'Query'
+    return Plan(table_name, operation, path, key_terms, filter_terms, attributes, consistent, items), None
+
+
+def plan(table_name, where, attributes=None, consistent=False, refresh=False):
+    '''
+    The cheapest Plan (by estimated read units) for the items of `table_name` matching `where`
+    (see parse_predicate), over a GetItem, a Query on the table or any covering index, or a
+    parallel Scan. Key conditions go to KeyConditionExpression, the rest to FilterExpression.
+    '''
+    terms = parse_predicate(where)
+    attributes = attributes.split(',') if isinstance(attributes, str) else (list(attributes) if attributes else None)
+    candidates, rejected = [], []
+    for path in access_paths(table_name, refresh):
+        candidate, reason = _candidate(table_name, path, terms, attributes, consistent)
+        if candidate is None:
+            rejected.append((f'Query {table_name}.{path.index_name}' if path.index_name else f'Query {table_name}', reason))
+        else:
+            candidates.append(candidate)
+    table_path = access_paths(table_name)[0]
+    if not any(candidate.operation == 'Scan' for candidate in candidates):
+        candidates.append(Plan(table_name, 'Scan', table_path, [], terms, attributes, consistent,
+                               max(table_path.item_count, 1)))
+    order = {'GetItem': 0, 'Query': 1, 'Scan': 2}
+    candidates.sort(key=lambda candidate: (candidate.read_units, order[candidate.operation], candidate.items))
+    best = candidates[0]
+    best.alternatives = [(candidate.describe(), f'~{candidate.read_units:g} RCU') for candidate in candidates[1:]]
+    best.alternatives += rejected
+    return best
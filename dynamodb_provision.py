@@ -0,0 +1,271 @@
+import contextlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_bulk import _backoff_delay, bulk_delete
+from dynamodb_ratelimit import TokenBucket
+from dynamodb_scan import parallel_scan
+from dynamodb_waiter import describe_table, wait_for
+from my_aws_py_base import _get_boto_client
+
+
+# CreateTable/UpdateTable/DeleteTable calls per second, and tables allowed in CREATING/UPDATING/DELETING at
+# once; both well under the account's control-plane limits.
+CONTROL_PLANE_RATE = 10.0
+MAX_PENDING_TABLES = 50
+ACTIONS = ('create', 'ensure', 'delete', 'recreate')
+
+MUSIC_TABLE_SPEC = {
+    'key': ['Artist', 'SongTitle'],
+    'attributes': {'Artist': 'S', 'SongTitle': 'S'},
+    'throughput': [10, 5],
+}
+
+
+class ProvisionError(Exception):
+    pass
+
+
+def load_spec(spec):
+    '''
+    {table_name: table spec} from a dict or the path of a JSON file. A table spec is
+    {'key': [hash, range], 'attributes': {name: 'S'|'N'|'B'}, 'throughput': [read, write] or None
+    for on-demand, 'gsis': {index_name: {'key': [...], 'projection': 'ALL'|'KEYS_ONLY'|[names],
+    'throughput': [read, write]}}}.
+    '''
+    if isinstance(spec, str):
+        with open(spec) as f:
+            spec = json.load(f)
+    return dict(spec)
+
+
+def _throughput(throughput):
+    return {'ReadCapacityUnits': throughput[0], 'WriteCapacityUnits': throughput[1]}
+
+
+def _key_schema(key):
+    return [{'AttributeName': name, 'KeyType': key_type} for name, key_type in zip(key, ('HASH', 'RANGE'))]
+
+
+def _attribute_definitions(spec, names):
+    try:
+        return [{'AttributeName': name, 'AttributeType': spec['attributes'][name]} for name in names]
+    except KeyError as ex:
+        raise ProvisionError(f'Key attribute {ex} has no type in the spec attributes') from None
+
+
+def _index_request(index_name, index_spec, table_spec):
+    projection = index_spec.get('projection', 'ALL')
+    request = {
+        'IndexName': index_name,
+        'KeySchema': _key_schema(index_spec['key']),
+        'Projection': {'ProjectionType': projection} if isinstance(projection, str) else
+                      {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': list(projection)},
+    }
+    if table_spec.get('throughput'):
+        request['ProvisionedThroughput'] = _throughput(index_spec.get('throughput') or table_spec['throughput'])
+    return request
+
+
+def table_request(table_name, spec):
+    '''
+    CreateTable keyword arguments for one table spec (see load_spec), GSIs included.
+    '''
+    gsis = spec.get('gsis') or {}
+    key_names = dict.fromkeys(list(spec['key']) + [name for index in gsis.values() for name in index['key']])
+    request = {
+        'TableName': table_name,
+        'KeySchema': _key_schema(spec['key']),
+        'AttributeDefinitions': _attribute_definitions(spec, key_names),
+    }
+    if spec.get('throughput'):
+        request['ProvisionedThroughput'] = _throughput(spec['throughput'])
+    else:
+        request['BillingMode'] = 'PAY_PER_REQUEST'
+    if gsis:
+        request['GlobalSecondaryIndexes'] = [_index_request(name, index, spec) for name, index in gsis.items()]
+    return request
+
+
+class ControlPlane:
+    '''
+    Rate-limited control-plane calls, retrying LimitExceededException with jittered backoff.
+    '''
+
+    def __init__(self, rate=CONTROL_PLANE_RATE, max_retries=10, base_delay=0.5, max_delay=20.0):
+        self.client = _get_boto_client('dynamodb')
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def call(self, operation, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return getattr(self.client, operation)(**kwargs)
+            except self.client.exceptions.LimitExceededException:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(_backoff_delay(attempt, self.base_delay, self.max_delay))
+
+
+def _chunks(names, size):
+    return [names[i:i + size] for i in range(0, len(names), size)]
+
+
+def _run(names, call, targets, executor, max_pending, timeout, verbose):
+    '''
+    call(name) for every name, at most `max_pending` tables at a time, each batch followed by
+    one shared wait on the targets of its tables.
+    '''
+    for chunk in _chunks(names, max_pending):
+        list(executor.map(call, chunk))
+        wait_for([target for name in chunk for target in targets(name)], timeout=timeout, verbose=verbose)
+
+
+def _missing_indexes(description, spec):
+    existing = {gsi['IndexName'] for gsi in description.get('GlobalSecondaryIndexes') or []}
+    return [name for name in spec.get('gsis') or {} if name not in existing]
+
+
+def provision(spec, action='ensure', rate=CONTROL_PLANE_RATE, max_pending=MAX_PENDING_TABLES, concurrency=8,
+              timeout=900, verbose=False):
+    '''
+    Create, delete or recreate every table of `spec` (see load_spec) concurrently.
+
+    'create' creates the missing tables, 'ensure' also adds missing GSIs to existing tables,
+    'delete' deletes the existing ones and 'recreate' deletes and creates them all. Calls go
+    through one rate-limited ControlPlane, and each step waits on all of its tables and indexes
+    with a single shared wait_for. Returns {'created', 'deleted', 'indexes', 'unchanged'}.
+    '''
+    if action not in ACTIONS:
+        raise ProvisionError(f'Action ({action}) is not valid! Valid actions are {ACTIONS}.')
+    spec = load_spec(spec)
+    names = list(spec)
+    control = ControlPlane(rate)
+    summary = {'created': [], 'deleted': [], 'indexes': [], 'unchanged': []}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='provision') as executor:
+        descriptions = dict(zip(names, executor.map(describe_table, names)))
+        # Tables still being deleted are gone for our purposes once the delete finishes.
+        deleting = [name for name in names if (descriptions[name] or {}).get('TableStatus') == 'DELETING']
+        if deleting:
+            wait_for([(name, None, 'table_not_exists') for name in deleting], timeout=timeout, verbose=verbose)
+            descriptions.update(dict.fromkeys(deleting))
+        if action in ('delete', 'recreate'):
+            doomed = [name for name in names if descriptions[name]]
+            _run(doomed, lambda name: control.call('delete_table', TableName=name),
+                 lambda name: [(name, None, 'table_not_exists')], executor, max_pending, timeout, verbose)
+            summary['deleted'] = doomed
+            descriptions.update(dict.fromkeys(doomed))
+        if action == 'delete':
+            return summary
+        missing = [name for name in names if not descriptions[name]]
+        _run(missing, lambda name: control.call('create_table', **table_request(name, spec[name])),
+             lambda name: [(name, None, 'table_exists')] + ([(name, '*', 'active')] if spec[name].get('gsis') else []),
+             executor, max_pending, timeout, verbose)
+        summary['created'] = missing
+        existing = [name for name in names if descriptions[name]]
+        pending = {}
+        if action == 'ensure':
+            pending = {name: _missing_indexes(descriptions[name], spec[name]) for name in existing}
+            pending = {name: indexes for name, indexes in pending.items() if indexes}
+            if pending:
+                wait_for([(name, None, 'table_exists') for name in pending], timeout=timeout, verbose=verbose)
+        # A table takes one GSI change at a time: add one index per table per round.
+        while pending:
+            rounds = {name: indexes.pop(0) for name, indexes in pending.items()}
+
+            def create_index(name):
+                index_spec = spec[name]['gsis'][rounds[name]]
+                control.call('update_table', TableName=name,
+                             AttributeDefinitions=_attribute_definitions(spec[name], index_spec['key']),
+                             GlobalSecondaryIndexUpdates=[
+                                 {'Create': _index_request(rounds[name], index_spec, spec[name])}])
+            _run(list(rounds), create_index, lambda name: [(name, rounds[name], 'active')],
+                 executor, max_pending, timeout, verbose)
+            summary['indexes'].extend(f'{name}/{index_name}' for name, index_name in rounds.items())
+            pending = {name: indexes for name, indexes in pending.items() if indexes}
+        summary['unchanged'] = [name for name in existing
+                                if not any(entry.startswith(f'{name}/') for entry in summary['indexes'])]
+    return summary
+
+
+def truncate_table(table_name, total_segments=4, concurrency=8):
+    '''
+    Delete every item of the table with a keys-only parallel scan; returns the number deleted.
+    '''
+    description = describe_table(table_name)
+    if description is None:
+        raise ProvisionError(f'Table ({table_name}) does not exist')
+    key_names = [key['AttributeName'] for key in description['KeySchema']]
+    names = {f'#k{i}': name for i, name in enumerate(key_names)}
+    keys = parallel_scan(table_name, total_segments, ProjectionExpression=', '.join(names),
+                         ExpressionAttributeNames=names)
+    return bulk_delete(table_name, keys, concurrency=concurrency).items
+
+
+class TablePool:
+    '''
+    Warm tables of one spec named `{prefix}-0` .. `{prefix}-{size - 1}` that survive across test
+    runs: acquire() hands out a truncated table instead of creating one, release() returns it.
+    '''
+
+    def __init__(self, spec=None, prefix='music-pool', size=4):
+        self.spec = spec or MUSIC_TABLE_SPEC
+        self.prefix = prefix
+        self.size = size
+        self._lock = threading.Lock()
+        self._free = None
+        self._in_use = set()
+
+    def _names(self, start, stop):
+        return [f'{self.prefix}-{i}' for i in range(start, stop)]
+
+    def warm(self, **provision_kwargs):
+        '''
+        Ensure every pool table exists with the spec's indexes; returns the provision summary.
+        '''
+        summary = provision({name: self.spec for name in self._names(0, self.size)}, 'ensure', **provision_kwargs)
+        with self._lock:
+            self._free = [name for name in self._names(0, self.size) if name not in self._in_use]
+        return summary
+
+    def acquire(self):
+        if self._free is None:
+            self.warm()
+        with self._lock:
+            grow = not self._free
+            if grow:
+                # Grow the pool instead of making the caller wait for a release.
+                name = f'{self.prefix}-{self.size}'
+                self.size += 1
+            else:
+                name = self._free.pop(0)
+            self._in_use.add(name)
+        if grow:
+            provision({name: self.spec}, 'ensure')
+        truncate_table(name)
+        return name
+
+    def release(self, name):
+        with self._lock:
+            self._in_use.discard(name)
+            if self._free is not None:
+                self._free.append(name)
+
+    @contextlib.contextmanager
+    def table(self):
+        name = self.acquire()
+        try:
+            yield name
+        finally:
+            self.release(name)
+
+    def destroy(self, **provision_kwargs):
+        with self._lock:
+            names = self._names(0, self.size)
+            self._free = None
+        return provision({name: self.spec for name in names}, 'delete', **provision_kwargs)
@@ -0,0 +1,127 @@
+import base64
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+_prefetch_lock = threading.Lock()
+_prefetch_executor = None
+
+
+def _get_prefetch_executor():
+    global _prefetch_executor
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='query-prefetch')
+        return _prefetch_executor
+
+
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    key = {}
+    for name, value in last_evaluated_key.items():
+        typed = serializer.serialize(value)
+        if 'B' in typed:
+            typed = {'B': base64.b64encode(bytes(typed['B'])).decode()}
+        key[name] = typed
+    return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True).encode()).decode()
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    for name, typed in key.items():
+        if 'B' in typed:
+            typed = {'B': base64.b64decode(typed['B'])}
+        key[name] = deserializer.deserialize(typed)
+    return key
+
+
+class QueryIterator:
+    '''
+    Lazily page through table.query(**query_kwargs), following LastEvaluatedKey.
+
+    `limit` caps the number of items across all pages, `page_size` caps each request and
+    `prefetch` requests the next page in the background while the current one is consumed.
+    `cursor` is the value of a previous iterator's `.cursor`; it points past the last page
+    that was fully consumed, so resuming after a break mid-page replays the rest of that page.
+    Items of a sharded table (see dynamodb_shard) come with their logical hash keys.
+    '''
+
+    def __init__(self, table, limit=None, page_size=None, prefetch=False, cursor=None, **query_kwargs):
+        # Imported here: dynamodb_shard imports this module.
+        from dynamodb_shard import check_filter, get_sharding
+        self.table = table
+        self.shard_map = get_sharding(getattr(table, 'name', None))
+        if self.shard_map is not None:
+            check_filter(self.shard_map, table.name, query_kwargs)
+        self.limit = limit
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.query_kwargs = query_kwargs
+        self.last_evaluated_key = decode_cursor(cursor)
+        self.count = 0
+        self.scanned_count = 0
+        self.pages = 0
+        self.exhausted = False
+
+    @property
+    def cursor(self):
+        return None if self.exhausted else encode_cursor(self.last_evaluated_key)
+
+    def _request_limit(self, remaining):
+        limits = [n for n in (self.page_size, remaining) if n is not None]
+        return min(limits) if limits else None
+
+    def _fetch(self, start_key, remaining):
+        kwargs = dict(self.query_kwargs)
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        request_limit = self._request_limit(remaining)
+        if request_limit is not None:
+            kwargs['Limit'] = request_limit
+        return self.table.query(**kwargs)
+
+    def _next_page(self, resp, remaining):
+        start_key = resp.get('LastEvaluatedKey')
+        if not start_key or remaining == 0:
+            return None
+        if self.prefetch:
+            return _get_prefetch_executor().submit(self._fetch, start_key, remaining)
+        return start_key
+
+    def __iter__(self):
+        if self.exhausted:
+            return
+        remaining = None if self.limit is None else self.limit - self.count
+        if remaining == 0:
+            return
+        resp = self._fetch(self.last_evaluated_key, remaining)
+        while True:
+            items = resp.get('Items', [])
+            if self.shard_map is not None:
+                items = [self.shard_map.to_logical(item) for item in items]
+            if remaining is not None:
+                items = items[:remaining]
+                remaining -= len(items)
+            pending = self._next_page(resp, remaining)
+            self.pages += 1
+            self.scanned_count += resp.get('ScannedCount', 0)
+            for item in items:
+                self.count += 1
+                yield item
+            self.last_evaluated_key = resp.get('LastEvaluatedKey')
+            if pending is None:
+                self.exhausted = not self.last_evaluated_key
+                return
+            resp = pending.result() if self.prefetch else self._fetch(pending, remaining)
+
+
+def paginated_query(table, limit=None, page_size=None, prefetch=False, cursor=None, **query_kwargs):
+    return QueryIterator(table, limit, page_size, prefetch, cursor, **query_kwargs)
@@ -0,0 +1,321 @@
+import os
+import threading
+import time
+
+from dynamodb_waiter import describe_table
+from my_aws_py_base import on_env_loaded, register_client_hook
+
+
+READ_OPERATIONS = {'GetItem', 'Query', 'Scan', 'BatchGetItem', 'TransactGetItems'}
+WRITE_OPERATIONS = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+_THROTTLE_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+
+
+class TokenBucket:
+    '''
+    Token bucket refilled at `rate` units per second and holding at most `burst` units.
+
+    The balance may go negative: acquire() only waits for a non-negative balance and
+    debit() charges the difference once the real consumption is known.
+    '''
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.burst = burst or max(1.0, rate)
+            self.tokens = min(self.tokens, self.burst)
+
+    def acquire(self, units=1.0):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 0:
+                    self.tokens -= units
+                    return
+                wait = -self.tokens / self.rate
+            time.sleep(wait)
+
+    def debit(self, units):
+        with self._lock:
+            self._refill()
+            self.tokens -= units
+
+
+class CapacityLimiter:
+    '''
+    Read and write buckets for one table or GSI, running at `utilization` of its provisioned
+    throughput. The rate is cut on throttling and recovers additively (AIMD) towards the target.
+    '''
+
+    def __init__(self, read_units, write_units, utilization=0.9):
+        self.utilization = utilization
+        self.targets = {'read': read_units * utilization, 'write': write_units * utilization}
+        self.buckets = {kind: TokenBucket(rate) for kind, rate in self.targets.items()}
+        self.throttles = 0
+
+    def update_provisioned(self, read_units, write_units):
+        self.targets = {'read': read_units * self.utilization, 'write': write_units * self.utilization}
+        for kind, rate in self.targets.items():
+            self.buckets[kind].set_rate(rate)
+
+    def acquire(self, kind, units):
+        self.buckets[kind].acquire(units)
+
+    def debit(self, kind, units):
+        self.buckets[kind].debit(units)
+
+    def on_throttle(self, kind):
+        self.throttles += 1
+        bucket = self.buckets[kind]
+        bucket.set_rate(max(0.1 * self.targets[kind], bucket.rate * 0.7))
+
+    def on_success(self, kind):
+        bucket = self.buckets[kind]
+        target = self.targets[kind]
+        if bucket.rate < target:
+            bucket.set_rate(min(target, bucket.rate + 0.02 * target))
+
+    def as_dict(self):
+        return {
+            kind: {'rate': round(bucket.rate, 3), 'target': round(self.targets[kind], 3)}
+            for kind, bucket in self.buckets.items()
+        } | {'throttles': self.throttles}
+
+
+class TableLimiters:
+    '''
+    CapacityLimiter per table and GSI, learned from DescribeTable and refreshed every
+    `refresh_interval` seconds. On-demand tables get no limiter. A missing table or a failed
+    describe is retried after `retry_interval` seconds.
+    '''
+
+    def __init__(self, utilization=0.9, refresh_interval=300.0, retry_interval=5.0):
+        self.utilization = utilization
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._tables = {}
+        # One lock per table held while describing it, so only that table's callers wait.
+        self._describe_locks = {}
+        # Rolling estimate of the units one Query/Scan page costs, per (table, index, operation).
+        self._page_costs = {}
+
+    def _describe(self, table_name):
+        '''
+        {index_name or None: (read units, write units)}, or None when the table does not exist.
+        '''
+        description = describe_table(table_name)
+        if description is None:
+            return None
+        billing = (description.get('BillingModeSummary') or {}).get('BillingMode')
+        limiters = {}
+        if billing != 'PAY_PER_REQUEST':
+            for index_name, throughput in [(None, description.get('ProvisionedThroughput'))] + [
+                    (gsi['IndexName'], gsi.get('ProvisionedThroughput'))
+                    for gsi in description.get('GlobalSecondaryIndexes') or []]:
+                if throughput and throughput.get('ReadCapacityUnits'):
+                    limiters[index_name] = (throughput['ReadCapacityUnits'], throughput['WriteCapacityUnits'])
+        return limiters
+
+    def _fresh(self, table_name):
+        with self._lock:
+            entry = self._tables.get(table_name)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry, None
+            return entry, self._describe_locks.setdefault(table_name, threading.Lock())
+
+    def get(self, table_name):
+        '''
+        {index_name or None: CapacityLimiter} for the table. DescribeTable runs outside the shared
+        lock; while one caller refreshes a table the others keep using its stale limiters.
+        '''
+        entry, describe_lock = self._fresh(table_name)
+        if describe_lock is None:
+            return entry[1]
+        if not describe_lock.acquire(blocking=entry is None):
+            return entry[1]
+        try:
+            # Another caller may have refreshed the table while this one waited.
+            entry, stale = self._fresh(table_name)
+            if stale is None:
+                return entry[1]
+            failed = False
+            try:
+                provisioned = self._describe(table_name)
+            except Exception:
+                provisioned, failed = None, True
+            previous = entry[1] if entry else {}
+            if failed:
+                limiters = previous
+            else:
+                limiters = {}
+                for index_name, (read_units, write_units) in (provisioned or {}).items():
+                    limiters[index_name] = previous.get(index_name) or CapacityLimiter(read_units, write_units,
+                                                                                       self.utilization)
+                    limiters[index_name].update_provisioned(read_units, write_units)
+            ttl = self.retry_interval if provisioned is None else self.refresh_interval
+            with self._lock:
+                self._tables[table_name] = (time.monotonic() + ttl, limiters)
+            return limiters
+        finally:
+            describe_lock.release()
+
+    def page_cost(self, key):
+        return self._page_costs.get(key, 1.0)
+
+    def observe_page_cost(self, key, units):
+        with self._lock:
+            self._page_costs[key] = 0.8 * self._page_costs.get(key, units) + 0.2 * units
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                f'{table_name}/{index_name}' if index_name else table_name: limiter.as_dict()
+                for table_name, (_, limiters) in self._tables.items()
+                for index_name, limiter in limiters.items()
+            }
+
+
+_limiters = None
+
+
+def _estimate(operation, params):
+    '''
+    [(table_name, index_name, kind, estimated units)] charged before the call is sent.
+    '''
+    if operation in ('Query', 'Scan'):
+        key = (params['TableName'], params.get('IndexName'), operation)
+        return [(params['TableName'], params.get('IndexName'), 'read', _limiters.page_cost(key))]
+    if operation == 'GetItem':
+        return [(params['TableName'], None, 'read', 1.0 if params.get('ConsistentRead') else 0.5)]
+    if operation in ('PutItem', 'UpdateItem', 'DeleteItem'):
+        return [(params['TableName'], None, 'write', 1.0)]
+    if operation == 'BatchWriteItem':
+        return [(table_name, None, 'write', float(len(requests)))
+                for table_name, requests in params['RequestItems'].items()]
+    if operation == 'BatchGetItem':
+        return [(table_name, None, 'read', 0.5 * len(request['Keys']))
+                for table_name, request in params['RequestItems'].items()]
+    counts = {}
+    for action in params.get('TransactItems', []):
+        for request in action.values():
+            counts[request['TableName']] = counts.get(request['TableName'], 0) + 2.0
+    kind = 'read' if operation == 'TransactGetItems' else 'write'
+    return [(table_name, None, kind, units) for table_name, units in counts.items()]
+
+
+def _charges(estimates):
+    '''
+    Expand estimates to every limiter that pays for them: a write to a table also
+    consumes write capacity on each of its GSIs.
+    '''
+    charges = []
+    for table_name, index_name, kind, units in estimates:
+        limiters = _limiters.get(table_name)
+        targets = [index_name] if index_name or kind == 'read' else list(limiters)
+        charges.extend((table_name, target, kind, units, limiters[target]) for target in targets if target in limiters)
+    return charges
+
+
+def _on_provide_client_params(params, model, context, **kwargs):
+    if _limiters is None or (model.name not in READ_OPERATIONS and model.name not in WRITE_OPERATIONS):
+        return
+    charges = _charges(_estimate(model.name, params))
+    if not charges:
+        return
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'INDEXES')
+    for _, _, kind, units, limiter in charges:
+        limiter.acquire(kind, units)
+    context['ratelimit_charges'] = charges
+
+
+def _on_response_received(context, parsed_response=None, **kwargs):
+    charges = context.get('ratelimit_charges')
+    error_code = ((parsed_response or {}).get('Error') or {}).get('Code')
+    if charges and error_code in _THROTTLE_CODES:
+        for _, _, kind, _, limiter in charges:
+            limiter.on_throttle(kind)
+
+
+def _consumed_units(consumed, table_name, index_name, kind):
+    field = 'ReadCapacityUnits' if kind == 'read' else 'WriteCapacityUnits'
+    for entry in consumed if isinstance(consumed, list) else [consumed]:
+        if entry.get('TableName') != table_name:
+            continue
+        units = (entry.get('GlobalSecondaryIndexes') or {}).get(index_name) if index_name else entry.get('Table')
+        if units:
+            return units.get(field) or units.get('CapacityUnits') or 0.0
+        if not index_name:
+            return entry.get(field) or entry.get('CapacityUnits') or 0.0
+    return None
+
+
+def _on_after_call(http_response, parsed, model, context, **kwargs):
+    charges = context.pop('ratelimit_charges', None)
+    if not charges or http_response.status_code >= 300:
+        return
+    consumed = parsed.get('ConsumedCapacity')
+    for table_name, index_name, kind, estimated, limiter in charges:
+        limiter.on_success(kind)
+        actual = _consumed_units(consumed, table_name, index_name, kind) if consumed else None
+        if actual is None:
+            continue
+        if model.name in ('Query', 'Scan'):
+            limiter.debit(kind, actual - estimated)
+            if _limiters is not None:
+                _limiters.observe_page_cost((table_name, index_name, model.name), actual)
+        else:
+            # The other estimates are already the minimum DynamoDB charges, so only add the excess.
+            limiter.debit(kind, max(0.0, actual - estimated))
+
+
+def _install_handlers(client):
+    if client.meta.service_model.service_name != 'dynamodb':
+        return
+    client.meta.events.register('provide-client-params', _on_provide_client_params)
+    client.meta.events.register('response-received', _on_response_received)
+    client.meta.events.register('after-call', _on_after_call)
+
+
+def enable_rate_limiting(utilization=0.9, refresh_interval=300.0):
+    '''
+    Throttle every DynamoDB call of this process client-side to `utilization` of the provisioned
+    throughput of the table or GSI it uses, before the server starts throttling.
+    '''
+    global _limiters
+    _limiters = TableLimiters(utilization, refresh_interval)
+    register_client_hook(_install_handlers)
+    return _limiters
+
+
+def disable_rate_limiting():
+    global _limiters
+    _limiters = None
+
+
+def get_rate_limiters():
+    return _limiters
+
+
+def _enable_rate_limiting_from_env():
+    # e.g. ddb_rate_limit=0.9 keeps a CLI run at 90% of the provisioned throughput.
+    utilization = os.getenv('ddb_rate_limit')
+    if utilization:
+        enable_rate_limiting(float(utilization))
+
+
+on_env_loaded(_enable_rate_limiting_from_env)
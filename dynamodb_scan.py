@@ -0,0 +1,119 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_shard import check_filter, get_sharding
+from my_aws_py_base import _get_boto_client, _get_boto_resource_client
+
+
+_PAGE = 'page'
+_ERROR = 'error'
+_DONE = 'done'
+
+
+class ClientTable:
+    '''
+    Table-like wrapper over the low-level client: scan() and query() return raw typed items
+    ({'N': '12'}) and skip the resource layer's Decimal/dict conversion. Expressions must be
+    strings with typed ExpressionAttributeValues. Over a _get_boto_resource_client it works like
+    a resource Table instead, but is safe to share between threads.
+    '''
+
+    def __init__(self, table_name, client=None):
+        self.name = table_name
+        self.client = client or _get_boto_client('dynamodb')
+
+    def scan(self, **kwargs):
+        return self.client.scan(TableName=self.name, **kwargs)
+
+    def query(self, **kwargs):
+        return self.client.query(TableName=self.name, **kwargs)
+
+
+def scan_segment_pages(table_name, segment=0, total_segments=1, exclusive_start_key=None, table=None, raw=False,
+                       **scan_kwargs):
+    '''
+    Yield every scan response of one segment, following LastEvaluatedKey to the end. Items of a
+    sharded table (see dynamodb_shard) come with their logical hash keys.
+    '''
+    table = table or ClientTable(table_name, None if raw else _get_boto_resource_client('dynamodb'))
+    shard_map = get_sharding(table_name)
+    if shard_map is not None:
+        check_filter(shard_map, table_name, scan_kwargs)
+    if total_segments > 1:
+        scan_kwargs.update(Segment=segment, TotalSegments=total_segments)
+    while True:
+        if exclusive_start_key:
+            scan_kwargs['ExclusiveStartKey'] = exclusive_start_key
+        resp = table.scan(**scan_kwargs)
+        if shard_map is not None and 'Items' in resp:
+            resp['Items'] = [shard_map.to_logical(item) for item in resp['Items']]
+        yield resp
+        exclusive_start_key = resp.get('LastEvaluatedKey')
+        if not exclusive_start_key:
+            return
+
+
+def _put(pages, entry, stop):
+    while not stop.is_set():
+        try:
+            pages.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _scan_worker(table_name, segment, total_segments, start_key, raw, pages, stop, scan_kwargs):
+    try:
+        for resp in scan_segment_pages(table_name, segment, total_segments, start_key, raw=raw, **scan_kwargs):
+            if not _put(pages, (_PAGE, segment, resp), stop):
+                return
+    except Exception as ex:
+        _put(pages, (_ERROR, segment, ex), stop)
+    finally:
+        _put(pages, (_DONE, segment, None), stop)
+
+
+def parallel_scan_pages(table_name, total_segments=4, max_workers=None, max_buffered_pages=None,
+                        segments=None, start_keys=None, raw=False, **scan_kwargs):
+    '''
+    Scan `segments` (default: all of `total_segments`) on a thread pool and yield
+    (segment, response) tuples as pages arrive.
+
+    At most `max_buffered_pages` pages are held between the workers and the consumer, so a
+    slow consumer stalls the scan instead of growing memory. Closing the generator stops it.
+    With `raw` the pages come from the low-level client (see ClientTable).
+    '''
+    segments = list(range(total_segments)) if segments is None else list(segments)
+    start_keys = start_keys or {}
+    if not segments:
+        return
+    max_workers = max_workers or len(segments)
+    pages = queue.Queue(maxsize=max_buffered_pages or 2 * max_workers)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'scan-{table_name}')
+    try:
+        for segment in segments:
+            executor.submit(_scan_worker, table_name, segment, total_segments, start_keys.get(segment), raw,
+                            pages, stop, scan_kwargs)
+        remaining = len(segments)
+        while remaining:
+            kind, segment, payload = pages.get()
+            if kind == _PAGE:
+                yield segment, payload
+            elif kind == _ERROR:
+                raise payload
+            else:
+                remaining -= 1
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parallel_scan(table_name, total_segments=4, max_workers=None, max_buffered_pages=None, **scan_kwargs):
+    '''
+    Yield every item of the table using a parallel segmented scan.
+    '''
+    for _, resp in parallel_scan_pages(table_name, total_segments, max_workers, max_buffered_pages, **scan_kwargs):
+        yield from resp.get('Items', [])
@@ -0,0 +1,444 @@
+import heapq
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_cache import invalidate_item
+from dynamodb_query import paginated_query
+from my_aws_py_base import on_env_loaded, register_client_hook
+
+
+SHARD_MODES = ('hash', 'random')
+# Between a logical hash key and its shard number; a control character no natural key contains.
+SHARD_SEPARATOR = '\x1f'
+# Write capacity one partition sustains per second, in WCU.
+PARTITION_WCU = 1000
+
+
+class ShardError(ValueError):
+    pass
+
+
+def _plain(value):
+    # Low-level clients send {'S': 'x'}; the resource layer hands over 'x' at this point.
+    if isinstance(value, dict) and len(value) == 1:
+        (kind, raw), = value.items()
+        if kind in ('S', 'N', 'B'):
+            return raw
+    return value
+
+
+def _typed_like(original, value):
+    # `value` in the form of `original`: typed ({'S': ...}) for the low-level client, plain otherwise.
+    if isinstance(original, dict) and len(original) == 1:
+        (kind, _), = original.items()
+        return {kind: value}
+    return value
+
+
+class ShardMap:
+    '''
+    How logical hash keys map to physical ones: key `k` with n > 1 shards is stored as `k<sep>0` ..
+    `k<sep>{n-1}` (SHARD_SEPARATOR by default). `shards` applies to every key and `hot_keys` ({key: n}) overrides it per key, so
+    only the hot keys need to be sharded. In 'hash' mode the shard follows from the range key, so
+    a full-key read or write touches one shard; in 'random' mode writes spread evenly over the
+    shards and full-key reads fan out to all of them.
+    '''
+
+    def __init__(self, shards=1, hot_keys=None, mode='hash', hash_name='Artist', range_name='SongTitle',
+                 separator=SHARD_SEPARATOR):
+        if mode not in SHARD_MODES:
+            raise ShardError(f'Shard mode ({mode}) is not valid! Valid modes are {SHARD_MODES}.')
+        if mode == 'hash' and not range_name:
+            raise ShardError('Hash sharding picks the shard from the range key; use random mode without one')
+        self.shards = shards
+        self.hot_keys = dict(hot_keys or {})
+        self.mode = mode
+        self.hash_name = hash_name
+        self.range_name = range_name
+        self.separator = separator
+
+    def shard_count(self, logical):
+        return self.hot_keys.get(logical, self.shards)
+
+    def physical(self, logical, shard):
+        return logical if self.shard_count(logical) <= 1 else f'{logical}{self.separator}{shard}'
+
+    def physical_keys(self, logical):
+        return [self.physical(logical, shard) for shard in range(self.shard_count(logical))]
+
+    def write_key(self, item):
+        '''
+        Physical hash key to write `item` (or its key, plain or typed) to, as a plain value.
+        '''
+        logical = _plain(item[self.hash_name])
+        count = self.shard_count(logical)
+        if count <= 1:
+            return logical
+        if self.mode == 'random':
+            return self.physical(logical, random.randrange(count))
+        return self.physical(logical, zlib.crc32(str(_plain(item[self.range_name])).encode()) % count)
+
+    def logical(self, physical):
+        if not isinstance(physical, str) or self.separator not in physical:
+            return physical
+        # Only strip a suffix this map could have written.
+        logical, _, shard = physical.rpartition(self.separator)
+        count = self.shard_count(logical)
+        return logical if count > 1 and shard.isdigit() and shard == str(int(shard)) and int(shard) < count \
+            else physical
+
+    def to_physical(self, item):
+        return dict(item, **{self.hash_name: _typed_like(item[self.hash_name], self.write_key(item))})
+
+    def to_logical(self, item):
+        if item is None or self.hash_name not in item:
+            return item
+        value = item[self.hash_name]
+        return dict(item, **{self.hash_name: _typed_like(value, self.logical(_plain(value)))})
+
+    def locations(self, key):
+        '''
+        Every physical key a logical `key` may be stored under: its shard in hash mode, all in random mode.
+        '''
+        logical = _plain(key[self.hash_name])
+        if self.mode == 'hash' or self.shard_count(logical) <= 1:
+            return [self.to_physical(key)]
+        return [dict(key, **{self.hash_name: _typed_like(key[self.hash_name], k)}) for k in self.physical_keys(logical)]
+
+
+_shard_maps = {}
+_shard_maps_lock = threading.Lock()
+
+
+def configure_sharding(table_name=None, shards=8, hot_keys=None, mode='hash', hash_name='Artist',
+                       range_name='SongTitle'):
+    '''
+    Shard the hash keys of `table_name` (of every table not configured otherwise when None, see
+    ShardMap). From then on the sharded_* functions and the dynamodb.py item commands use it, bulk,
+    transact, sync and load test writes go to the shards (hash mode only), and scans and queries
+    return logical hash keys.
+    '''
+    shard_map = ShardMap(shards, hot_keys, mode, hash_name, range_name)
+    with _shard_maps_lock:
+        _shard_maps[table_name] = shard_map
+    return shard_map
+
+
+def disable_sharding(table_name=None):
+    with _shard_maps_lock:
+        if table_name is None:
+            _shard_maps.clear()
+        else:
+            _shard_maps.pop(table_name, None)
+
+
+def get_sharding(table_name):
+    with _shard_maps_lock:
+        return _shard_maps.get(table_name) or _shard_maps.get(None)
+
+
+def _shard_map(table_name):
+    shard_map = get_sharding(table_name)
+    if shard_map is None:
+        raise ShardError(f'Table ({table_name}) is not sharded; see configure_sharding')
+    return shard_map
+
+
+def routable_sharding(table_name, operation):
+    '''
+    The ShardMap of `table_name` (None when it is not sharded) for an `operation` that addresses
+    items by key only. Random mode needs a read per shard to find where a key is, so it is refused.
+    '''
+    shard_map = get_sharding(table_name)
+    if shard_map is not None and shard_map.mode == 'random':
+        raise ShardError(f'{operation} cannot tell which shard holds a key of table ({table_name}) in random mode; '
+                         f'use hash mode or the sharded_* functions')
+    return shard_map
+
+
+def _references(expression, names, attribute):
+    if not isinstance(expression, str):
+        # A boto3 condition: build it to learn the attribute names it uses.
+        from boto3.dynamodb.conditions import ConditionExpressionBuilder
+        built = ConditionExpressionBuilder().build_expression(expression)
+        return attribute in built.attribute_name_placeholders.values()
+    placeholders = [name for name, value in (names or {}).items() if value == attribute]
+    return any(re.search(rf'(?<![\w#:.]){re.escape(token)}(?![\w])', expression)
+               for token in [attribute] + placeholders)
+
+
+def check_filter(shard_map, table_name, kwargs):
+    '''
+    Refuse a read whose FilterExpression tests the sharded hash key: the table holds the physical
+    keys (k<sep>n), which a filter on the logical ones would silently not match.
+    '''
+    expression = kwargs.get('FilterExpression')
+    if expression is not None and _references(expression, kwargs.get('ExpressionAttributeNames'), shard_map.hash_name):
+        raise ShardError(f'Table ({table_name}) is sharded on {shard_map.hash_name}; a filter cannot test it '
+                         f'(query the key with sharded_query instead)')
+
+
+def _fan_out(calls, concurrency):
+    if len(calls) == 1:
+        return [calls[0]()]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(calls)), thread_name_prefix='shard') as executor:
+        return list(executor.map(lambda call: call(), calls))
+
+
+def _locate(table, shard_map, key, concurrency, **get_kwargs):
+    '''
+    (physical key, item) of a logical key: one read in hash mode, a read per shard in random mode.
+    '''
+    physical_keys = shard_map.locations(key)
+    items = _fan_out([lambda k=k: table.get_item(Key=k, **get_kwargs).get('Item') for k in physical_keys],
+                     concurrency)
+    for physical, item in zip(physical_keys, items):
+        if item is not None:
+            return physical, item
+    return None, None
+
+
+def _key_of(shard_map, item):
+    return {name: item[name] for name in (shard_map.hash_name, shard_map.range_name) if name and name in item}
+
+
+def sharded_put(table, item, concurrency=16, **put_kwargs):
+    '''
+    table.put_item on the shard of `item`. In random mode an existing item is overwritten on the
+    shard that holds it and only a new key goes to a random shard; concurrent first writes of
+    the same new key may still land on two shards (the reads then return either copy).
+    '''
+    shard_map = _shard_map(table.name)
+    physical = None
+    if shard_map.mode == 'random':
+        physical, _ = _locate(table, shard_map, _key_of(shard_map, item), concurrency)
+    physical = dict(item, **{shard_map.hash_name: physical[shard_map.hash_name]}) if physical \
+        else shard_map.to_physical(item)
+    resp = table.put_item(Item=physical, **put_kwargs)
+    invalidate_item(table.name, physical)
+    return resp
+
+
+def sharded_get(table, key, concurrency=16, **get_kwargs):
+    '''
+    The item of a logical key, with its logical hash key, or None.
+    '''
+    shard_map = _shard_map(table.name)
+    _, item = _locate(table, shard_map, key, concurrency, **get_kwargs)
+    return shard_map.to_logical(item)
+
+
+def sharded_update(table, key, concurrency=16, **update_kwargs):
+    '''
+    table.update_item on the shard holding `key` (a new random shard when no shard holds it yet;
+    like sharded_put, concurrent first writes of a new key may land on two shards).
+    '''
+    shard_map = _shard_map(table.name)
+    physical = None
+    if shard_map.mode == 'random':
+        physical, _ = _locate(table, shard_map, key, concurrency)
+    physical = physical or shard_map.to_physical(key)
+    resp = table.update_item(Key=physical, **update_kwargs)
+    invalidate_item(table.name, physical)
+    return resp
+
+
+def sharded_delete(table, key, concurrency=16):
+    '''
+    Delete a logical key: from its shard in hash mode, from every shard in random mode.
+    '''
+    shard_map = _shard_map(table.name)
+    physical_keys = shard_map.locations(key)
+    responses = _fan_out([lambda k=k: table.delete_item(Key=k) for k in physical_keys], concurrency)
+    for physical in physical_keys:
+        invalidate_item(table.name, physical)
+    return responses
+
+
+def sharded_query(table, logical, range_condition=None, sort_key=None, limit=None, concurrency=16, **query_kwargs):
+    '''
+    Items of logical hash key `logical` (on the table, or on an index keyed by the same attribute
+    with IndexName), queried on every shard in parallel and merged back into `sort_key` order
+    (the table's range key by default). `range_condition` is an optional boto3 Key condition.
+    '''
+    from boto3.dynamodb.conditions import Key
+    shard_map = _shard_map(table.name)
+    sort_key = sort_key or shard_map.range_name
+    ascending = query_kwargs.get('ScanIndexForward', True)
+
+    def run(physical):
+        condition = Key(shard_map.hash_name).eq(physical)
+        if range_condition is not None:
+            condition = condition & range_condition
+        # Every shard may hold all of the first `limit` items.
+        return list(paginated_query(table, limit=limit, KeyConditionExpression=condition, **query_kwargs))
+
+    shards = _fan_out([lambda k=k: run(k) for k in shard_map.physical_keys(logical)], concurrency)
+    merged = heapq.merge(*shards, key=lambda item: item.get(sort_key), reverse=not ascending) if sort_key \
+        else (item for items in shards for item in items)
+    for count, item in enumerate(merged):
+        if limit is not None and count >= limit:
+            return
+        yield shard_map.to_logical(item)
+
+
+# Hot key detection -------------------------------------------------------------------------------
+
+_WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+
+
+def _write_units(item):
+    return max(1, math.ceil(len(json.dumps(item, default=str)) / 1024))
+
+
+class WriteSampler:
+    '''
+    Sampled writes per (table, hash key): total writes, total WCU and the peak WCU in any one
+    second. Memory follows the number of distinct keys sampled.
+    '''
+
+    def __init__(self, sample_rate=1.0, key_names=None):
+        self.sample_rate = sample_rate
+        self.key_names = key_names or {}
+        self._lock = threading.Lock()
+        self._keys = {}
+        self.started_at = time.monotonic()
+        self.samples = 0
+
+    def _hash_name(self, table_name, item):
+        name = self.key_names.get(table_name)
+        if name is None:
+            from dynamodb_waiter import describe_table
+            description = describe_table(table_name)
+            name = next(key['AttributeName'] for key in description['KeySchema'] if key['KeyType'] == 'HASH') \
+                if description else next(iter(item))
+            self.key_names[table_name] = name
+        return name
+
+    def observe(self, table_name, item, units=1, now=None):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        hash_key = _plain(item.get(self._hash_name(table_name, item)))
+        now = time.monotonic() if now is None else now
+        second = int(now)
+        # Scale the sampled units back up to an estimate of the real ones.
+        units = units / self.sample_rate
+        with self._lock:
+            self.samples += 1
+            entry = self._keys.get((table_name, hash_key))
+            if entry is None:
+                entry = self._keys[(table_name, hash_key)] = {'writes': 0, 'units': 0.0, 'peak': 0.0,
+                                                              'second': second, 'current': 0.0}
+            entry['writes'] += 1 / self.sample_rate
+            entry['units'] += units
+            if entry['second'] != second:
+                entry['second'], entry['current'] = second, 0.0
+            entry['current'] += units
+            entry['peak'] = max(entry['peak'], entry['current'])
+
+    def observe_request(self, operation, params):
+        if operation == 'BatchWriteItem':
+            for table_name, requests in params.get('RequestItems', {}).items():
+                for request in requests:
+                    (kind, body), = request.items()
+                    item = body.get('Item') or body.get('Key')
+                    self.observe(table_name, item, _write_units(item))
+        elif operation == 'TransactWriteItems':
+            for action in params.get('TransactItems', []):
+                for kind, request in action.items():
+                    if kind != 'ConditionCheck':
+                        item = request.get('Item') or request.get('Key')
+                        # Transactional writes cost twice the WCU.
+                        self.observe(request['TableName'], item, 2 * _write_units(item))
+        else:
+            item = params.get('Item') or params.get('Key') or {}
+            self.observe(params['TableName'], item, _write_units(item))
+
+    def report(self, partition_wcu=PARTITION_WCU, headroom=0.5, top=10):
+        '''
+        [{table, key, writes, wcu, peak_wcu, share, shards}] of the hottest keys, where `shards` is the
+        power of two that keeps each shard's peak under `headroom` of a partition's `partition_wcu`.
+        '''
+        with self._lock:
+            entries = list(self._keys.items())
+        total = sum(entry['units'] for _, entry in entries) or 1.0
+        report = []
+        for (table_name, hash_key), entry in sorted(entries, key=lambda e: -e[1]['peak'])[:top]:
+            needed = entry['peak'] / (partition_wcu * headroom)
+            report.append({
+                'table': table_name, 'key': hash_key, 'writes': round(entry['writes']), 'wcu': round(entry['units'], 1),
+                'peak_wcu': round(entry['peak'], 1), 'share': round(entry['units'] / total, 4),
+                'shards': 1 if needed <= 1 else 2 ** math.ceil(math.log2(needed)),
+            })
+        return report
+
+
+_sampler = None
+
+
+def _on_provide_client_params(params, model, **kwargs):
+    sampler = _sampler
+    if sampler is not None and model.name in _WRITE_OPERATIONS:
+        sampler.observe_request(model.name, params)
+
+
+def _install_handlers(client):
+    if client.meta.service_model.service_name != 'dynamodb':
+        return
+    client.meta.events.register('provide-client-params', _on_provide_client_params)
+
+
+def enable_write_sampling(sample_rate=1.0, key_names=None):
+    '''
+    Sample the writes of every DynamoDB client of this process into a WriteSampler.
+    '''
+    global _sampler
+    _sampler = WriteSampler(sample_rate, key_names)
+    register_client_hook(_install_handlers)
+    return _sampler
+
+
+def disable_write_sampling():
+    global _sampler
+    _sampler = None
+
+
+def get_write_sampler():
+    return _sampler
+
+
+def print_hot_keys(sampler=None, partition_wcu=PARTITION_WCU, headroom=0.5, top=10):
+    sampler = sampler or _sampler
+    if sampler is None:
+        return
+    for entry in sampler.report(partition_wcu, headroom, top):
+        # Sharded keys are printed as key#shard; the separator itself does not print.
+        key = str(entry['key']).replace(SHARD_SEPARATOR, '#')
+        print(f'{entry["table"]} {key}: writes={entry["writes"]} wcu={entry["wcu"]} '
+              f'peak={entry["peak_wcu"]}/s share={entry["share"]:.1%} -> shards={entry["shards"]}')
+
+
+def _enable_from_env():
+    # e.g. ddb_shards=8 (every table) or ddb_shards=music-test:8,music-default:4, with ddb_shard_mode=random;
+    # ddb_hot_keys=0.1 samples 10% of the writes and prints the hot keys at exit.
+    shards = os.getenv('ddb_shards')
+    if shards:
+        mode = os.getenv('ddb_shard_mode', 'hash')
+        for entry in shards.split(','):
+            table_name, _, count = entry.rpartition(':')
+            configure_sharding(table_name or None, int(count), mode=mode)
+    sample_rate = os.getenv('ddb_hot_keys')
+    if sample_rate:
+        import atexit
+        enable_write_sampling(float(sample_rate))
+        atexit.register(print_hot_keys)
+
+
+on_env_loaded(_enable_from_env)
@@ -0,0 +1,475 @@
+import base64
+import decimal
+import hashlib
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_bulk import BulkStats, bulk_delete, bulk_write
+from dynamodb_columnar import from_typed
+from dynamodb_query import paginated_query
+from dynamodb_scan import ClientTable, parallel_scan_pages
+from dynamodb_shard import get_sharding
+from dynamodb_waiter import describe_table
+from my_aws_py_base import register_client_hook
+
+
+DEFAULT_BUCKETS = 256
+CHECKPOINT_VERSION = 1
+_WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+
+
+class SyncError(Exception):
+    pass
+
+
+def _canonical(value):
+    '''
+    Bytes of a raw attribute value that only depend on its content (set members are sorted).
+    '''
+    (kind, raw), = value.items()
+    if kind in ('S', 'N'):
+        return f'{kind}{len(raw)}:{raw}'.encode()
+    if kind == 'B':
+        raw = from_typed(value)
+        return b'B%d:' % len(raw) + raw
+    if kind in ('BOOL', 'NULL'):
+        return f'{kind}:{int(bool(raw))}'.encode()
+    if kind in ('SS', 'NS', 'BS'):
+        members = sorted(_canonical({kind[0]: member}) for member in raw)
+        return kind.encode() + b'%d[' % len(members) + b''.join(members) + b']'
+    if kind == 'L':
+        return b'L%d[' % len(raw) + b''.join(_canonical(v) for v in raw) + b']'
+    return b'M%d{' % len(raw) + b''.join(_canonical({'S': k}) + _canonical(raw[k]) for k in sorted(raw)) + b'}'
+
+
+def item_digest(raw_item):
+    '''
+    128-bit content hash of a raw item as an int; XOR-combined digests do not depend on item order.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(raw_item):
+        digest.update(_canonical({'S': name}))
+        digest.update(_canonical(raw_item[name]))
+    return int.from_bytes(digest.digest(), 'big')
+
+
+def bucket_of(hash_key, buckets):
+    data = hash_key if isinstance(hash_key, bytes) else str(hash_key).encode()
+    return zlib.crc32(data) % buckets
+
+
+def _number_text(raw):
+    # 1.50, 1.5 and 15E-1 are the same number key; format() keeps all 38 digits, unlike normalize().
+    number = decimal.Decimal(raw)
+    if not number:
+        return '0'
+    text = format(number, 'f')
+    return text.rstrip('0').rstrip('.') if '.' in text else text
+
+
+def _typed_key(value):
+    # Hashable form of a raw key value, e.g. ('N', '1.5'); numbers in one canonical text, binary as bytes.
+    (kind, raw), = value.items()
+    if kind == 'N':
+        return kind, _number_text(raw)
+    if kind == 'B':
+        # A boto3 Binary from the resource layer, or the str a low-level client also accepts.
+        raw = getattr(raw, 'value', raw)
+        return kind, raw.encode() if isinstance(raw, str) else bytes(raw)
+    return kind, raw
+
+
+def _encode_key(hash_key):
+    kind, raw = hash_key
+    return [kind, base64.b64encode(raw).decode() if kind == 'B' else raw]
+
+
+def _decode_key(kind, raw):
+    return kind, base64.b64decode(raw) if kind == 'B' else raw
+
+
+class HashTree:
+    '''
+    Two levels of a Merkle-like tree over one table: a digest and item count per hash key (the
+    XOR of its items' digests) and a digest per bucket of hash keys. Only hashes are kept, never
+    the items; hash keys are kept typed (see _typed_key) so they can be queried back exactly.
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.partitions = {}
+        self.bucket_digests = [0] * buckets
+        self.items = 0
+
+    def add(self, hash_key, digest):
+        partition_digest, count = self.partition(hash_key)
+        self.partitions[hash_key] = (partition_digest ^ digest, count + 1)
+        self.bucket_digests[bucket_of(hash_key, self.buckets)] ^= digest
+        self.items += 1
+
+    def partition(self, hash_key):
+        return self.partitions.get(hash_key, (0, 0))
+
+    def set_partition(self, hash_key, digest, count):
+        '''
+        Replace what the tree holds for one hash key, e.g. after reading its partition again.
+        '''
+        old_digest, old_count = self.partitions.pop(hash_key, (0, 0))
+        self.bucket_digests[bucket_of(hash_key, self.buckets)] ^= old_digest ^ digest
+        self.items += count - old_count
+        if count:
+            self.partitions[hash_key] = (digest, count)
+
+    def differing_partitions(self, other):
+        '''
+        Hash keys whose items differ between the two trees, looking only into differing buckets.
+        '''
+        buckets = {b for b in range(self.buckets) if self.bucket_digests[b] != other.bucket_digests[b]}
+        if not buckets:
+            return []
+        keys = {k for k in self.partitions if bucket_of(k, self.buckets) in buckets}
+        keys |= {k for k in other.partitions if bucket_of(k, self.buckets) in buckets}
+        return sorted((k for k in keys if self.partition(k) != other.partition(k)), key=repr)
+
+
+def _tree_state(tree):
+    return [_encode_key(hash_key) + [f'{digest:x}', count] for hash_key, (digest, count) in tree.partitions.items()]
+
+
+def _tree_from_state(partitions, buckets):
+    tree = HashTree(buckets)
+    for kind, raw, digest, count in partitions:
+        tree.set_partition(_decode_key(kind, raw), int(digest, 16), count)
+    return tree
+
+
+def hash_table(table_name, hash_name, buckets=DEFAULT_BUCKETS, total_segments=4, max_workers=None):
+    '''
+    HashTree of a table from a parallel raw scan.
+    '''
+    tree = HashTree(buckets)
+    for _, resp in parallel_scan_pages(table_name, total_segments, max_workers, raw=True):
+        for item in resp.get('Items', []):
+            tree.add(_typed_key(item[hash_name]), item_digest(item))
+    return tree
+
+
+# Change tracking ---------------------------------------------------------------------------------
+
+_journal = None
+_hash_names = {}
+_hash_names_lock = threading.Lock()
+
+
+def _journal_path(checkpoint):
+    return checkpoint + '.changes'
+
+
+def _hash_name(table_name):
+    with _hash_names_lock:
+        if table_name in _hash_names:
+            return _hash_names[table_name]
+    description = describe_table(table_name)
+    name = next((key['AttributeName'] for key in description['KeySchema'] if key['KeyType'] == 'HASH'), None) \
+        if description else None
+    if name is not None:
+        with _hash_names_lock:
+            _hash_names[table_name] = name
+    return name
+
+
+def _typed_hash_key(value):
+    # Low-level clients send {'S': 'x'}; the resource layer hands over plain 'x' at this point.
+    if not (isinstance(value, dict) and len(value) == 1 and next(iter(value)) in ('S', 'N', 'B')):
+        from boto3.dynamodb.types import TypeSerializer
+        value = TypeSerializer().serialize(value)
+    return _typed_key(value)
+
+
+def _changed_keys(operation, params):
+    '''
+    {(table name, typed hash key)} a write request may change.
+    '''
+    if operation == 'BatchWriteItem':
+        writes = [(table_name, body.get('Item') or body.get('Key'))
+                  for table_name, requests in params.get('RequestItems', {}).items()
+                  for request in requests for body in request.values()]
+    elif operation == 'TransactWriteItems':
+        writes = [(request['TableName'], request.get('Item') or request.get('Key'))
+                  for action in params.get('TransactItems', []) for kind, request in action.items()
+                  if kind != 'ConditionCheck']
+    else:
+        writes = [(params.get('TableName'), params.get('Item') or params.get('Key'))]
+    changed = set()
+    for table_name, item in writes:
+        hash_name = _hash_name(table_name) if table_name and item else None
+        if hash_name in (item or {}):
+            kind, raw = _typed_hash_key(item[hash_name])
+            shard_map = get_sharding(table_name)
+            # Diffs see the logical partitions of a sharded table (see _read_partition).
+            changed.add((table_name, (kind, shard_map.logical(raw) if shard_map and kind == 'S' else raw)))
+    return changed
+
+
+def _append_changes(path, changes):
+    data = ''.join(json.dumps([table_name] + _encode_key(hash_key)) + '\n' for table_name, hash_key in changes)
+    # One O_APPEND write per request, so the lines of concurrent writers (threads or processes) do not interleave.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data.encode())
+    finally:
+        os.close(fd)
+
+
+def _on_provide_client_params(params, model, context, **kwargs):
+    journal = _journal
+    if journal is not None and model.name in _WRITE_OPERATIONS:
+        context['sync_changes'] = (journal, _changed_keys(model.name, params))
+
+
+def _on_call_done(context, **kwargs):
+    # Journaled once the write has happened (or failed), so a diff that has read the journal
+    # past this line reads the partition after the write.
+    journal, changes = context.pop('sync_changes', (None, None))
+    if changes:
+        _append_changes(journal, changes)
+
+
+def _install_handlers(client):
+    if client.meta.service_model.service_name != 'dynamodb':
+        return
+    client.meta.events.register('provide-client-params', _on_provide_client_params)
+    client.meta.events.register('after-call', _on_call_done)
+    client.meta.events.register('after-call-error', _on_call_done)
+
+
+def track_changes(checkpoint):
+    '''
+    Journal the hash key of every DynamoDB write of this process next to `checkpoint`, so
+    diff_tables(..., checkpoint=checkpoint) only reads the partitions written since its last run.
+    '''
+    global _journal
+    _journal = _journal_path(checkpoint)
+    register_client_hook(_install_handlers)
+
+
+def stop_tracking_changes():
+    global _journal
+    _journal = None
+
+
+def _read_changes(checkpoint, offset):
+    '''
+    ({table name: {typed hash key}}, new offset) of the complete journal lines past `offset`,
+    or None when the journal no longer holds `offset` bytes.
+    '''
+    path = _journal_path(checkpoint)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size < offset:
+        return None
+    if size == offset:
+        return {}, offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    # A line still being appended is read by the next run.
+    end = data.rfind(b'\n') + 1
+    changes = {}
+    for line in data[:end].splitlines():
+        table_name, kind, raw = json.loads(line)
+        changes.setdefault(table_name, set()).add(_decode_key(kind, raw))
+    return changes, offset + end
+
+
+def _journal_size(checkpoint):
+    path = _journal_path(checkpoint)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+# Checkpoints -------------------------------------------------------------------------------------
+
+def _load_checkpoint(checkpoint, source, target, hash_name, buckets):
+    '''
+    (source tree, target tree, journal offset) saved by the last diff of the same tables, or None.
+    '''
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint) as f:
+        state = json.load(f)
+    if (state.get('version'), state.get('source'), state.get('target'), state.get('hash_name'),
+            state.get('buckets')) != (CHECKPOINT_VERSION, source, target, hash_name, buckets):
+        return None
+    return (_tree_from_state(state['partitions'][source], buckets),
+            _tree_from_state(state['partitions'][target], buckets), state['offset'])
+
+
+def _save_checkpoint(checkpoint, source, target, hash_name, source_tree, target_tree, offset):
+    state = {
+        'version': CHECKPOINT_VERSION, 'source': source, 'target': target, 'hash_name': hash_name,
+        'buckets': source_tree.buckets, 'offset': offset,
+        'partitions': {source: _tree_state(source_tree), target: _tree_state(target_tree)},
+    }
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, checkpoint)
+
+
+# Diff --------------------------------------------------------------------------------------------
+
+class TableDiff:
+    '''
+    What to write to `target` to make it equal to `source`: whole items to put and keys to delete.
+    '''
+
+    def __init__(self, source, target, key_names):
+        self.source = source
+        self.target = target
+        self.key_names = key_names
+        self.puts = []
+        self.deletes = []
+        self.source_items = 0
+        self.target_items = 0
+        self.buckets = 0
+        self.differing_buckets = 0
+        self.differing_partitions = 0
+        self.full_scan = False
+        self.partitions_read = 0
+        # Set by diff_tables with a checkpoint, for apply_diff to record the synced partitions.
+        self.checkpoint = None
+        self._state = None
+
+    def __bool__(self):
+        return bool(self.puts or self.deletes)
+
+    def summary(self):
+        return {
+            'source_items': self.source_items, 'target_items': self.target_items,
+            'buckets': self.buckets, 'differing_buckets': self.differing_buckets,
+            'differing_partitions': self.differing_partitions, 'full_scan': self.full_scan,
+            'partitions_read': self.partitions_read, 'puts': len(self.puts), 'deletes': len(self.deletes),
+        }
+
+    def __str__(self):
+        return ', '.join(f'{k}={v}' for k, v in self.summary().items())
+
+
+def _key_names(table_name):
+    description = describe_table(table_name)
+    if description is None:
+        raise SyncError(f'Table ({table_name}) does not exist')
+    keys = {key['KeyType']: key['AttributeName'] for key in description['KeySchema']}
+    return keys['HASH'], keys.get('RANGE')
+
+
+def _read_partition(table_name, hash_name, hash_key):
+    '''
+    (digest, raw items) of one hash key, read consistently; the logical partition of a sharded
+    table is read from all of its shards.
+    '''
+    # A raw query with the typed key: the resource layer would reject a float hash key.
+    kind, raw = hash_key
+    shard_map = get_sharding(table_name)
+    physical_keys = shard_map.physical_keys(raw) if shard_map and kind == 'S' else [raw]
+    items = [item for physical in physical_keys
+             for item in paginated_query(ClientTable(table_name), KeyConditionExpression='#h = :h', ConsistentRead=True,
+                                         ExpressionAttributeNames={'#h': hash_name},
+                                         ExpressionAttributeValues={':h': {kind: physical}})]
+    digest = 0
+    for item in items:
+        digest ^= item_digest(item)
+    return digest, items
+
+
+def _by_key(raw_items, key_names):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    items = ({name: deserializer.deserialize(value) for name, value in item.items()} for item in raw_items)
+    return {tuple(item.get(name) for name in key_names): item for item in items}
+
+
+def diff_tables(source, target, buckets=DEFAULT_BUCKETS, total_segments=4, concurrency=8, checkpoint=None,
+                full=False):
+    '''
+    TableDiff of `target` against `source`. Both tables are hashed concurrently with parallel
+    scans, then only the hash keys of differing buckets are compared and only the partitions
+    whose digests differ are read back (one query each) to find the items to put and delete.
+
+    With `checkpoint` (a file path) both hash trees are saved there, and the next diff of the same
+    tables scans nothing: it reads once each partition that track_changes journaled since, and the
+    partitions that still differ, so a re-run costs reads in proportion to the drift. Every process
+    writing to either table must track changes into the same checkpoint; when one does not, or the
+    checkpoint is suspect, pass `full` to scan again.
+    '''
+    hash_name, range_name = _key_names(source)
+    if _key_names(target) != (hash_name, range_name):
+        raise SyncError(f'Tables ({source}, {target}) have different key schemas')
+    key_names = [name for name in (hash_name, range_name) if name]
+    diff = TableDiff(source, target, key_names)
+    state = _load_checkpoint(checkpoint, source, target, hash_name, buckets) if checkpoint and not full else None
+    changes = _read_changes(checkpoint, state[2]) if state else None
+    reads = {}
+    with ThreadPoolExecutor(max_workers=max(2, concurrency), thread_name_prefix='sync') as executor:
+
+        def read(wanted):
+            wanted = [entry for entry in dict.fromkeys(wanted) if entry not in reads]
+            reads.update(zip(wanted, executor.map(lambda entry: _read_partition(entry[0], hash_name, entry[1]),
+                                                  wanted)))
+            for table_name, hash_key in wanted:
+                digest, items = reads[(table_name, hash_key)]
+                trees[table_name].set_partition(hash_key, digest, len(items))
+
+        if changes is None:
+            # Writes journaled while the tables are scanned are read again by the next run.
+            offset = _journal_size(checkpoint) if checkpoint else 0
+            source_tree, target_tree = executor.map(lambda name: hash_table(name, hash_name, buckets, total_segments),
+                                                    (source, target))
+            trees = {source: source_tree, target: target_tree}
+            diff.full_scan = True
+        else:
+            source_tree, target_tree, _ = state
+            changes, offset = changes
+            trees = {source: source_tree, target: target_tree}
+            read([(table_name, hash_key) for table_name in (source, target)
+                  for hash_key in sorted(changes.get(table_name, ()), key=repr)])
+        partitions = source_tree.differing_partitions(target_tree)
+        # Partitions read above are current already; only the others are read here.
+        read([(table_name, hash_key) for hash_key in partitions for table_name in (source, target)])
+    # A partition read again may turn out equal after all, e.g. written to during the scan.
+    partitions = [hash_key for hash_key in partitions
+                  if source_tree.partition(hash_key) != target_tree.partition(hash_key)]
+    for hash_key in partitions:
+        wanted = _by_key(reads[(source, hash_key)][1], key_names)
+        present = _by_key(reads[(target, hash_key)][1], key_names)
+        diff.puts.extend(item for key, item in wanted.items() if present.get(key) != item)
+        diff.deletes.extend({name: present[key][name] for name in key_names} for key in present if key not in wanted)
+    diff.source_items, diff.target_items, diff.buckets = source_tree.items, target_tree.items, buckets
+    diff.differing_buckets = sum(a != b for a, b in zip(source_tree.bucket_digests, target_tree.bucket_digests))
+    diff.differing_partitions = len(partitions)
+    diff.partitions_read = len(reads)
+    if checkpoint:
+        _save_checkpoint(checkpoint, source, target, hash_name, source_tree, target_tree, offset)
+        diff.checkpoint, diff._state = checkpoint, (hash_name, source_tree, target_tree, offset, partitions)
+    return diff
+
+
+def apply_diff(diff, concurrency=8):
+    '''
+    Write a TableDiff to its target with bulk_write and bulk_delete; returns (put, delete) BulkStats.
+    A diff with a checkpoint records the synced partitions as equal, so the next diff skips them.
+    '''
+    put_stats = bulk_write(diff.target, diff.puts, concurrency=concurrency) if diff.puts else BulkStats().finish()
+    delete_stats = bulk_delete(diff.target, diff.deletes, concurrency=concurrency) if diff.deletes \
+        else BulkStats().finish()
+    if diff.checkpoint:
+        hash_name, source_tree, target_tree, offset, partitions = diff._state
+        for hash_key in partitions:
+            target_tree.set_partition(hash_key, *source_tree.partition(hash_key))
+        _save_checkpoint(diff.checkpoint, diff.source, diff.target, hash_name, source_tree, target_tree, offset)
+    return put_stats, delete_stats
+
@@ -0,0 +1,134 @@
+import heapq
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dynamodb_scan import ClientTable
+from dynamodb_shard import get_sharding
+from my_aws_py_base import _get_boto_resource_client
+
+
+class _Reversed:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class TopNStats:
+    def __init__(self):
+        self.partitions = 0
+        self.pages = 0
+        self.items = 0
+        self.pruned = 0
+
+    def as_dict(self):
+        return {'partitions': self.partitions, 'pages': self.pages, 'items': self.items, 'pruned': self.pruned}
+
+    def __str__(self):
+        return ', '.join(f'{k}={v}' for k, v in self.as_dict().items())
+
+
+class _TopHeap:
+    '''
+    The best `n` items seen so far; the root is the worst of them, i.e. the one to evict next.
+    '''
+
+    def __init__(self, n, sort_key, ascending):
+        self.n = n
+        self.sort_key = sort_key
+        self.ascending = ascending
+        self._heap = []
+        self._seq = itertools.count()
+
+    def _entry_key(self, value, seq):
+        # On equal sort keys the item seen first wins.
+        return (_Reversed(value), _Reversed(seq)) if self.ascending else (value, _Reversed(seq))
+
+    def push(self, item):
+        entry = (self._entry_key(item[self.sort_key], next(self._seq)), item)
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, entry)
+        elif self._heap[0][0] < entry[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def can_improve(self, value):
+        '''
+        Whether an item with sort key `value` would still make it into the top n.
+        '''
+        if len(self._heap) < self.n:
+            return True
+        worst = self._heap[0][1][self.sort_key]
+        return value < worst if self.ascending else worst < value
+
+    def items(self):
+        return [item for _, item in sorted(self._heap, reverse=True)]
+
+
+def _query_page(table_name, query_kwargs, limit, start_key):
+    table = ClientTable(table_name, _get_boto_resource_client('dynamodb'))
+    if start_key:
+        query_kwargs = dict(query_kwargs, ExclusiveStartKey=start_key)
+    resp = table.query(Limit=limit, **query_kwargs)
+    shard_map = get_sharding(table_name)
+    if shard_map is not None and 'Items' in resp:
+        resp['Items'] = [shard_map.to_logical(item) for item in resp['Items']]
+    return resp
+
+
+def top_n(table_name, partition_keys, n=10, hash_key='AlbumTitle', sort_key='Length',
+          index_name='AlbumTitle-Length-index', ascending=True, page_size=None, concurrency=16, stats=None, **query_kwargs):
+    '''
+    The `n` items with the smallest (or, with ascending=False, largest) `sort_key` across all
+    `partition_keys` values of `hash_key`, best first.
+
+    One ordered, limited query per partition runs concurrently and pages are merged into a
+    bounded heap as they arrive. A partition stops paging as soon as its last item can no longer
+    enter the top n, so the latency follows the slowest partition rather than their sum.
+    Pages hold at most `page_size` items (default n) and no partition is read past n items.
+    '''
+    from boto3.dynamodb.conditions import Key
+    stats = stats if stats is not None else TopNStats()
+    partition_keys = partition_keys.split(',') if isinstance(partition_keys, str) else list(partition_keys)
+    if index_name:
+        query_kwargs['IndexName'] = index_name
+    query_kwargs['ScanIndexForward'] = ascending
+    heap = _TopHeap(n, sort_key, ascending)
+    stats.partitions = len(partition_keys)
+    if n <= 0:
+        return []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'topn-{table_name}') as executor:
+        def submit(partition_key, fetched, start_key):
+            kwargs = dict(query_kwargs, KeyConditionExpression=Key(hash_key).eq(partition_key))
+            future = executor.submit(_query_page, table_name, kwargs, min(page_size or n, n - fetched), start_key)
+            pending[future] = (partition_key, fetched)
+
+        pending = {}
+        for partition_key in partition_keys:
+            submit(partition_key, 0, None)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                partition_key, fetched = pending.pop(future)
+                resp = future.result()
+                items = resp.get('Items', [])
+                stats.pages += 1
+                stats.items += len(items)
+                for item in items:
+                    heap.push(item)
+                fetched += len(items)
+                start_key = resp.get('LastEvaluatedKey')
+                if not start_key or fetched >= n:
+                    continue
+                # Items of a partition arrive in sort order: once the last one read (returned or
+                # filtered out) cannot make the top n, nothing after it can either.
+                if sort_key in start_key and not heap.can_improve(start_key[sort_key]):
+                    stats.pruned += 1
+                    continue
+                submit(partition_key, fetched, start_key)
+    return heap.items()
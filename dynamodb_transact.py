@@ -0,0 +1,219 @@
+import functools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_bulk import _backoff_delay
+from dynamodb_cache import invalidate_transact_items
+from dynamodb_shard import routable_sharding
+import my_aws_py_base
+from dynamodb_waiter import describe_table
+from my_aws_py_base import _get_boto_client
+
+
+TRANSACT_MAX_ACTIONS = 100
+RETRYABLE_REASONS = {'TransactionConflict', 'ThrottlingError', 'ProvisionedThroughputExceeded'}
+RETRYABLE_ERRORS = {'TransactionInProgressException', 'ProvisionedThroughputExceededException',
+                    'ThrottlingException', 'RequestLimitExceeded', 'InternalServerError'}
+# Key schemas are cached this long, so a table deleted and recreated is described again.
+KEY_SCHEMA_TTL = 60.0
+
+
+class TransactionConflictError(ValueError):
+    pass
+
+
+class TableNotFoundError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_key_names(table_name, generation, epoch):
+    description = describe_table(table_name)
+    if description is None:
+        raise TableNotFoundError(f'Table ({table_name}) does not exist')
+    return tuple(key['AttributeName'] for key in description['KeySchema'])
+
+
+def _key_names(table_name):
+    # Cached per registry generation (close_boto_registry) and KEY_SCHEMA_TTL period.
+    return _cached_key_names(table_name, my_aws_py_base._registry_generation, int(time.monotonic() // KEY_SCHEMA_TTL))
+
+
+def _action_key(action):
+    '''
+    (table_name, key) of the item one TransactItems action touches.
+    '''
+    (kind, request), = action.items()
+    if kind == 'Put':
+        item = request['Item']
+        key = {name: item[name] for name in _key_names(request['TableName'])}
+    else:
+        key = request['Key']
+    return request['TableName'], tuple(sorted((name, tuple(value.items())) for name, value in key.items()))
+
+
+def _route(action):
+    '''
+    The action on the shard of its item when its table is hash-sharded (see dynamodb_shard).
+    '''
+    (kind, request), = action.items()
+    shard_map = routable_sharding(request['TableName'], 'transact_write')
+    if shard_map is None:
+        return action
+    field = 'Item' if kind == 'Put' else 'Key'
+    return {kind: dict(request, **{field: shard_map.to_physical(request[field])})}
+
+
+class _Group:
+    def __init__(self, index, actions):
+        self.index = index
+        self.actions = actions
+        self.keys = [_action_key(action) for action in actions]
+        if len(set(self.keys)) != len(self.keys):
+            raise TransactionConflictError(
+                f'Operation {index} has more than one action on the same item, which a transaction cannot do')
+        if len(actions) > TRANSACT_MAX_ACTIONS:
+            raise TransactionConflictError(f'Operation {index} has more than {TRANSACT_MAX_ACTIONS} actions')
+
+
+class TransactStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = 0
+        self.transactions = 0
+        self.requests = 0
+        self.retries = 0
+        self.conflicts = 0
+        self.throttles = 0
+        self.succeeded = []
+        self.failed = {}
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            'operations': self.operations,
+            'transactions': self.transactions,
+            'requests': self.requests,
+            'retries': self.retries,
+            'conflicts': self.conflicts,
+            'throttles': self.throttles,
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+        }
+
+    def __str__(self):
+        return ', '.join(f'{k}={v}' for k, v in self.as_dict().items())
+
+
+def pack(operations):
+    '''
+    Pack logical operations (each a list of TransactItems actions applied atomically) into
+    waves of transactions with at most 100 actions and no two actions on the same item.
+
+    An operation always lands in a later wave than any earlier operation touching one of its
+    items, so operations on the same item keep their order; transactions within a wave never
+    share an item and can run concurrently.
+    '''
+    groups = [_Group(index, list(actions)) for index, actions in enumerate(operations)]
+    transactions = []  # [wave, [groups], set of keys]
+    last_wave = {}
+    for group in groups:
+        earliest = max((last_wave[key] + 1 for key in group.keys if key in last_wave), default=0)
+        for transaction in transactions:
+            wave, members, keys = transaction
+            if (wave >= earliest and sum(len(g.actions) for g in members) + len(group.actions) <= TRANSACT_MAX_ACTIONS
+                    and keys.isdisjoint(group.keys)):
+                break
+        else:
+            transaction = [earliest, [], set()]
+            transactions.append(transaction)
+        transaction[1].append(group)
+        transaction[2].update(group.keys)
+        for key in group.keys:
+            last_wave[key] = max(last_wave.get(key, -1), transaction[0])
+    waves = {}
+    for wave, members, _ in transactions:
+        waves.setdefault(wave, []).append(members)
+    return [waves[wave] for wave in sorted(waves)]
+
+
+def _failed_groups(groups, reasons):
+    failed, offset = {}, 0
+    for group in groups:
+        codes = [reason.get('Code') for reason in reasons[offset:offset + len(group.actions)]]
+        offset += len(group.actions)
+        bad = [code for code in codes if code and code != 'None']
+        if bad and not set(bad) <= RETRYABLE_REASONS:
+            failed[group.index] = ','.join(sorted(set(bad)))
+    return failed
+
+
+def _run_transaction(groups, stats, max_retries, base_delay, max_delay):
+    client = _get_boto_client('dynamodb')
+    token = str(uuid.uuid4())
+    attempt = 0
+    while groups:
+        actions = [action for group in groups for action in group.actions]
+        stats.add(requests=1)
+        try:
+            # The same token on every retry of the same actions makes the retry idempotent.
+            client.transact_write_items(TransactItems=actions, ClientRequestToken=token)
+        except client.exceptions.ClientError as ex:
+            code = ex.response.get('Error', {}).get('Code')
+            reasons = ex.response.get('CancellationReasons') or []
+            if code == 'TransactionCanceledException' and reasons:
+                failed = _failed_groups(groups, reasons)
+                if failed:
+                    # Drop the operations that can never succeed and retry the rest as a new transaction.
+                    with stats._lock:
+                        stats.failed.update(failed)
+                    groups = [group for group in groups if group.index not in failed]
+                    token = str(uuid.uuid4())
+                    continue
+                codes = {reason.get('Code') for reason in reasons}
+                stats.add(conflicts=int('TransactionConflict' in codes),
+                          throttles=int(bool(codes & {'ThrottlingError', 'ProvisionedThroughputExceeded'})))
+            elif code in RETRYABLE_ERRORS:
+                stats.add(throttles=int(code != 'TransactionInProgressException'))
+            else:
+                raise
+            if attempt >= max_retries:
+                with stats._lock:
+                    stats.failed.update({group.index: f'{code} after {max_retries} retries' for group in groups})
+                return
+            stats.add(retries=1)
+            time.sleep(_backoff_delay(attempt, base_delay, max_delay))
+            attempt += 1
+            continue
+        invalidate_transact_items(actions)
+        with stats._lock:
+            stats.succeeded.extend(group.index for group in groups)
+        return
+
+
+def transact_write(operations, concurrency=8, max_retries=10, base_delay=0.05, max_delay=5.0):
+    '''
+    Apply logical operations (each a list of TransactItems actions) with as few TransactWriteItems
+    calls as possible (see pack). Transactions of a wave run concurrently; conflicts and throttles
+    are retried with jittered backoff under the transaction's idempotency token, and operations
+    whose conditions fail are reported in TransactStats.failed ({operation index: reason})
+    without failing the rest of their transaction. Actions on hash-sharded tables go to the
+    shards of their items.
+    '''
+    operations = [[_route(action) for action in actions] for actions in operations]
+    stats = TransactStats()
+    stats.operations = len(operations)
+    waves = pack(operations)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='transact') as executor:
+        for wave in waves:
+            stats.add(transactions=len(wave))
+            for future in [executor.submit(_run_transaction, groups, stats, max_retries, base_delay, max_delay)
+                           for groups in wave]:
+                future.result()
+    return stats
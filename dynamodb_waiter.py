@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from my_aws_py_base import _get_boto_client
+
+
+TABLE_STATUSES = ('table_exists', 'table_not_exists')
+INDEX_STATUSES = ('active', 'exists', 'not_exists')
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+def poll_delays(initial_delay=0.5, max_delay=10.0, backoff=1.5):
+    '''
+    Adaptive polling schedule: fast at first, then backing off geometrically up to `max_delay`.
+    '''
+    delay = initial_delay
+    while True:
+        yield delay
+        delay = min(max_delay, delay * backoff)
+
+
+def describe_table(table_name, client=None):
+    '''
+    The DescribeTable 'Table' description, or None when the table does not exist.
+    '''
+    client = client or _get_boto_client('dynamodb')
+    try:
+        return client.describe_table(TableName=table_name)['Table']
+    except client.exceptions.ResourceNotFoundException:
+        return None
+
+
+def get_status(description, index_name=None):
+    '''
+    TableStatus (or IndexStatus of `index_name`) of a DescribeTable description, None if absent.
+    With index_name='*' the status is ACTIVE only when the table has GSIs and all are ACTIVE.
+    '''
+    if description is None:
+        return None
+    if index_name is None:
+        return description.get('TableStatus')
+    indexes = description.get('GlobalSecondaryIndexes') or []
+    if index_name == '*':
+        if not indexes:
+            return None
+        statuses = {gsi.get('IndexStatus') for gsi in indexes}
+        return 'ACTIVE' if statuses == {'ACTIVE'} else ','.join(sorted(s for s in statuses if s))
+    for gsi in indexes:
+        if gsi.get('IndexName') == index_name:
+            return gsi.get('IndexStatus')
+    return None
+
+
+def is_satisfied(description, index_name, status):
+    current = get_status(description, index_name)
+    if index_name is None:
+        if status == 'table_exists':
+            return current == 'ACTIVE'
+        return current is None
+    if status == 'active':
+        return current == 'ACTIVE'
+    if status == 'exists':
+        return current is not None
+    return current is None
+
+
+def _check_target(table_name, index_name, status):
+    valid = TABLE_STATUSES if index_name is None else INDEX_STATUSES
+    if status not in valid:
+        raise ValueError(f'Status ({status}) is not valid for {table_name}/{index_name}! Valid statuses are {valid}.')
+    return table_name, index_name, status
+
+
+def wait_for(targets, timeout=600, initial_delay=0.5, max_delay=10.0, backoff=1.5, max_workers=8, verbose=True):
+    '''
+    Wait until every (table_name, index_name, status) target is satisfied.
+
+    index_name None targets the table (status 'table_exists' or 'table_not_exists'), any other
+    value a GSI (status 'active', 'exists' or 'not_exists'; '*' means all GSIs of the table).
+    Each table is described once per poll no matter how many of its indexes are watched, tables
+    are polled concurrently on their own adaptive schedule, and WaitTimeout is raised when
+    `timeout` seconds pass with targets still pending.
+    '''
+    pending = {}
+    for table_name, index_name, status in (_check_target(*target) for target in targets):
+        pending.setdefault(table_name, set()).add((index_name, status))
+    schedules = {table_name: poll_delays(initial_delay, max_delay, backoff) for table_name in pending}
+    next_poll = {table_name: 0.0 for table_name in pending}
+    deadline = time.monotonic() + timeout
+    client = _get_boto_client('dynamodb')
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+        while pending:
+            now = time.monotonic()
+            due = [table_name for table_name in pending if next_poll[table_name] <= now]
+            descriptions = dict(zip(due, executor.map(lambda name: describe_table(name, client), due)))
+            for table_name, description in descriptions.items():
+                waiting = {(index_name, status) for index_name, status in pending[table_name]
+                           if not is_satisfied(description, index_name, status)}
+                if not waiting:
+                    del pending[table_name]
+                    continue
+                pending[table_name] = waiting
+                next_poll[table_name] = time.monotonic() + next(schedules[table_name])
+                if verbose:
+                    for index_name, status in sorted(waiting, key=str):
+                        name = table_name if index_name is None else f'{table_name}/{index_name}'
+                        print(f'Wait ({name}) being {status}... ({get_status(description, index_name)})')
+            if not pending:
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                names = [f'{t}/{i}' if i else t for t, targets in pending.items() for i, _ in targets]
+                raise WaitTimeout(f'Timed out after {timeout}s waiting for {sorted(names)}')
+            time.sleep(max(0.0, min(min(next_poll[t] for t in pending), deadline) - now))
@@ -0,0 +1,386 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamodb_bulk import _backoff_delay, bulk_write
+from dynamodb_cache import _freeze, cached_get_item, invalidate_item
+from dynamodb_waiter import describe_table
+from my_aws_py_base import _get_boto_resource_client, on_env_loaded
+
+
+DURABILITY_MODES = ('async', 'sync')
+
+
+class WriteBehindError(Exception):
+    def __init__(self, message, failed=()):
+        super().__init__(message)
+        # [(table_name, item or None, SET values or None)] of the writes that were given up on.
+        self.failed = list(failed)
+
+
+class _Entry:
+    '''
+    The final state of one key since the last flush: a whole item (put) or SET values (update).
+    Every write merged into it waits on the same event when durability is 'sync'.
+    '''
+
+    def __init__(self, table_name, key, item=None, values=None):
+        self.table_name = table_name
+        self.key = key
+        self.item = item
+        self.values = values
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.error = None
+        self.attempts = 0
+
+    def merge_put(self, item):
+        self.item, self.values = dict(item), None
+
+    def merge_update(self, values):
+        if self.item is not None:
+            self.item.update(values)
+        else:
+            self.values.update(values)
+
+    def view(self, load):
+        '''
+        The item as it will be once this entry is written; `load` reads the stored item.
+        '''
+        if self.item is not None:
+            return dict(self.item)
+        # UpdateItem creates a missing item from its key.
+        return dict(load() or self.key, **self.values)
+
+
+class WriteBehindBuffer:
+    '''
+    Coalesces put_item and SET-only update_item calls per key and writes only the last state of
+    each key, with BatchWriteItem for puts and one UpdateItem per updated key. A background thread
+    flushes once `max_items` keys are pending or the oldest pending write is `max_delay` seconds
+    old. Reads through get() see pending writes. With durability='sync' a write returns once the
+    flush that contains it has succeeded (and raises if it failed); with 'async' it returns at
+    once, a failed write is buffered again for up to `max_retries` more flushes, and flush()
+    raises WriteBehindError with the writes it gave up on.
+    '''
+
+    def __init__(self, max_items=100, max_delay=1.0, durability='async', concurrency=8, max_retries=3):
+        if durability not in DURABILITY_MODES:
+            raise WriteBehindError(f'Durability ({durability}) is not valid! Valid modes are {DURABILITY_MODES}.')
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.durability = durability
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = {}
+        self._key_names = {}
+        self._failed = []
+        self._closed = False
+        self._thread = None
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.items_written = 0
+        self.retries = 0
+
+    def _names(self, table_name):
+        key_names = self._key_names.get(table_name)
+        if key_names is None:
+            description = describe_table(table_name)
+            if description is None:
+                raise WriteBehindError(f'Table ({table_name}) does not exist')
+            key_names = self._key_names[table_name] = tuple(k['AttributeName'] for k in description['KeySchema'])
+        return key_names
+
+    def _key(self, table_name, item):
+        key = {name: item[name] for name in self._names(table_name)}
+        return (table_name, _freeze(key)), key
+
+    def _write(self, table_name, item, values):
+        if self._closed:
+            raise WriteBehindError('The write-behind buffer is closed')
+        slot, key = self._key(table_name, item)
+        with self._lock:
+            entry = self._pending.get(slot)
+            if entry is None:
+                entry = self._pending[slot] = _Entry(table_name, key, dict(item) if values is None else None,
+                                                     None if values is None else dict(values))
+            else:
+                self.coalesced += 1
+                if values is None:
+                    entry.merge_put(item)
+                else:
+                    entry.merge_update(values)
+            self.writes += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            # Wake the flusher to start the clock on a first entry, or to flush a full buffer.
+            if len(self._pending) in (1, self.max_items):
+                self._lock.notify()
+        if self.durability == 'sync':
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+
+    def put(self, table_name, item):
+        self._write(table_name, item, None)
+
+    def update(self, table_name, key, values):
+        '''
+        Buffer `UPDATE ... SET name = value` for every name, value of `values`.
+        '''
+        self._write(table_name, key, values)
+
+    def discard(self, table_name, key):
+        '''
+        Drop the pending write of `key`, e.g. before deleting the item, and wait for one in flight.
+        '''
+        slot, _ = self._key(table_name, key)
+        with self._lock:
+            entry = self._pending.pop(slot, None)
+            in_flight = self._in_flight.get(slot)
+        if entry is not None:
+            entry.done.set()
+        if in_flight is not None:
+            in_flight.done.wait()
+
+    def get(self, table_name, key, load):
+        '''
+        The item of `key` including its buffered writes; `load()` reads it from the table.
+        '''
+        slot, _ = self._key(table_name, key)
+        with self._lock:
+            pending, in_flight = self._pending.get(slot), self._in_flight.get(slot)
+        if in_flight is not None:
+            load = functools.partial(in_flight.view, load)
+        return load() if pending is None else pending.view(load)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if len(self._pending) >= self.max_items:
+                        break
+                    oldest = min((e.created_at for e in self._pending.values()), default=None)
+                    timeout = None if oldest is None else oldest + self.max_delay - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._lock.wait(timeout)
+                if self._closed:
+                    return
+            try:
+                self._flush()
+            except Exception:
+                # Already recorded on the entries, and buffered again or kept for flush() to report.
+                pass
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+            if not batch:
+                return
+            try:
+                errors = self._write_entries(list(batch.values()))
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+                    self.flushes += 1
+                for entry in batch.values():
+                    entry.done.set()
+            if errors:
+                self._requeue([entry for entry in batch.values() if entry.error is not None])
+                raise errors[0]
+
+    def _requeue(self, entries):
+        '''
+        Buffer failed async writes again, under any write made to the same key since; keep the
+        ones out of retries (and every failed sync write, whose caller saw the error) for flush().
+        '''
+        with self._lock:
+            for entry in entries:
+                entry.attempts += 1
+                if self.durability == 'sync' or entry.attempts > self.max_retries:
+                    self._failed.append(entry)
+                    continue
+                self.retries += 1
+                slot = (entry.table_name, _freeze(entry.key))
+                newer = self._pending.get(slot)
+                if newer is None:
+                    retry = self._pending[slot] = _Entry(entry.table_name, entry.key, entry.item, entry.values)
+                    retry.attempts = entry.attempts
+                elif newer.item is None:
+                    # A later update applies on top of the failed write; a later put replaces it.
+                    if entry.item is not None:
+                        newer.item, newer.values = dict(entry.item, **newer.values), None
+                    else:
+                        newer.values = dict(entry.values, **newer.values)
+            if self._pending:
+                self._lock.notify()
+
+    def _write_entries(self, entries):
+        '''
+        Write the entries and return the exceptions of the failed ones.
+        '''
+        errors = []
+        puts, updates = {}, []
+        for entry in entries:
+            if entry.item is not None:
+                puts.setdefault(entry.table_name, []).append(entry)
+            else:
+                updates.append(entry)
+        for table_name, table_puts in puts.items():
+            try:
+                bulk_write(table_name, [entry.item for entry in table_puts], concurrency=self.concurrency)
+                self.items_written += len(table_puts)
+            except Exception as ex:
+                errors.append(ex)
+                for entry in table_puts:
+                    entry.error = ex
+        if updates:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='write-behind') as executor:
+                for entry, error in zip(updates, executor.map(_update_entry, updates)):
+                    if error is None:
+                        self.items_written += 1
+                    else:
+                        errors.append(error)
+                        entry.error = error
+        return errors
+
+    def flush(self):
+        '''
+        Write everything buffered so far, retrying failed writes with backoff, then raise
+        WriteBehindError with the writes given up on since the last call (see its `failed`).
+        '''
+        for attempt in range(self.max_retries + 1):
+            self._flush_safely()
+            if not self.pending():
+                break
+            time.sleep(_backoff_delay(attempt))
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed:
+            raise WriteBehindError(f'{len(failed)} buffered write(s) failed, first: {failed[0].error!r}',
+                                   [(entry.table_name, entry.item, entry.values) for entry in failed]) \
+                from failed[0].error
+
+    def _flush_safely(self):
+        try:
+            self._flush()
+        except Exception:
+            pass
+
+    def close(self):
+        '''
+        Flush and stop the background thread.
+        '''
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'items_written': self.items_written,
+                'retries': self.retries,
+                'durability': self.durability,
+            }
+
+
+def _update_entry(entry):
+    names = {f'#a{i}': name for i, name in enumerate(entry.values)}
+    try:
+        _get_boto_resource_client('dynamodb').update_item(
+            TableName=entry.table_name, Key=entry.key,
+            UpdateExpression='SET ' + ', '.join(f'{alias} = :v{i}' for i, alias in enumerate(names)),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f':v{i}': value for i, value in enumerate(entry.values.values())},
+        )
+    except Exception as ex:
+        return ex
+    finally:
+        invalidate_item(entry.table_name, entry.key)
+    return None
+
+
+_buffer = None
+
+
+def enable_write_behind(max_items=100, max_delay=1.0, durability='async', concurrency=8):
+    global _buffer
+    if _buffer is not None:
+        _buffer.close()
+    _buffer = WriteBehindBuffer(max_items, max_delay, durability, concurrency)
+    return _buffer
+
+
+def disable_write_behind():
+    '''
+    Flush what is buffered and go back to writing through.
+    '''
+    global _buffer
+    buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.close()
+
+
+def get_write_behind():
+    return _buffer
+
+
+@contextlib.contextmanager
+def write_behind(max_items=100, max_delay=1.0, durability='async', concurrency=8):
+    '''
+    Buffer writes inside the block only: the buffer is flushed and writes go through again on
+    exit. An already enabled buffer is used as it is and left enabled.
+    '''
+    buffer = get_write_behind()
+    if buffer is not None:
+        yield buffer
+        return
+    buffer = enable_write_behind(max_items, max_delay, durability, concurrency)
+    try:
+        yield buffer
+    finally:
+        if get_write_behind() is buffer:
+            disable_write_behind()
+
+
+def buffered_get_item(table, key):
+    '''
+    cached_get_item(table, key), including the writes to `key` still in the buffer.
+    '''
+    load = lambda: cached_get_item(table, key)
+    buffer = get_write_behind()
+    return load() if buffer is None else buffer.get(table.name, key, load)
+
+
+def _enable_write_behind_from_env():
+    # e.g. ddb_write_behind=0.5 coalesces writes for up to half a second; flushed at exit.
+    max_delay = os.getenv('ddb_write_behind')
+    if max_delay:
+        import atexit
+        enable_write_behind(max_delay=float(max_delay), durability=os.getenv('ddb_write_behind_durability', 'async'))
+        atexit.register(disable_write_behind)
+
+
+on_env_loaded(_enable_write_behind_from_env)
@@ -1,46 +1,428 @@
+import functools
 import os
+import sys
+import threading
+import time
+import types
 
-import boto3
-from dotenv import load_dotenv
 
-load_dotenv()
+# boto3, botocore and dotenv cost hundreds of milliseconds to import, so they are only imported
+# (and .env only read) by the first call that needs them; importing this module stays cheap.
+_env_lock = threading.RLock()
+_env_loaded = False
+_env_loading = False
+_env_hooks = []
 
 
-def _get_boto_session(profile_name=None):
+def _load_env():
+    global _env_loaded, _env_loading
+    if _env_loaded:
+        return
+    with _env_lock:
+        # A hook that needs the env again (in this thread) finds it being loaded.
+        if _env_loaded or _env_loading:
+            return
+        _env_loading = True
+        from dotenv import load_dotenv
+        load_dotenv()
+        # Hooks run before the env is published as loaded, so other threads wait for them
+        # instead of creating clients the hooks have not set up yet.
+        try:
+            for hook in _env_hooks:
+                hook()
+        finally:
+            _env_loaded = True
+
+
+def on_env_loaded(hook):
+    '''
+    Call hook() once .env has been read (immediately if it already has).
+    '''
+    with _env_lock:
+        if not _env_loaded:
+            _env_hooks.append(hook)
+            return
+    hook()
+
+
+# Sessions, clients and resources are cached per (profile, region, service, config) so
+# credential resolution, endpoint/model loading and the HTTP connection pool are paid once.
+# Clients are thread-safe and shared process-wide; resources are not, so each thread gets its own.
+_BOTO_CONFIG_DEFAULTS = {
+    'max_pool_connections': 50,
+    'tcp_keepalive': True,
+    'retry_mode': 'adaptive',
+    'max_attempts': 10,
+}
+
+_registry_lock = threading.RLock()
+_registry_generation = 0
+_sessions = {}
+_clients = {}
+_thread_resources = threading.local()
+_client_hooks = []
+
+
+def _get_boto_config_options(**overrides):
+    _load_env()
+    options = dict(_BOTO_CONFIG_DEFAULTS)
+    options['max_pool_connections'] = int(os.getenv('boto_max_pool_connections', options['max_pool_connections']))
+    options['retry_mode'] = os.getenv('boto_retry_mode', options['retry_mode'])
+    options.update((k, v) for k, v in overrides.items() if v is not None)
+    unknown = set(options) - set(_BOTO_CONFIG_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown boto config option(s): {sorted(unknown)}')
+    return tuple(sorted(options.items()))
+
+
+def _make_boto_config(config_key):
+    from botocore.config import Config
+    options = dict(config_key)
+    return Config(
+        max_pool_connections=options['max_pool_connections'],
+        tcp_keepalive=options['tcp_keepalive'],
+        retries={'mode': options['retry_mode'], 'max_attempts': options['max_attempts']},
+    )
+
+
+def _get_boto_session(profile_name=None, region_name=None):
+    _load_env()
     profile_name = profile_name or os.getenv('AWS_PROFILE') or 'default'
-    return boto3.session.Session(profile_name=profile_name)
+    key = (profile_name, region_name)
+    with _registry_lock:
+        session = _sessions.get(key)
+        if session is None:
+            import boto3
+            session = _sessions[key] = boto3.session.Session(profile_name=profile_name, region_name=region_name)
+        return session
 
 
-def _get_boto_resource(resource, profile_name=None):
-    return _get_boto_session(profile_name).resource(resource)
+def _get_boto_resource(resource, profile_name=None, region_name=None, **config):
+    profile_name = profile_name or os.getenv('AWS_PROFILE') or 'default'
+    key = (profile_name, region_name, resource, _get_boto_config_options(**config))
+    cache = getattr(_thread_resources, 'cache', None)
+    if cache is None or _thread_resources.generation != _registry_generation:
+        if cache:
+            _close_resources(cache)
+        cache = _thread_resources.cache = {}
+        _thread_resources.generation = _registry_generation
+    if key not in cache:
+        session = _get_boto_session(profile_name, region_name)
+        with _registry_lock:  # boto3 sessions are not safe to build clients/resources on concurrently
+            cache[key] = session.resource(resource, config=_make_boto_config(key[3]))
+            _instrument_client(cache[key].meta.client)
+    return cache[key]
     # return boto3.resource(resource)  # use profile of 'AWS_PROFILE' env or 'default'
 
 
-def _get_boto_client(resource, profile_name=None):
-    return _get_boto_session(profile_name).client(resource)
+def _close_resources(cache):
+    # The evicted resources' clients hold connection pools of their own.
+    for resource in cache.values():
+        resource.meta.client.close()
+
+
+def _get_boto_client(resource, profile_name=None, region_name=None, **config):
+    profile_name = profile_name or os.getenv('AWS_PROFILE') or 'default'
+    key = (profile_name, region_name, resource, _get_boto_config_options(**config))
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = _get_boto_session(profile_name, region_name)
+            client = _clients[key] = _instrument_client(session.client(resource, config=_make_boto_config(key[3])))
+        return client
     # return boto3.client(resource)  # use profile of 'AWS_PROFILE' env or 'default'
 
 
+def _get_boto_resource_client(resource, profile_name=None, region_name=None, **config):
+    '''
+    Process-wide client of a resource: thread-safe and shared like _get_boto_client, but with the
+    resource layer's conversion of plain values (e.g. Decimal, Key conditions). For worker threads,
+    which would otherwise each build a resource and connection pool of their own.
+    '''
+    profile_name = profile_name or os.getenv('AWS_PROFILE') or 'default'
+    key = (profile_name, region_name, resource, _get_boto_config_options(**config), 'resource')
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = _get_boto_session(profile_name, region_name)
+            client = _clients[key] = _instrument_client(
+                session.resource(resource, config=_make_boto_config(key[3])).meta.client)
+        return client
+
+
+def close_boto_registry(resource=None, profile_name=None):
+    '''
+    Close and evict cached clients (optionally only for one service and/or profile).
+    Per-thread resources are closed and dropped the next time their thread asks for one, and the
+    calling thread's right away.
+    '''
+    global _registry_generation
+    with _registry_lock:
+        keys = [k for k in _clients
+                if (resource is None or k[2] == resource) and (profile_name is None or k[0] == profile_name)]
+        for key in keys:
+            _clients.pop(key).close()
+        if resource is None and profile_name is None:
+            _sessions.clear()
+        _registry_generation += 1
+    cache = getattr(_thread_resources, 'cache', None)
+    if cache:
+        _close_resources(cache)
+        _thread_resources.cache = None
+    return len(keys)
+
+
+def register_client_hook(hook):
+    '''
+    Call hook(client) on every client created from now on and on the cached ones, e.g. to
+    register botocore event handlers. Per-thread resources are rebuilt on their next use.
+    '''
+    global _registry_generation
+    with _registry_lock:
+        if hook in _client_hooks:
+            return
+        _client_hooks.append(hook)
+        for client in _clients.values():
+            hook(client)
+        _registry_generation += 1
+
+
+# Instrumentation: every client (including the ones behind resources) gets these botocore event
+# handlers when it is created. They return immediately while instrumentation is disabled.
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_THROTTLE_CODES = {
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+    'Throttling', 'TooManyRequestsException',
+}
+_CAPACITY_FIELDS = ('CapacityUnits', 'ReadCapacityUnits', 'WriteCapacityUnits')
+
+_metrics = None
+
+
+class ClientMetrics:
+    def __init__(self, return_consumed_capacity='INDEXES'):
+        self.return_consumed_capacity = return_consumed_capacity
+        self._lock = threading.Lock()
+        self.operations = {}
+        self.capacity = {}
+
+    def _operation(self, service, operation):
+        key = (service, operation)
+        stats = self.operations.get(key)
+        if stats is None:
+            stats = self.operations[key] = {
+                'calls': 0, 'errors': 0, 'attempts': 0, 'retries': 0, 'throttles': 0,
+                'request_bytes': 0, 'response_bytes': 0, 'latency_sum': 0.0,
+                'latency_buckets': [0] * (len(_LATENCY_BUCKETS) + 1),
+            }
+        return stats
+
+    def record_call(self, service, operation, latency, retries, error):
+        bucket = next((i for i, le in enumerate(_LATENCY_BUCKETS) if latency <= le), len(_LATENCY_BUCKETS))
+        with self._lock:
+            stats = self._operation(service, operation)
+            stats['calls'] += 1
+            stats['errors'] += bool(error)
+            stats['retries'] += retries
+            stats['latency_sum'] += latency
+            stats['latency_buckets'][bucket] += 1
+
+    def record_attempt(self, service, operation, request_bytes=0, response_bytes=0, throttled=False):
+        with self._lock:
+            stats = self._operation(service, operation)
+            stats['attempts'] += 1
+            stats['throttles'] += throttled
+            stats['request_bytes'] += request_bytes
+            stats['response_bytes'] += response_bytes
+
+    def _add_capacity(self, table_name, index_name, units):
+        key = (table_name, index_name)
+        totals = self.capacity.setdefault(key, dict.fromkeys(_CAPACITY_FIELDS, 0.0))
+        for field in _CAPACITY_FIELDS:
+            totals[field] += units.get(field) or 0.0
+
+    def record_capacity(self, consumed):
+        with self._lock:
+            for entry in consumed if isinstance(consumed, list) else [consumed]:
+                table_name = entry.get('TableName')
+                self._add_capacity(table_name, None, entry)
+                for index_type in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+                    for index_name, units in (entry.get(index_type) or {}).items():
+                        self._add_capacity(table_name, index_name, units)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'operations': [
+                    dict(stats, service=service, operation=operation,
+                         latency_buckets=dict(zip([str(le) for le in _LATENCY_BUCKETS] + ['+Inf'],
+                                                  stats['latency_buckets'])))
+                    for (service, operation), stats in sorted(self.operations.items())
+                ],
+                'consumed_capacity': [
+                    dict(units, table=table_name, index=index_name)
+                    for (table_name, index_name), units in sorted(self.capacity.items(), key=str)
+                ],
+            }
+
+    def to_json(self, indent=2):
+        import json
+        return json.dumps(self.as_dict(), indent=indent)
+
+    def to_prometheus(self, prefix='aws_client'):
+        lines = []
+        data = self.as_dict()
+        counters = ('calls', 'errors', 'attempts', 'retries', 'throttles', 'request_bytes', 'response_bytes')
+        for name in counters:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for stats in data['operations']:
+                lines.append(f'{prefix}_{name}_total{{service="{stats["service"]}",operation="{stats["operation"]}"}} {stats[name]}')
+        lines.append(f'# TYPE {prefix}_request_duration_seconds histogram')
+        for stats in data['operations']:
+            labels = f'service="{stats["service"]}",operation="{stats["operation"]}"'
+            cumulative = 0
+            for le, count in stats['latency_buckets'].items():
+                cumulative += count
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {stats["latency_sum"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {stats["calls"]}')
+        for field in _CAPACITY_FIELDS:
+            metric = f'{prefix}_consumed_{field[:-len("CapacityUnits")].lower() or "total"}_capacity_units_total'
+            lines.append(f'# TYPE {metric} counter')
+            for units in data['consumed_capacity']:
+                lines.append(f'{metric}{{table="{units["table"]}",index="{units["index"] or ""}"}} {units[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _on_provide_client_params(params, model, context, **kwargs):
+    metrics = _metrics
+    if metrics is None:
+        return
+    context['metrics_started_at'] = time.perf_counter()
+    if metrics.return_consumed_capacity and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', metrics.return_consumed_capacity)
+
+
+def _on_response_received(context, response_dict=None, parsed_response=None, exception=None, **kwargs):
+    metrics = _metrics
+    if metrics is None or 'metrics_started_at' not in context:
+        return
+    error_code = ((parsed_response or {}).get('Error') or {}).get('Code')
+    metrics.record_attempt(
+        context['metrics_service'], context['metrics_operation'],
+        request_bytes=context.pop('metrics_request_bytes', 0),
+        response_bytes=len((response_dict or {}).get('body') or b''),
+        throttled=error_code in _THROTTLE_CODES,
+    )
+
+
+def _on_before_send(request, **kwargs):
+    context = request.context
+    if _metrics is None or 'metrics_started_at' not in context:
+        return
+    body = request.body
+    context['metrics_request_bytes'] = len(body) if isinstance(body, (bytes, bytearray, str)) else 0
+
+
+def _on_before_call(model, context, **kwargs):
+    if _metrics is not None and 'metrics_started_at' in context:
+        context['metrics_service'] = model.service_model.service_id.hyphenize()
+        context['metrics_operation'] = model.name
+
+
+def _on_after_call(http_response, parsed, model, context, **kwargs):
+    metrics = _metrics
+    started_at = context.get('metrics_started_at')
+    if metrics is None or started_at is None:
+        return
+    metrics.record_call(
+        model.service_model.service_id.hyphenize(), model.name,
+        latency=time.perf_counter() - started_at,
+        retries=(parsed.get('ResponseMetadata') or {}).get('RetryAttempts', 0),
+        error=http_response.status_code >= 300,
+    )
+    if parsed.get('ConsumedCapacity'):
+        metrics.record_capacity(parsed['ConsumedCapacity'])
+
+
+def _instrument_client(client):
+    events = client.meta.events
+    events.register('provide-client-params', _on_provide_client_params)
+    events.register('before-call', _on_before_call)
+    events.register('before-send', _on_before_send)
+    events.register('response-received', _on_response_received)
+    events.register('after-call', _on_after_call)
+    for hook in _client_hooks:
+        hook(client)
+    return client
+
+
+def enable_instrumentation(return_consumed_capacity='INDEXES'):
+    '''
+    Start recording latency, retries, throttles, bytes and consumed capacity of every boto3
+    client call. `return_consumed_capacity` ('INDEXES', 'TOTAL' or None) is added to DynamoDB
+    requests that do not ask for it themselves.
+    '''
+    global _metrics
+    _metrics = ClientMetrics(return_consumed_capacity)
+    return _metrics
+
+
+def disable_instrumentation():
+    global _metrics
+    _metrics = None
+
+
+def get_metrics():
+    return _metrics
+
+
+def _dump_metrics(path):
+    if _metrics is None:
+        return
+    text = _metrics.to_prometheus() if path.endswith('.prom') else _metrics.to_json()
+    if path == '-':
+        print(text)
+        return
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _enable_instrumentation_from_env():
+    # e.g. boto_metrics=metrics.json (or metrics.prom, or - for stdout) dumps the metrics at exit.
+    path = os.getenv('boto_metrics')
+    if path:
+        import atexit
+        enable_instrumentation()
+        atexit.register(_dump_metrics, path)
+
+
 def _change_profile_of_default_session(profile_name):
+    import boto3
     boto3.setup_default_session(profile_name=profile_name)
 
 
 def _get_aws_account_id():
+    _load_env()
     return os.getenv('aws_account_id', 'stanley')
 
 
 def _get_default_region():
+    _load_env()
     return os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
 
 
 def _get_aws_doc_lang():
+    _load_env()
     return os.getenv('aws_doc_lang', 'zh_tw')
 
 
 def _get_awsscripts_dir():
+    _load_env()
     return os.getenv('awsscripts_dir', f'{os.path.expanduser("~")}/awsscripts')
 
 
+@functools.lru_cache(maxsize=None)
 def _is_ec2_instance():
     import requests
     from requests.exceptions import ConnectTimeout
@@ -52,6 +434,46 @@ def _is_ec2_instance():
 
 
 def open_ref_url():
+    _load_env()
     for url in os.environ['ref_url'].split(';'):
         os.system(f"open {url}")
 
+
+def _parse_cli_value(value):
+    import ast
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def _is_cli_value(arg):
+    return not arg.startswith('-') or arg[1:2].isdigit() or (arg.startswith('--') and '=' in arg)
+
+
+def _fast_fire(namespace, argv=None):
+    '''
+    Dispatch `command [value ...] [--name=value ...]` to the function `command` of `namespace`
+    directly; anything else (help, bare flags, chained commands) goes to fire.Fire(namespace).
+    This skips importing fire for plain invocations from cron and shell pipelines.
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = namespace.get(argv[0]) if argv else None
+    if not (isinstance(command, types.FunctionType) and command.__module__ == namespace.get('__name__')
+            and all(_is_cli_value(arg) for arg in argv[1:])):
+        import fire
+        return fire.Fire(namespace, command=argv)
+    args, kwargs = [], {}
+    for arg in argv[1:]:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            kwargs[name.replace('-', '_')] = _parse_cli_value(value)
+        else:
+            args.append(_parse_cli_value(arg))
+    result = command(*args, **kwargs)
+    if result is not None:
+        print(result)
+    return result
+
+
+on_env_loaded(_enable_instrumentation_from_env)
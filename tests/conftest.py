@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dynamodb_bench  # noqa: E402
+
+
+@pytest.fixture
+def memory_backend():
+    with dynamodb_bench._memory_backend():
+        yield
+
+
+@pytest.fixture
+def moto_backend():
+    pytest.importorskip('moto')
+    with dynamodb_bench._moto_backend():
+        yield
+
+
+@pytest.fixture(params=['memory', 'moto'])
+def backend(request):
+    '''
+    Runs a test once on the in-memory engine and once on moto.
+    '''
+    if request.param == 'moto':
+        pytest.importorskip('moto')
+    with dynamodb_bench._BACKENDS[request.param]():
+        yield request.param
+
+
+@pytest.fixture
+def music_table(memory_backend):
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        dynamodb_bench._create_fixture_tables()
+    return dynamodb_bench.dynamodb.get_table_name()
@@ -0,0 +1,49 @@
+import boto3
+
+import dynamodb
+
+from dynamodb_bulk import bulk_delete, bulk_get, bulk_write
+from dynamodb_scan import parallel_scan
+from dynamodb_topn import top_n
+
+
+def _songs(count):
+    return [{'Artist': f'Artist-{i % 7}', 'SongTitle': f'Song-{i}', 'AlbumTitle': f'Album-{i % 3}', 'Length': i}
+            for i in range(count)]
+
+
+def test_bulk_write_get_delete_round_trip(music_table):
+    stats = bulk_write(music_table, _songs(260), concurrency=4)
+    assert stats.items == 260
+    keys = [{'Artist': f'Artist-{i % 7}', 'SongTitle': f'Song-{i}'} for i in range(0, 260, 10)]
+    found = list(bulk_get(music_table, keys, concurrency=4))
+    assert [key for key, _ in found] == keys
+    assert all(item['Length'] == int(key['SongTitle'][5:]) for key, item in found)
+    bulk_delete(music_table, keys)
+    assert all(item is None for _, item in bulk_get(music_table, keys))
+
+
+def test_bulk_get_answers_repeated_keys(music_table):
+    bulk_write(music_table, _songs(4))
+    keys = [{'Artist': f'Artist-{i}', 'SongTitle': f'Song-{i}'} for i in (0, 1, 2, 0)]
+    keys.append({'Artist': 'nobody', 'SongTitle': 'none'})
+    found = [item and item['SongTitle'] for _, item in bulk_get(music_table, keys)]
+    assert found == ['Song-0', 'Song-1', 'Song-2', 'Song-0', None]
+
+
+def test_worker_threads_share_one_resource_client(music_table, monkeypatch):
+    # The default table has the AlbumTitle-Length-index top_n reads.
+    indexed_table = dynamodb.get_default_table_name()
+    bulk_write(indexed_table, _songs(30))
+    created = []
+    original = boto3.session.Session.resource
+    monkeypatch.setattr(boto3.session.Session, 'resource',
+                        lambda self, *args, **kwargs: created.append(args) or original(self, *args, **kwargs))
+    for _ in range(3):
+        bulk_write(music_table, _songs(300), concurrency=8)
+        list(bulk_get(music_table, [{'Artist': 'Artist-0', 'SongTitle': f'Song-{i}'} for i in range(300)],
+                      concurrency=8))
+        list(parallel_scan(music_table, total_segments=4))
+        assert len(top_n(indexed_table, 'Album-0,Album-1,Album-2', n=5)) == 5
+    # Built once for the whole process, not once per worker thread and call.
+    assert len(created) <= 1
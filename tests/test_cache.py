@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import dynamodb_cache
+from dynamodb_cache import ReadThroughCache, cached_get_item, enable_cache, invalidate_item
+from my_aws_py_base import _get_boto_resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cache():
+    try:
+        yield enable_cache(max_size=2, ttl=60.0)
+    finally:
+        dynamodb_cache.disable_cache()
+
+
+def test_read_through_hits_and_invalidation(music_table, cache):
+    table = _get_boto_resource('dynamodb').Table(music_table)
+    key = {'Artist': 'a', 'SongTitle': 's'}
+    table.put_item(Item=dict(key, Length=1))
+    assert cached_get_item(table, key)['Length'] == 1
+    table.put_item(Item=dict(key, Length=2))
+    assert cached_get_item(table, key)['Length'] == 1
+    invalidate_item(music_table, key)
+    assert cached_get_item(table, key)['Length'] == 2
+    assert cache.stats()['hits'] == 1 and cache.stats()['invalidations'] == 1
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = ReadThroughCache(max_size=2, ttl=10.0)
+    now = [100.0]
+    monkeypatch.setattr(dynamodb_cache.time, 'monotonic', lambda: now[0])
+    for name in 'abc':
+        cache.get_or_load(cache.item_key('t', {'k': name}), lambda name=name: name.upper())
+    assert cache.stats()['evictions'] == 1
+    now[0] += 11
+    assert cache.get_or_load(cache.item_key('t', {'k': 'c'}), lambda: 'fresh') == 'fresh'
+    assert cache.stats()['expirations'] == 1
+
+
+def test_env_enables_cache(monkeypatch):
+    monkeypatch.setenv('ddb_cache', '500:5')
+    try:
+        dynamodb_cache._enable_cache_from_env()
+        assert (dynamodb_cache.get_cache().max_size, dynamodb_cache.get_cache().ttl) == (500, 5.0)
+    finally:
+        dynamodb_cache.disable_cache()
+
+
+def test_cli_reads_go_through_the_env_cache(tmp_path):
+    config = tmp_path / 'config'
+    config.write_text('[default]\nregion = us-east-1\naws_access_key_id = t\naws_secret_access_key = t\n')
+    env = dict(os.environ, AWS_CONFIG_FILE=str(config), AWS_SHARED_CREDENTIALS_FILE=str(config), AWS_PROFILE='default',
+               ddb_backend='memory', ddb_cache='100')
+    script = ('import contextlib, io, dynamodb, dynamodb_cache\n'
+              'with contextlib.redirect_stdout(io.StringIO()):\n'
+              '    dynamodb.create_table(); dynamodb.put_item(); dynamodb.get_item(None); dynamodb.get_item(None)\n'
+              'print(dynamodb_cache.get_cache().stats()["hits"])\n')
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '1'
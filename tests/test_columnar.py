@@ -0,0 +1,55 @@
+import contextlib
+import io
+
+import pytest
+
+import dynamodb
+from dynamodb_columnar import ColumnBuilder, column_stats, from_typed, scan_columns
+from my_aws_py_base import _get_boto_resource
+
+np = pytest.importorskip('numpy')
+
+BIG = 10 ** 37 + 1
+
+
+def test_from_typed():
+    assert from_typed({'N': '12'}) == 12 and from_typed({'N': '1.5'}) == 1.5
+    assert from_typed({'M': {'a': {'L': [{'S': 'x'}, {'NULL': True}]}}}) == {'a': ['x', None]}
+    assert from_typed({'SS': ['b', 'a']}) == {'a', 'b'}
+
+
+def test_column_kinds():
+    builder = ColumnBuilder(['i', 'f', 'missing', 'big', 's'])
+    builder.add_page([{'i': {'N': '1'}, 'f': {'N': '1.5'}, 'missing': {'N': '2'}, 'big': {'N': str(BIG)}, 's': {'S': 'a'}},
+                      {'i': {'N': '3'}, 'f': {'N': '2'}, 'big': {'N': '5'}, 's': {'S': 'b'}}])
+    columns = builder.build()
+    assert columns['i'].dtype == np.int64 and columns['f'].dtype == np.float64
+    assert np.isnan(columns['missing'][1])
+    assert columns['big'].dtype == object and columns['big'][0] == BIG
+    assert list(columns['s']) == ['a', 'b']
+
+
+def test_column_stats_skip_missing_values():
+    assert column_stats(np.array([1.0, np.nan, 3.0])) == {'count': 2, 'min': 1.0, 'max': 3.0, 'mean': 2.0}
+    assert column_stats(np.array([np.nan])) == {'count': 0}
+    column = np.empty(3, dtype=object)
+    column[:] = [BIG, None, 1]
+    assert column_stats(column) == {'count': 2, 'min': 1, 'max': BIG, 'mean': (BIG + 1) / 2}
+    assert column_stats(np.array(['a', None], dtype=object)) == {'count': 1}
+
+
+def test_scan_column_stats_with_missing_and_huge_numbers(music_table):
+    table = _get_boto_resource('dynamodb').Table(music_table)
+    for i in range(10):
+        item = {'Artist': f'a{i}', 'SongTitle': 's', 'AlbumTitle': f'album{i % 2}', 'Awards': BIG if i == 0 else i}
+        if i % 3:
+            item['Length'] = i
+        table.put_item(Item=item)
+    columns = scan_columns(music_table, ['Length', 'Awards'], total_segments=2)
+    assert column_stats(columns['Length'])['count'] == 6
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        dynamodb.scan_column_stats(music_table)
+    assert 'Length: count=6 min=1.0 max=8.0 mean=4.500' in out.getvalue()
+    assert f'Awards: count=10 min=1 max={BIG}' in out.getvalue()
+    assert 'AlbumTitle: 2 distinct value(s)' in out.getvalue()
@@ -0,0 +1,56 @@
+import base64
+import bz2
+import csv
+import glob
+import gzip
+import io
+import json
+import os
+
+from dynamodb_export import export_table
+from my_aws_py_base import _get_boto_resource
+
+
+def _fill(table_name, count=30):
+    table = _get_boto_resource('dynamodb').Table(table_name)
+    for i in range(count):
+        table.put_item(Item={'Artist': f'a{i}', 'SongTitle': 's', 'Length': i, 'Tags': {'rock', f't{i % 3}'},
+                             'Scores': {1, 2, i + 3}, 'Blobs': {b'\x00', b'\xff'}})
+
+
+def _lines(output_dir, pattern, opener=gzip.open):
+    return [line for path in sorted(glob.glob(os.path.join(output_dir, pattern)))
+            for line in opener(path, 'rt')]
+
+
+def test_jsonl_export_is_lossless(music_table, tmp_path):
+    _fill(music_table)
+    manifest = export_table(music_table, str(tmp_path), total_segments=3)
+    assert manifest['items'] == 30
+    items = [json.loads(line)['Item'] for line in _lines(tmp_path, '*.jsonl.gz')]
+    assert sorted(int(item['Length']['N']) for item in items) == list(range(30))
+
+
+def test_plain_and_csv_exports_write_sets(music_table, tmp_path):
+    _fill(music_table)
+    export_table(music_table, str(tmp_path / 'plain'), total_segments=2, plain=True)
+    items = {item['Artist']: item for item in map(json.loads, _lines(tmp_path / 'plain', '*.jsonl.gz'))}
+    assert len(items) == 30
+    assert items['a4']['Tags'] == ['rock', 't1'] and items['a4']['Scores'] == [1, 2, 7]
+    assert items['a4']['Blobs'] == [{'__b64__': base64.b64encode(b).decode()} for b in (b'\x00', b'\xff')]
+
+    export_table(music_table, str(tmp_path / 'csv'), fmt='csv', total_segments=2, attributes='Artist,Tags',
+                 compression='bz2')
+    rows = [row for line in _lines(tmp_path / 'csv', '*.csv.bz2', bz2.open) for row in csv.reader(io.StringIO(line))]
+    rows = [row for row in rows if row != ['Artist', 'Tags']]
+    assert len(rows) == 30 and ['a5', '["rock", "t2"]'] in rows
+
+
+def test_resume_restarts_segments_whose_shard_is_gone(music_table, tmp_path):
+    _fill(music_table)
+    export_table(music_table, str(tmp_path), total_segments=2)
+    for path in glob.glob(os.path.join(tmp_path, '*.jsonl.gz')):
+        os.remove(path)
+    manifest = export_table(music_table, str(tmp_path), total_segments=2)
+    assert manifest['items'] == 30
+    assert len(_lines(tmp_path, '*.jsonl.gz')) == 30
@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_budget():
+    # A fresh interpreter per run: the modules this test process imported must not count.
+    result = subprocess.run([sys.executable, 'dynamodb_bench.py', 'import_budget'], cwd=ROOT,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'heavy modules loaded: none' in result.stdout
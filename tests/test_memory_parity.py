@@ -0,0 +1,159 @@
+import decimal
+import json
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+
+import dynamodb_bench
+from my_aws_py_base import _get_boto_client, _get_boto_resource
+
+pytest.importorskip('moto')
+
+
+def _normalize(value):
+    # Request ids and headers differ between backends; everything else must match.
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k != 'ResponseMetadata'}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return json.loads(json.dumps(value, default=str))
+
+
+def _create(client):
+    client.create_table(
+        TableName='tbl',
+        KeySchema=[{'AttributeName': 'h', 'KeyType': 'HASH'}, {'AttributeName': 'r', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'h', 'AttributeType': 'S'}, {'AttributeName': 'r', 'AttributeType': 'N'},
+                              {'AttributeName': 'g', 'AttributeType': 'S'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'gix',
+            'KeySchema': [{'AttributeName': 'g', 'KeyType': 'HASH'}, {'AttributeName': 'r', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'},
+            'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1},
+        }],
+        ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+    table = _get_boto_resource('dynamodb').Table('tbl')
+    with table.batch_writer() as batch:
+        for h in range(5):
+            for i in range(20):
+                item = {'h': f'h{h}', 'r': i - 5, 'v': f'val{i}', 'n': decimal.Decimal(i) / 4, 'l': [1, 'a'],
+                        'm': {'x': {'y': i}}}
+                if i % 3:
+                    item['g'] = f'g{i % 2}'
+                batch.put_item(Item=item)
+    return table
+
+
+def _on_both(scenario):
+    '''
+    {backend: normalized result} of running scenario(client, table) on a fresh table per backend.
+    '''
+    results = {}
+    for backend in ('memory', 'moto'):
+        with dynamodb_bench._BACKENDS[backend]():
+            client = _get_boto_client('dynamodb')
+            results[backend] = _normalize(scenario(client, _create(client)))
+    return results
+
+
+def _assert_parity(scenario):
+    results = _on_both(scenario)
+    assert results['memory'] == results['moto']
+    return results['memory']
+
+
+def test_query_key_conditions():
+    _assert_parity(lambda client, table: [
+        table.query(KeyConditionExpression=Key('h').eq('h1') & Key('r').between(-2, 4))['Items'],
+        table.query(KeyConditionExpression=Key('h').eq('h1') & Key('r').gt(3), ScanIndexForward=False, Limit=4),
+        table.query(KeyConditionExpression=Key('h').eq('h1') & Key('r').lte(-3)),
+    ])
+
+
+def test_query_filter_projection_and_count():
+    _assert_parity(lambda client, table: [
+        table.query(KeyConditionExpression=Key('h').eq('h2'),
+                    FilterExpression=Attr('n').gte(2) & ~Attr('v').begins_with('val1'),
+                    ProjectionExpression='r, m.x.y, l[1]'),
+        table.query(KeyConditionExpression=Key('h').eq('h2'), Select='COUNT', FilterExpression=Attr('g').exists()),
+    ])
+
+
+def test_query_global_secondary_index():
+    result = _assert_parity(lambda client, table: sorted(
+        map(str, table.query(IndexName='gix', KeyConditionExpression=Key('g').eq('g1') & Key('r').lt(3))['Items'])))
+    assert result
+
+
+def test_segmented_scan_pagination():
+    def scenario(client, table):
+        keys = []
+        for segment in range(3):
+            kwargs = dict(Segment=segment, TotalSegments=3, Limit=7)
+            while True:
+                page = table.scan(**kwargs)
+                keys += [(item['h'], int(item['r'])) for item in page['Items']]
+                if 'LastEvaluatedKey' not in page:
+                    break
+                kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+        return sorted(keys)
+
+    assert len(_assert_parity(scenario)) == 100
+
+
+def test_update_expressions():
+    _assert_parity(lambda client, table: table.update_item(
+        Key={'h': 'h0', 'r': 0},
+        UpdateExpression='SET n = n + :one, z = if_not_exists(z, :z), l = list_append(l, :l) REMOVE v ADD s :s',
+        ExpressionAttributeValues={':one': 1, ':z': 'zz', ':l': [3], ':s': {'p', 'q'}},
+        ReturnValues='ALL_NEW')['Attributes'])
+
+
+def test_conditional_put_and_transaction_cancellation():
+    def scenario(client, table):
+        codes = []
+        try:
+            table.put_item(Item={'h': 'h0', 'r': 0}, ConditionExpression='attribute_not_exists(h)')
+        except client.exceptions.ConditionalCheckFailedException as ex:
+            codes.append(ex.response['Error']['Code'])
+        try:
+            client.transact_write_items(TransactItems=[
+                {'Put': {'TableName': 'tbl', 'Item': {'h': {'S': 'new'}, 'r': {'N': '1'}}}},
+                {'ConditionCheck': {'TableName': 'tbl', 'Key': {'h': {'S': 'h0'}, 'r': {'N': '1'}},
+                                    'ConditionExpression': 'n > :x',
+                                    'ExpressionAttributeValues': {':x': {'N': '100'}}}}])
+        except client.exceptions.TransactionCanceledException as ex:
+            codes.append([reason['Code'] for reason in ex.response['CancellationReasons']])
+        # A cancelled transaction writes nothing.
+        codes.append(client.get_item(TableName='tbl', Key={'h': {'S': 'new'}, 'r': {'N': '1'}}).get('Item'))
+        return codes
+
+    assert _assert_parity(scenario) == ['ConditionalCheckFailedException', ['None', 'ConditionalCheckFailed'], None]
+
+
+def test_delete_batch_get_and_describe():
+    def scenario(client, table):
+        deleted = table.delete_item(Key={'h': 'h0', 'r': 1}, ReturnValues='ALL_OLD')['Attributes']
+        count = table.scan(Select='COUNT')['Count']
+        found = _get_boto_resource('dynamodb').batch_get_item(
+            RequestItems={'tbl': {'Keys': [{'h': 'h3', 'r': 2}, {'h': 'h3', 'r': 100}]}})['Responses']['tbl']
+        description = client.describe_table(TableName='tbl')['Table']
+        return [deleted, count, sorted(map(str, found)),
+                [description['ItemCount'], description['GlobalSecondaryIndexes'][0]['IndexName'],
+                 description['TableStatus']]]
+
+    assert _assert_parity(scenario)[1] == 99
+
+
+def test_errors_on_missing_table_and_bad_key():
+    def scenario(client, table):
+        codes = []
+        for call in (lambda: client.get_item(TableName='missing', Key={'h': {'S': 'x'}}),
+                     lambda: client.get_item(TableName='tbl', Key={'h': {'S': 'x'}})):
+            try:
+                call()
+            except client.exceptions.ClientError as ex:
+                codes.append(ex.response['Error']['Code'])
+        return codes
+
+    assert _assert_parity(scenario) == ['ResourceNotFoundException', 'ValidationException']
@@ -0,0 +1,76 @@
+import pytest
+
+import dynamodb_planner
+from dynamodb_planner import PlanError, access_paths, forget_schema, parse_predicate, plan
+from my_aws_py_base import _get_boto_client, _get_boto_resource
+
+INDEX = 'music-test-Length-global-secondary-index'
+
+
+@pytest.fixture(autouse=True)
+def fresh_schemas():
+    forget_schema()
+    yield
+    forget_schema()
+
+
+@pytest.fixture
+def songs(music_table):
+    table = _get_boto_resource('dynamodb').Table(music_table)
+    for i in range(20):
+        table.put_item(Item={'Artist': f'a{i % 4}', 'SongTitle': f's{i}', 'Length': i % 5})
+    return music_table
+
+
+def _drop_index(table_name, index_name):
+    _get_boto_client('dynamodb').update_table(TableName=table_name,
+                                              GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': index_name}}])
+
+
+def test_parse_predicate():
+    assert parse_predicate({'a': 1, 'b': ['between', 1, 2]}) == [('a', '=', (1,)), ('b', 'between', (1, 2))]
+    with pytest.raises(PlanError):
+        parse_predicate({'b': ['between', 1]})
+
+
+def test_picks_get_query_index_and_scan(songs):
+    assert plan(songs, {'Artist': 'a1', 'SongTitle': 's1'}).operation == 'GetItem'
+    assert plan(songs, {'Artist': 'a1'}).operation == 'Query'
+    by_length = plan(songs, {'Length': 3})
+    assert (by_length.operation, by_length.index_name) == ('Query', INDEX)
+    assert sorted(item['SongTitle'] for item in by_length.execute()) == ['s13', 's18', 's3', 's8']
+    assert plan(songs, {'AlbumTitle': 'x'}).operation == 'Scan'
+
+
+def test_dropped_index_is_forgotten_when_a_plan_fails(songs):
+    stale = plan(songs, {'Length': 3})
+    _drop_index(songs, INDEX)
+    with pytest.raises(Exception):
+        list(stale.execute())
+    replanned = plan(songs, {'Length': 3})
+    assert replanned.operation == 'Scan'
+    assert len(list(replanned.execute())) == 4
+
+
+def test_schema_expires(songs, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dynamodb_planner.time, 'monotonic', lambda: now[0])
+    assert INDEX in {path.index_name for path in access_paths(songs)}
+    _drop_index(songs, INDEX)
+    assert INDEX in {path.index_name for path in access_paths(songs)}
+    now[0] += dynamodb_planner.SCHEMA_TTL + 1
+    assert INDEX not in {path.index_name for path in access_paths(songs)}
+
+
+def test_pending_index_is_described_again_soon(monkeypatch):
+    description = {'KeySchema': [{'AttributeName': 'h', 'KeyType': 'HASH'}], 'ItemCount': 10,
+                   'GlobalSecondaryIndexes': [{'IndexName': 'new', 'IndexStatus': 'CREATING',
+                                               'KeySchema': [{'AttributeName': 'g', 'KeyType': 'HASH'}],
+                                               'Projection': {'ProjectionType': 'ALL'}}]}
+    now = [1000.0]
+    monkeypatch.setattr(dynamodb_planner.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(dynamodb_planner, 'describe_table', lambda table_name: description)
+    assert [path.index_name for path in access_paths('t')] == [None]
+    description['GlobalSecondaryIndexes'][0]['IndexStatus'] = 'ACTIVE'
+    now[0] += dynamodb_planner.SCHEMA_PENDING_TTL + 1
+    assert [path.index_name for path in access_paths('t')] == [None, 'new']
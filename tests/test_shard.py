@@ -0,0 +1,142 @@
+import contextlib
+import io
+import random
+
+import pytest
+from boto3.dynamodb.conditions import Attr
+
+import dynamodb
+import dynamodb_loadgen
+import dynamodb_planner
+import dynamodb_sync
+from dynamodb_aggregate import aggregate
+from dynamodb_bulk import bulk_delete, bulk_get, bulk_write
+from dynamodb_export import export_table
+from dynamodb_scan import parallel_scan
+from dynamodb_shard import SHARD_SEPARATOR, ShardError, configure_sharding, disable_sharding, get_sharding
+from dynamodb_transact import transact_write
+from my_aws_py_base import _get_boto_client, _get_boto_resource
+
+
+@pytest.fixture
+def sharded(music_table):
+    configure_sharding(music_table, shards=4)
+    yield music_table
+    disable_sharding()
+
+
+def _stored_artists(table_name):
+    # What the table really holds, read past the shard map.
+    items = _get_boto_client('dynamodb').scan(TableName=table_name)['Items']
+    return {item['Artist']['S'] for item in items}
+
+
+def _cli(command, *args):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        command(*args)
+    return out.getvalue()
+
+
+def test_batch_write_round_trips_through_item_commands_and_scan(sharded):
+    _cli(dynamodb.batch_write, sharded, 20)
+    assert all(SHARD_SEPARATOR in artist for artist in _stored_artists(sharded))
+    assert "'Artist': 'No One You Know-7'" in _cli(dynamodb.get_item, 7, sharded)
+    _cli(dynamodb.update_item, 7, 42, sharded)
+    item = _get_boto_resource('dynamodb').Table(sharded).get_item(Key={'Artist': 'No One You Know-7',
+                                                                       'SongTitle': 'Call Me Today-7'})
+    assert 'Item' not in item
+    assert "'Length': Decimal('42')" in _cli(dynamodb.get_item, 7, sharded)
+    items = list(parallel_scan(sharded))
+    assert sorted(item['Artist'] for item in items) == sorted(f'No One You Know-{i}' for i in range(1, 21))
+    assert len(_stored_artists(sharded)) == 20
+
+
+def test_bulk_get_and_delete_use_the_shards(sharded):
+    bulk_write(sharded, [{'Artist': f'a{i}', 'SongTitle': 's', 'Length': i} for i in range(30)])
+    found = dict((key['Artist'], item) for key, item in bulk_get(sharded, [{'Artist': f'a{i}', 'SongTitle': 's'}
+                                                                            for i in range(31)]))
+    assert found['a3'] == {'Artist': 'a3', 'SongTitle': 's', 'Length': 3} and found['a30'] is None
+    bulk_delete(sharded, [{'Artist': f'a{i}', 'SongTitle': 's'} for i in range(10)])
+    assert len(list(parallel_scan(sharded))) == 20
+
+
+def test_transact_write_uses_the_shards(sharded):
+    stats = transact_write([[{'Put': {'TableName': sharded, 'Item': {'Artist': {'S': 'x'}, 'SongTitle': {'S': 'y'}},
+                                      'ConditionExpression': 'attribute_not_exists(Artist)'}}]])
+    assert stats.failed == {}
+    assert _stored_artists(sharded) == {get_sharding(sharded).write_key({'Artist': 'x', 'SongTitle': 'y'})}
+    stats = transact_write([[{'Update': {'TableName': sharded, 'Key': {'Artist': {'S': 'x'}, 'SongTitle': {'S': 'y'}},
+                                         'UpdateExpression': 'SET Length = :l',
+                                         'ConditionExpression': 'attribute_exists(Artist)',
+                                         'ExpressionAttributeValues': {':l': {'N': '5'}}}}]])
+    assert stats.failed == {} and [item['Length'] for item in parallel_scan(sharded)] == [5]
+
+
+def test_export_and_aggregate_see_logical_keys(sharded, tmp_path):
+    bulk_write(sharded, [{'Artist': f'a{i % 3}', 'SongTitle': f's{i}', 'Length': i} for i in range(12)])
+    manifest = export_table(sharded, str(tmp_path), total_segments=2, compression=None, plain=True)
+    assert manifest['items'] == 12
+    exported = ''.join(open(tmp_path / shard['path']).read() for shard in manifest['shards'])
+    assert SHARD_SEPARATOR not in exported and '"Artist": "a1"' in exported
+    result = aggregate(sharded, 'count,sum:Length', group_by='Artist')
+    assert result.results() == {('a0',): {'count': 4, 'sum:Length': 18}, ('a1',): {'count': 4, 'sum:Length': 22},
+                                ('a2',): {'count': 4, 'sum:Length': 26}}
+
+
+def test_filters_on_the_sharded_key_are_refused(sharded):
+    with pytest.raises(ShardError):
+        list(parallel_scan(sharded, FilterExpression=Attr('Artist').eq('a1')))
+    with pytest.raises(ShardError):
+        list(parallel_scan(sharded, FilterExpression='#a = :a', ExpressionAttributeNames={'#a': 'Artist'},
+                           ExpressionAttributeValues={':a': 'a1'}))
+    assert list(parallel_scan(sharded, FilterExpression=Attr('Length').eq(1))) == []
+
+
+def test_random_mode_refuses_key_only_paths(music_table):
+    configure_sharding(music_table, shards=4, mode='random')
+    try:
+        with pytest.raises(ShardError):
+            bulk_write(music_table, [{'Artist': 'a', 'SongTitle': 's'}])
+        with pytest.raises(ShardError):
+            list(bulk_get(music_table, [{'Artist': 'a', 'SongTitle': 's'}]))
+        with pytest.raises(ShardError):
+            transact_write([[{'Put': {'TableName': music_table,
+                                      'Item': {'Artist': {'S': 'a'}, 'SongTitle': {'S': 's'}}}}]])
+        with pytest.raises(ShardError):
+            dynamodb_loadgen.run_load(music_table, duration=0.1, processes=1, concurrency=1)
+    finally:
+        disable_sharding()
+
+
+def test_planner_reads_logical_keys(sharded):
+    bulk_write(sharded, [{'Artist': f'a{i % 2}', 'SongTitle': f's{i:02d}', 'Length': i} for i in range(20)])
+    get = dynamodb_planner.plan(sharded, {'Artist': 'a1', 'SongTitle': 's03'})
+    assert get.operation == 'GetItem' and list(get.execute()) == [{'Artist': 'a1', 'SongTitle': 's03', 'Length': 3}]
+    query = dynamodb_planner.plan(sharded, {'Artist': 'a0', 'SongTitle': ['>', 's10']}, attributes='Length')
+    assert query.operation == 'Query'
+    assert [item['Length'] for item in query.execute()] == [12, 14, 16, 18]
+    assert [item['Length'] for item in query.execute(limit=2)] == [12, 14]
+
+
+def test_sync_between_sharded_and_plain_tables(sharded):
+    items = [{'Artist': f'a{i % 5}', 'SongTitle': f's{i}', 'Length': i} for i in range(40)]
+    bulk_write(dynamodb.get_default_table_name(), items)
+    bulk_write(sharded, items[:35] + [{'Artist': 'a9', 'SongTitle': 'extra'}])
+    diff = dynamodb_sync.diff_tables(dynamodb.get_default_table_name(), sharded)
+    assert (len(diff.puts), len(diff.deletes), diff.differing_partitions) == (5, 1, 6)
+    dynamodb_sync.apply_diff(diff)
+    assert not dynamodb_sync.diff_tables(dynamodb.get_default_table_name(), sharded)
+    assert all(SHARD_SEPARATOR in artist for artist in _stored_artists(sharded))
+
+
+def test_loadgen_operations_use_the_shards(sharded):
+    shard_map = get_sharding(sharded)
+    client = _get_boto_client('dynamodb')
+    keys, rng = dynamodb_loadgen.ZipfKeys(5, seed=1), random.Random(1)
+    for operation in ('put', 'update', 'transact', 'get', 'query'):
+        dynamodb_loadgen._run_operation(client, sharded, operation, keys, rng, 10, shard_map)
+    assert all(SHARD_SEPARATOR in artist for artist in _stored_artists(sharded))
+    keys = dynamodb_loadgen.ZipfKeys(1)
+    dynamodb_loadgen._run_operation(client, sharded, 'put', keys, rng, 10, shard_map)
+    assert dynamodb_loadgen._run_operation(client, sharded, 'get', keys, rng, 10, shard_map)['Item']
+    assert dynamodb_loadgen._run_operation(client, sharded, 'query', keys, rng, 10, shard_map)['Count'] == 1
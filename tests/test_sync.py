@@ -0,0 +1,98 @@
+import collections
+import decimal
+
+import pytest
+
+import dynamodb_memory
+import dynamodb_sync
+from dynamodb_bulk import bulk_write
+from my_aws_py_base import _get_boto_client, _get_boto_resource
+
+SOURCE = 'music-default'
+
+
+@pytest.fixture
+def tables(music_table):
+    items = [{'Artist': f'band{i % 40}', 'SongTitle': f'song{i}', 'Length': i, 'Tags': {'a', f't{i % 3}'}}
+             for i in range(400)]
+    bulk_write(SOURCE, items)
+    bulk_write(music_table, items)
+    yield SOURCE, music_table
+    dynamodb_sync.stop_tracking_changes()
+
+
+@pytest.fixture
+def operations(monkeypatch):
+    # Operation counts of the in-memory engine since the last clear().
+    counts = collections.Counter()
+    engine = dynamodb_memory.get_engine()
+    handle = engine.handle
+    monkeypatch.setattr(engine, 'handle', lambda operation, params: (counts.update([operation]),
+                                                                       handle(operation, params))[1])
+    return counts
+
+
+def _drift(target):
+    table = _get_boto_resource('dynamodb').Table(target)
+    table.put_item(Item={'Artist': 'band3', 'SongTitle': 'song3', 'Length': 1234})
+    table.delete_item(Key={'Artist': 'band7', 'SongTitle': 'song47'})
+    _get_boto_client('dynamodb').batch_write_item(RequestItems={target: [
+        {'PutRequest': {'Item': {'Artist': {'S': 'nobody'}, 'SongTitle': {'S': 'x'}}}}]})
+
+
+def test_diff_and_apply_make_tables_equal(tables):
+    source, target = tables
+    assert not dynamodb_sync.diff_tables(source, target)
+    _drift(target)
+    diff = dynamodb_sync.diff_tables(source, target)
+    assert (len(diff.puts), len(diff.deletes), diff.differing_partitions) == (2, 1, 3)
+    dynamodb_sync.apply_diff(diff)
+    assert not dynamodb_sync.diff_tables(source, target)
+    assert _get_boto_resource('dynamodb').Table(target).get_item(
+        Key={'Artist': 'band7', 'SongTitle': 'song47'})['Item']['Tags'] == {'a', 't2'}
+
+
+def test_rerun_reads_only_the_tracked_partitions(tables, operations, tmp_path):
+    source, target = tables
+    checkpoint = str(tmp_path / 'sync.json')
+    dynamodb_sync.track_changes(checkpoint)
+    assert dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint).full_scan
+    _drift(target)
+    operations.clear()
+    diff = dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    # Three changed partitions, each read once per table; nothing is scanned or read twice.
+    assert not diff.full_scan and operations['Scan'] == 0 and operations['Query'] == diff.partitions_read == 6
+    assert (len(diff.puts), len(diff.deletes), diff.differing_partitions) == (2, 1, 3)
+    dynamodb_sync.apply_diff(diff)
+    operations.clear()
+    diff = dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    assert not diff and operations['Scan'] == 0
+    operations.clear()
+    diff = dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    assert not diff and operations['Scan'] == operations['Query'] == 0
+
+
+def test_untracked_writes_need_a_full_diff(tables, tmp_path):
+    source, target = tables
+    checkpoint = str(tmp_path / 'sync.json')
+    dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    _drift(target)
+    assert not dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    diff = dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint, full=True)
+    assert diff.full_scan and diff.differing_partitions == 3
+
+
+def test_checkpoint_of_other_settings_is_not_used(tables, tmp_path):
+    source, target = tables
+    checkpoint = str(tmp_path / 'sync.json')
+    dynamodb_sync.diff_tables(source, target, checkpoint=checkpoint)
+    assert dynamodb_sync.diff_tables(source, target, buckets=64, checkpoint=checkpoint).full_scan
+    assert dynamodb_sync.diff_tables(target, source, buckets=64, checkpoint=checkpoint).full_scan
+
+
+def test_number_keys_have_one_form():
+    assert dynamodb_sync._typed_key({'N': '1.50'}) == dynamodb_sync._typed_key({'N': '15E-1'}) == ('N', '1.5')
+    assert dynamodb_sync._typed_key({'N': '1E+2'}) == ('N', '100')
+    assert dynamodb_sync._typed_hash_key(decimal.Decimal('100.0')) == ('N', '100')
+    big = '1234567890123456789012345678901234567.8'
+    assert dynamodb_sync._typed_key({'N': big}) == ('N', big)
@@ -0,0 +1,32 @@
+import contextlib
+import io
+
+import pytest
+
+import dynamodb
+import dynamodb_waiter
+from dynamodb_waiter import WaitTimeout, get_status, wait_for
+from my_aws_py_base import _get_boto_resource
+
+
+def test_wait_for_tables_and_indexes(music_table):
+    description = dynamodb_waiter.describe_table(music_table)
+    assert get_status(description) == 'ACTIVE'
+    index_name = f'{music_table}-Length-global-secondary-index'
+    assert get_status(description, index_name) == 'ACTIVE'
+    assert get_status(dynamodb_waiter.describe_table('missing')) is None
+    wait_for([(music_table, None, 'table_exists'), (music_table, index_name, 'active'), (music_table, 'missing-index', 'not_exists'),
+              ('missing', None, 'table_not_exists')], verbose=False)
+
+
+def test_wait_for_times_out(music_table):
+    with pytest.raises(WaitTimeout):
+        wait_for([('missing', None, 'table_exists')], timeout=0.2, verbose=False)
+
+
+def test_show_index_status_accepts_a_table_alias(music_table):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        dynamodb.show_global_secondary_index_status(table_name='missing',
+                                                    table=_get_boto_resource('dynamodb').Table(music_table))
+    assert out.getvalue() == 'Index status: ACTIVE\n'
@@ -0,0 +1,90 @@
+import contextlib
+import io
+
+import pytest
+
+import dynamodb
+import dynamodb_writebehind
+from dynamodb_writebehind import WriteBehindBuffer, WriteBehindError, get_write_behind, write_behind
+from my_aws_py_base import _get_boto_resource
+
+KEY = {'Artist': 'hot', 'SongTitle': 'song'}
+
+
+@pytest.fixture
+def table(music_table):
+    yield _get_boto_resource('dynamodb').Table(music_table)
+    dynamodb_writebehind.disable_write_behind()
+
+
+def _failing(monkeypatch, failures):
+    '''
+    Make the first `failures` UpdateItem calls of the buffer fail; returns the list of calls.
+    '''
+    calls = []
+    update = dynamodb_writebehind._update_entry
+
+    def flaky(entry):
+        calls.append(dict(entry.values))
+        return RuntimeError('boom') if len(calls) <= failures else update(entry)
+
+    monkeypatch.setattr(dynamodb_writebehind, '_update_entry', flaky)
+    return calls
+
+
+def test_updates_to_one_key_are_coalesced(table, monkeypatch):
+    calls = _failing(monkeypatch, 0)
+    buffer = WriteBehindBuffer(max_delay=60)
+    for value in range(50):
+        buffer.update(table.name, KEY, {'Length': value})
+    assert buffer.get(table.name, KEY, lambda: None)['Length'] == 49
+    buffer.close()
+    assert calls == [{'Length': 49}]
+    assert table.get_item(Key=KEY)['Item']['Length'] == 49
+
+
+def test_failed_writes_are_buffered_again(table, monkeypatch):
+    calls = _failing(monkeypatch, 1)
+    buffer = WriteBehindBuffer(max_delay=60)
+    buffer.update(table.name, KEY, {'Length': 1})
+    buffer.flush()
+    assert len(calls) == 2 and buffer.stats()['retries'] == 1
+    assert table.get_item(Key=KEY)['Item']['Length'] == 1
+    buffer.close()
+
+
+def test_retry_keeps_later_writes_on_top(table, monkeypatch):
+    calls = _failing(monkeypatch, 1)
+    buffer = WriteBehindBuffer(max_delay=60)
+    buffer.update(table.name, KEY, {'Length': 1, 'Awards': 1})
+    buffer._flush_safely()
+    buffer.update(table.name, KEY, {'Length': 2})
+    buffer.close()
+    assert calls[-1] == {'Length': 2, 'Awards': 1}
+
+
+def test_writes_given_up_on_are_returned(table, monkeypatch):
+    _failing(monkeypatch, 100)
+    buffer = WriteBehindBuffer(max_delay=60, max_retries=2)
+    buffer.update(table.name, KEY, {'Length': 5})
+    with pytest.raises(WriteBehindError) as raised:
+        buffer.close()
+    assert raised.value.failed == [(table.name, None, {'Length': 5})]
+    assert 'Item' not in table.get_item(Key=KEY)
+
+
+def test_write_behind_is_scoped(table):
+    with write_behind(max_delay=60) as buffer:
+        assert get_write_behind() is buffer
+    assert get_write_behind() is None
+    enabled = dynamodb_writebehind.enable_write_behind(max_delay=60)
+    with write_behind() as buffer:
+        assert buffer is enabled
+    assert get_write_behind() is enabled
+
+
+def test_update_hot_item_leaves_writes_synchronous(table):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        dynamodb.update_hot_item(times=20, table_name=table.name)
+    assert get_write_behind() is None
+    assert "'items_written': 1" in out.getvalue()